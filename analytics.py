@@ -0,0 +1,224 @@
+from __future__ import annotations
+from typing import Iterable, Iterator, TextIO
+
+import gzip
+import json
+import sys
+from collections import Counter
+from itertools import islice
+from multiprocessing import Pool
+
+CHUNK_SIZE = 10_000
+
+
+class Distribution:
+    """Mergeable count, sum, extremes and fixed-width histogram of a value."""
+    def __init__(self, bin_width: float) -> None:
+        self.bin_width = bin_width
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.min: float | None = None
+        self.max: float | None = None
+        self.bins: Counter[int] = Counter()
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.total_sq += value * value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.bins[int(value // self.bin_width)] += 1
+
+    def merge(self, other: Distribution) -> None:
+        if other.bin_width != self.bin_width:
+            raise ValueError("Cannot merge distributions with different bin widths.")
+        self.count += other.count
+        self.total += other.total
+        self.total_sq += other.total_sq
+        for bound in (other.min, other.max):
+            if bound is not None:
+                self.min = bound if self.min is None else min(self.min, bound)
+                self.max = bound if self.max is None else max(self.max, bound)
+        self.bins.update(other.bins)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def std(self) -> float:
+        if not self.count:
+            return 0.0
+        return max(0.0, self.total_sq / self.count - self.mean**2) ** 0.5
+
+    def quantile(self, q: float) -> float:
+        """Approximate quantile, as the lower edge of the histogram bin."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for b in sorted(self.bins):
+            seen += self.bins[b]
+            if seen >= target:
+                return b * self.bin_width
+        return self.max or 0.0
+
+
+class GameStats:
+    """Aggregate over the games of one policy."""
+    def __init__(self, score_bin: float = 1000, move_bin: float = 100) -> None:
+        self.games = 0
+        self.wins = 0
+        self.score = Distribution(score_bin)
+        self.moves = Distribution(move_bin)
+        self.win_moves = Distribution(move_bin)
+        self.win_time = Distribution(0.1)
+        self.max_tiles: Counter[int] = Counter()
+
+    def add(self, record: dict) -> None:
+        self.games += 1
+        self.score.add(record["score"])
+        self.moves.add(record["moves"])
+        self.max_tiles[record["max_tile"]] += 1
+        if record.get("win_move") is not None:
+            self.wins += 1
+            self.win_moves.add(record["win_move"])
+            if record.get("win_time") is not None:
+                self.win_time.add(record["win_time"])
+
+    def merge(self, other: GameStats) -> None:
+        self.games += other.games
+        self.wins += other.wins
+        self.score.merge(other.score)
+        self.moves.merge(other.moves)
+        self.win_moves.merge(other.win_moves)
+        self.win_time.merge(other.win_time)
+        self.max_tiles.update(other.max_tiles)
+
+
+type Summary = dict[str, GameStats]
+
+
+def merge_summaries(summaries: Iterable[Summary]) -> Summary:
+    merged: Summary = {}
+    for summary in summaries:
+        for policy, stats in summary.items():
+            if policy in merged:
+                merged[policy].merge(stats)
+            else:
+                merged[policy] = stats
+    return merged
+
+
+def _open(path: str) -> TextIO:
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt")
+    return open(path, "r")
+
+
+def read_chunks(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[list[dict]]:
+    """Stream result records from a JSON lines file, chunk_size at a time."""
+    with _open(path) as fin:
+        lines = (line for line in fin if line.strip())
+        while chunk := list(islice(lines, chunk_size)):
+            yield [json.loads(line) for line in chunk]
+
+
+def summarize_file(
+    path: str, chunk_size: int = CHUNK_SIZE, score_bin: float = 1000, move_bin: float = 100
+) -> Summary:
+    """Aggregate one result file with memory bounded by chunk_size."""
+    summary: Summary = {}
+    for chunk in read_chunks(path, chunk_size):
+        for record in chunk:
+            policy = record.get("policy", "unknown")
+            if policy not in summary:
+                summary[policy] = GameStats(score_bin, move_bin)
+            summary[policy].add(record)
+    return summary
+
+
+def _summarize_args(args: tuple[str, int, float, float]) -> Summary:
+    return summarize_file(*args)
+
+
+def summarize(
+    paths: list[str],
+    workers: int = 1,
+    chunk_size: int = CHUNK_SIZE,
+    score_bin: float = 1000,
+    move_bin: float = 100,
+) -> Summary:
+    """Aggregate many result files, one file per worker process at a time."""
+    jobs = [(path, chunk_size, score_bin, move_bin) for path in paths]
+    if workers <= 1 or len(paths) <= 1:
+        return merge_summaries(map(_summarize_args, jobs))
+    with Pool(min(workers, len(paths))) as pool:
+        return merge_summaries(pool.imap_unordered(_summarize_args, jobs))
+
+
+def _histogram(dist: Distribution, fout: TextIO, width: int = 40) -> None:
+    if not dist.count:
+        return
+    peak = max(dist.bins.values())
+    for b in sorted(dist.bins):
+        count = dist.bins[b]
+        low = b * dist.bin_width
+        bar = "#" * max(1, round(width * count / peak))
+        print(f"  {low:>10g} {count:>8} {bar}", file=fout)
+
+
+def print_summary(summary: Summary, fout: TextIO = sys.stdout, histograms: bool = True) -> None:
+    """Print per-policy comparison and distribution tables."""
+    print(
+        f"{'policy':<12}{'games':>8}{'win %':>8}{'mean':>10}{'std':>10}"
+        f"{'median':>10}{'max':>10}{'moves':>9}{'to 2048':>9}{'s to 2048':>11}",
+        file=fout,
+    )
+    for policy in sorted(summary):
+        s = summary[policy]
+        win_rate = 100 * s.wins / s.games if s.games else 0.0
+        to_win = f"{s.win_moves.mean:.0f}" if s.win_moves.count else "-"
+        time_to_win = f"{s.win_time.mean:.2f}" if s.win_time.count else "-"
+        print(
+            f"{policy:<12}{s.games:>8}{win_rate:>8.1f}{s.score.mean:>10.0f}{s.score.std:>10.0f}"
+            f"{s.score.quantile(0.5):>10.0f}{s.score.max or 0:>10.0f}{s.moves.mean:>9.0f}{to_win:>9}"
+            f"{time_to_win:>11}",
+            file=fout,
+        )
+
+    for policy in sorted(summary):
+        s = summary[policy]
+        print(f"\n{policy}: max tile frequency", file=fout)
+        for tile in sorted(s.max_tiles):
+            print(f"  {tile:>10} {s.max_tiles[tile]:>8} {100 * s.max_tiles[tile] / s.games:>6.1f}%", file=fout)
+        if histograms:
+            print(f"{policy}: score histogram", file=fout)
+            _histogram(s.score, fout)
+            print(f"{policy}: moves to 2048", file=fout)
+            _histogram(s.win_moves, fout)
+            print(f"{policy}: seconds to 2048", file=fout)
+            _histogram(s.win_time, fout)
+
+
+def main(argv: list[str] | None = None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Summarize self-play result files")
+    parser.add_argument("paths", nargs="+", help="JSON lines result files (.gz allowed)")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--score-bin", type=float, default=1000)
+    parser.add_argument("--move-bin", type=float, default=100)
+    parser.add_argument("--no-histograms", action="store_true")
+    args = parser.parse_args(argv)
+
+    summary = summarize(args.paths, args.workers, args.chunk_size, args.score_bin, args.move_bin)
+    print_summary(summary, histograms=not args.no_histograms)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+from __future__ import annotations
+from typing import Mapping
+
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+
+from gamestate import Action, Grid, GRID_SIZE
+
+# A board is packed into a 64-bit int of 16 nibbles, each holding the base-2
+# exponent of its tile (0 for empty). Cell (i, j) lives at bits 4 * (4i + j),
+# so row i is the 16-bit value (board >> 16i) & 0xFFFF with column j in its
+# j-th nibble. Tiles up to 32768 (exponent 15) are representable.
+type Board = int
+type Row = int
+
+ROW_MASK = 0xFFFF
+COL_MASK = 0x000F000F000F000F
+MAX_EXPONENT = 15
+ROW_COUNT = 1 << 16
+CACHE_SIZE = 1 << 16
+
+
+def row_cells(row: Row) -> list[int]:
+    """Unpack a 16-bit row into its four exponents."""
+    return [(row >> (4 * j)) & 0xF for j in range(GRID_SIZE)]
+
+
+def cells_row(cells: list[int]) -> Row:
+    """Pack four exponents into a 16-bit row."""
+    row = 0
+    for j, cell in enumerate(cells):
+        row |= cell << (4 * j)
+    return row
+
+
+def _slide_left(cells: list[int]) -> tuple[list[int], int]:
+    """Slide and merge exponents towards index 0, returning cells and score."""
+    result = []
+    score = 0
+    prev = 0
+    for cell in cells:
+        if cell == 0:
+            continue
+        if prev == cell and cell < MAX_EXPONENT:
+            result.append(cell + 1)
+            score += 1 << (cell + 1)
+            prev = 0
+        else:
+            if prev:
+                result.append(prev)
+            prev = cell
+    if prev:
+        result.append(prev)
+    return result + [0] * (GRID_SIZE - len(result)), score
+
+
+def _reverse_row(row: Row) -> Row:
+    return (
+        ((row & 0xF) << 12)
+        | ((row & 0xF0) << 4)
+        | ((row >> 4) & 0xF0)
+        | ((row >> 12) & 0xF)
+    )
+
+
+def _build_tables() -> tuple[list[Row], list[Row], list[int]]:
+    left = [0] * ROW_COUNT
+    right = [0] * ROW_COUNT
+    score = [0] * ROW_COUNT
+    for row in range(ROW_COUNT):
+        cells, gain = _slide_left(row_cells(row))
+        moved = cells_row(cells)
+        left[row] = moved
+        right[_reverse_row(row)] = _reverse_row(moved)
+        score[row] = gain
+    return left, right, score
+
+
+ROW_LEFT, ROW_RIGHT, ROW_SCORE = _build_tables()
+
+
+def pack(grid: Grid) -> Board:
+    """Pack a GameState grid into a board."""
+    board = 0
+    for i in range(GRID_SIZE):
+        for j in range(GRID_SIZE):
+            tile = grid[i][j]
+            if tile:
+                exponent = tile.bit_length() - 1
+                if tile != 1 << exponent or exponent > MAX_EXPONENT:
+                    raise ValueError(f"Tile {tile} cannot be packed.")
+                board |= exponent << (4 * (GRID_SIZE * i + j))
+    return board
+
+
+def unpack(board: Board) -> Grid:
+    """Unpack a board into a GameState grid."""
+    grid: Grid = []
+    for i in range(GRID_SIZE):
+        row = (board >> (16 * i)) & ROW_MASK
+        grid.append([1 << cell if cell else 0 for cell in row_cells(row)])
+    return grid
+
+
+def transpose(board: Board) -> Board:
+    """Swap rows and columns."""
+    a1 = board & 0xF0F00F0FF0F00F0F
+    a2 = board & 0x0000F0F00000F0F0
+    a3 = board & 0x0F0F00000F0F0000
+    a = a1 | (a2 << 12) | (a3 >> 12)
+    b1 = a & 0xFF00FF0000FF00FF
+    b2 = a & 0x00FF00FF00000000
+    b3 = a & 0x00000000FF00FF00
+    return b1 | (b2 >> 24) | (b3 << 24)
+
+
+def mirror(board: Board) -> Board:
+    """Reverse the order of columns."""
+    return (
+        ((board & 0x000F000F000F000F) << 12)
+        | ((board & 0x00F000F000F000F0) << 4)
+        | ((board >> 4) & 0x00F000F000F000F0)
+        | ((board >> 12) & 0x000F000F000F000F)
+    )
+
+
+def flip(board: Board) -> Board:
+    """Reverse the order of rows."""
+    return (
+        ((board & 0xFFFF) << 48)
+        | ((board & 0xFFFF0000) << 16)
+        | ((board >> 16) & 0xFFFF0000)
+        | (board >> 48)
+    )
+
+
+def symmetries(board: Board) -> list[Board]:
+    """All eight rotations and reflections of a board."""
+    m = mirror(board)
+    f = flip(board)
+    mf = flip(m)
+    result = [board, m, f, mf]
+    return result + [transpose(b) for b in result]
+
+
+def canonical(board: Board) -> Board:
+    """Smallest packed board among the symmetries of board."""
+    return min(symmetries(board))
+
+
+def canonical_index(board: Board) -> tuple[Board, int]:
+    """Canonical board and the index of the symmetry that produced it."""
+    variants = symmetries(board)
+    best = min(variants)
+    return best, variants.index(best)
+
+
+def _symmetry_actions() -> list[dict[Action, Action]]:
+    # Symmetry s mirrors columns if s & 1, flips rows if s & 2 and then
+    # transposes if s & 4, in the order of symmetries()
+    swap_columns = {Action.LEFT: Action.RIGHT, Action.RIGHT: Action.LEFT}
+    swap_rows = {Action.UP: Action.DOWN, Action.DOWN: Action.UP}
+    swap_axes = {
+        Action.LEFT: Action.UP,
+        Action.UP: Action.LEFT,
+        Action.RIGHT: Action.DOWN,
+        Action.DOWN: Action.RIGHT,
+    }
+    tables = []
+    for s in range(8):
+        table = {}
+        for action in Action:
+            mapped = action
+            if s & 1:
+                mapped = swap_columns.get(mapped, mapped)
+            if s & 2:
+                mapped = swap_rows.get(mapped, mapped)
+            if s & 4:
+                mapped = swap_axes[mapped]
+            table[action] = mapped
+        tables.append(table)
+    return tables
+
+
+# SYMMETRY_ACTIONS[s][a] is the action on symmetries(board)[s] that matches a on board
+SYMMETRY_ACTIONS = _symmetry_actions()
+
+
+def _move_rows(board: Board, table: list[Row]) -> tuple[Board, int]:
+    r0 = board & ROW_MASK
+    r1 = (board >> 16) & ROW_MASK
+    r2 = (board >> 32) & ROW_MASK
+    r3 = board >> 48
+    moved = table[r0] | (table[r1] << 16) | (table[r2] << 32) | (table[r3] << 48)
+    return moved, ROW_SCORE[r0] + ROW_SCORE[r1] + ROW_SCORE[r2] + ROW_SCORE[r3]
+
+
+def move(board: Board, action: Action) -> tuple[Board, int]:
+    """Apply an action, returning the new board and score gained."""
+    match action:
+        case Action.LEFT:
+            return _move_rows(board, ROW_LEFT)
+        case Action.RIGHT:
+            return _move_rows(board, ROW_RIGHT)
+        case Action.UP:
+            moved, score = _move_rows(transpose(board), ROW_LEFT)
+            return transpose(moved), score
+        case Action.DOWN:
+            moved, score = _move_rows(transpose(board), ROW_RIGHT)
+            return transpose(moved), score
+    raise ValueError(f"Unknown action {action}.")
+
+
+def possible_moves(board: Board) -> dict[Action, tuple[Board, int]]:
+    """Results of every action that changes the board."""
+    result = {}
+    for action in (Action.LEFT, Action.RIGHT):
+        moved, score = _move_rows(board, ROW_LEFT if action == Action.LEFT else ROW_RIGHT)
+        if moved != board:
+            result[action] = (moved, score)
+    t = transpose(board)
+    for action in (Action.UP, Action.DOWN):
+        moved, score = _move_rows(t, ROW_LEFT if action == Action.UP else ROW_RIGHT)
+        if moved != t:
+            result[action] = (transpose(moved), score)
+    return result
+
+
+type Successors = Mapping[Action, tuple[Board, int]]
+
+
+class SuccessorCache:
+    """
+    Bounded LRU cache of possible_moves results keyed by packed board.
+
+    Results are read-only mappings of (board, score) int pairs, so one cached
+    result can be handed to every caller without copying. It pays off where
+    the same positions come back: hint and review roots, tablebase lookups.
+    Search interiors and self-play games almost never revisit a board and
+    call possible_moves directly. The render and engine threads share one
+    cache, so lookups and updates of the LRU order hold a lock.
+    """
+    def __init__(self, max_entries: int = CACHE_SIZE) -> None:
+        self.max_entries = max_entries
+        self.entries: OrderedDict[Board, Successors] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, board: Board) -> Successors:
+        entries = self.entries
+        with self.lock:
+            result = entries.get(board)
+            if result is not None:
+                self.hits += 1
+                entries.move_to_end(board)
+                return result
+            self.misses += 1
+        # Computed outside the lock; a racing miss on the same board stores an equal result
+        result = MappingProxyType(possible_moves(board))
+        with self.lock:
+            entries[board] = result
+            if len(entries) > self.max_entries:
+                entries.popitem(last=False)
+        return result
+
+    __call__ = get
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def info(self) -> dict[str, float]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.entries),
+            "max_entries": self.max_entries,
+            "hit_rate": self.hit_rate,
+        }
+
+
+# Shared by hint, analysis and GUI code that revisits the same positions
+successor_cache = SuccessorCache()
+
+
+def empty_cells(board: Board) -> list[int]:
+    """Indices of empty cells, where index k is cell (k // 4, k % 4)."""
+    return [k for k in range(16) if not (board >> (4 * k)) & 0xF]
+
+
+def count_empty(board: Board) -> int:
+    # Fold each nibble to a single "non-zero" bit, then count.
+    x = board | (board >> 1)
+    x |= x >> 2
+    return 16 - (x & 0x1111111111111111).bit_count()
+
+
+def place(board: Board, index: int, exponent: int) -> Board:
+    """Place a tile of the given exponent at a cell index."""
+    return board | (exponent << (4 * index))
+
+
+def max_exponent(board: Board) -> int:
+    best = 0
+    while board:
+        cell = board & 0xF
+        if cell > best:
+            best = cell
+        board >>= 4
+    return best
+
+
+def is_over(board: Board) -> bool:
+    """True if no action changes the board."""
+    # Any tile plus any empty cell always leaves a move; the empty board has none
+    if board and count_empty(board):
+        return False
+    return not possible_moves(board)
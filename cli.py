@@ -1,28 +1,202 @@
-from gamestate import GameState, GameStatus, Action
-
-run = True
-
-game_state = GameState()
-
-while run:
-    print("Welcome to 2048! Move by typing [UP, DOWN, LEFT, RIGHT] or [W, A, S, D].")
-    while game_state.status == GameStatus.RUN:
-        print("")
-        game_state.print()
-        move = input("Move: ")
-        match move.strip().upper():
-            case "UP" | "W":
-                game_state.step(Action.UP)
-            case "LEFT" | "A":
-                game_state.step(Action.LEFT)
-            case "DOWN" | "S":
-                game_state.step(Action.DOWN)
-            case "RIGHT" | "D":
-                game_state.step(Action.RIGHT)
-            case "HELP" | "H":
-                print("Move by typing [UP, DOWN, LEFT, RIGHT] or [W, A, S, D].")
-            case _:
-                print("Invalid move.")
-    replay = input("\nWould you like to play again? (Y/N): ")
-    if replay.strip().upper() == "N":
-        run = False
\ No newline at end of file
+from __future__ import annotations
+from typing import BinaryIO, Iterator, TextIO
+
+import argparse
+import sys
+import time
+
+from gamestate import GameState, GameStatus, Action, WIN_TILE
+from rng import RNG_KINDS, make_rng
+
+WORD_ACTIONS = {
+    b"UP": Action.UP,
+    b"W": Action.UP,
+    b"LEFT": Action.LEFT,
+    b"A": Action.LEFT,
+    b"DOWN": Action.DOWN,
+    b"S": Action.DOWN,
+    b"RIGHT": Action.RIGHT,
+    b"D": Action.RIGHT,
+}
+# Compact move strings as written by selfplay.py
+CODE_ACTIONS = {
+    ord("L"): Action.LEFT,
+    ord("R"): Action.RIGHT,
+    ord("U"): Action.UP,
+    ord("D"): Action.DOWN,
+}
+READ_SIZE = 1 << 20
+
+
+def interactive(game_state: GameState, quiet: bool = False) -> None:
+    run = True
+    while run:
+        print("Welcome to 2048! Move by typing [UP, DOWN, LEFT, RIGHT] or [W, A, S, D].")
+        while game_state.status != GameStatus.END:
+            print("")
+            if quiet:
+                print(f"Score: {game_state.score}")
+            else:
+                game_state.print()
+            previous = game_state.status
+            move = input("Move: ")
+            match move.strip().upper():
+                case "UP" | "W":
+                    game_state.step(Action.UP)
+                case "LEFT" | "A":
+                    game_state.step(Action.LEFT)
+                case "DOWN" | "S":
+                    game_state.step(Action.DOWN)
+                case "RIGHT" | "D":
+                    game_state.step(Action.RIGHT)
+                case "HELP" | "H":
+                    print("Move by typing [UP, DOWN, LEFT, RIGHT] or [W, A, S, D].")
+                case _:
+                    print("Invalid move.")
+            if previous == GameStatus.RUN and game_state.status == GameStatus.WIN:
+                print(f"You reached {WIN_TILE} in {game_state.moves} moves! Keep going.")
+        replay = input("\nWould you like to play again? (Y/N): ")
+        if replay.strip().upper() == "N":
+            run = False
+        else:
+            game_state.reset()
+
+
+def read_moves(
+    fin: BinaryIO, fmt: str = "words", block_size: int = READ_SIZE
+) -> Iterator[Action | None]:
+    """
+    Parse moves from a binary stream in large blocks.
+
+    With fmt "words" moves are whitespace separated words as typed in
+    interactive mode; with "codes" every L/R/U/D character is a move. Tokens
+    that are not moves are yielded as None.
+    """
+    carry = b""
+    while True:
+        block = fin.read(block_size)
+        if not block:
+            break
+        if fmt == "codes":
+            for byte in block:
+                if byte in CODE_ACTIONS:
+                    yield CODE_ACTIONS[byte]
+                elif not chr(byte).isspace():
+                    yield None
+            continue
+        block = carry + block
+        tokens = block.split()
+        # The last token may continue in the next block
+        carry = tokens.pop() if tokens and not block[-1:].isspace() else b""
+        for token in tokens:
+            yield WORD_ACTIONS.get(token.upper())
+    if carry:
+        yield WORD_ACTIONS.get(carry.upper())
+
+
+def _max_tile(game_state: GameState) -> int:
+    return max(max(row) for row in game_state.grid)
+
+
+def batch(
+    game_state: GameState,
+    moves: Iterator[Action | None],
+    fout: TextIO = sys.stdout,
+    quiet: bool = False,
+    checkpoint: int = 0,
+    restart: bool = False,
+) -> dict[str, float]:
+    """Apply a stream of moves, reporting only checkpoints and a summary."""
+    start = time.perf_counter()
+    applied = invalid = ignored = 0
+    games = 1
+    step = game_state.step
+    for move in moves:
+        if game_state.status == GameStatus.END:
+            if not restart:
+                ignored += 1
+                continue
+            games += 1
+            game_state.reset()
+        if move is None:
+            invalid += 1
+            continue
+        step(move)
+        applied += 1
+        if checkpoint and applied % checkpoint == 0:
+            print(
+                f"[{applied}] game {games} move {game_state.moves} "
+                f"score {game_state.score} max {_max_tile(game_state)}",
+                file=fout,
+            )
+            if not quiet:
+                game_state.print(fout)
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        "games": games,
+        "applied": applied,
+        "invalid": invalid,
+        "ignored": ignored,
+        "moves": game_state.moves,
+        "score": game_state.score,
+        "max_tile": _max_tile(game_state),
+        "win_move": game_state.win_move,
+        "elapsed": elapsed,
+    }
+    print(
+        f"Applied {applied} moves ({invalid} invalid, {ignored} after game end) "
+        f"in {elapsed:.3f}s, {applied / elapsed if elapsed else 0:.0f} moves/s",
+        file=fout,
+    )
+    print(
+        f"Games: {games}  Status: {game_state.status.name}  Score: {game_state.score}  "
+        f"Max tile: {summary['max_tile']}  Win move: {game_state.win_move}",
+        file=fout,
+    )
+    if not quiet:
+        game_state.print(fout)
+    return summary
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Play 2048 in the terminal")
+    parser.add_argument(
+        "--batch", action="store_true", help="read moves in bulk instead of prompting"
+    )
+    parser.add_argument("--moves", help="file of moves for batch mode (default stdin)")
+    parser.add_argument(
+        "--format",
+        choices=("words", "codes"),
+        default="words",
+        help="words: UP/W, LEFT/A, ... per token; codes: L/R/U/D characters",
+    )
+    parser.add_argument("--seed", type=int, help="spawn seed for reproducible games")
+    parser.add_argument("--rng", choices=RNG_KINDS, default="random", help="spawn generator")
+    parser.add_argument("--quiet", action="store_true", help="do not print the board")
+    parser.add_argument(
+        "--checkpoint", type=int, default=0, help="report every N applied moves"
+    )
+    parser.add_argument(
+        "--restart", action="store_true", help="start a new game when one ends"
+    )
+    args = parser.parse_args(argv)
+
+    game_state = GameState(rng=make_rng(args.rng, args.seed))
+    if not args.batch:
+        interactive(game_state, args.quiet)
+        return
+
+    fin = open(args.moves, "rb") if args.moves else sys.stdin.buffer
+    fout = open(sys.stdout.fileno(), "w", buffering=READ_SIZE, closefd=False)
+    try:
+        moves = read_moves(fin, args.format)
+        batch(game_state, moves, fout, args.quiet, args.checkpoint, args.restart)
+    finally:
+        fout.flush()
+        if args.moves:
+            fin.close()
+
+
+if __name__ == "__main__":
+    main()
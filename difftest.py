@@ -0,0 +1,265 @@
+from __future__ import annotations
+from typing import Callable, Iterator, Protocol
+
+import sys
+import time
+from multiprocessing import Pool
+from random import Random
+
+import bitboard
+from gamestate import Action, GameState, Grid, GRID_SIZE
+
+type Successors = dict[Action, tuple[Grid, int]]
+
+# Packed boards cap tiles at 32768, so two 32768 tiles cannot merge there.
+# Such boards are generated but not compared, and reported as excluded.
+EXCLUSION = "boards with two 32768 tiles, which packed boards cannot merge"
+
+
+class Engine(Protocol):
+    """Adapter exposing one move implementation on list grids."""
+    name: str
+
+    def successors(self, grid: Grid) -> Successors:
+        """Result grid and score gained for every action that changes the grid."""
+        ...
+
+    def is_over(self, grid: Grid) -> bool: ...
+
+
+class ReferenceEngine:
+    """GameState.get_possible_moves, the behaviour every engine must match."""
+    name = "reference"
+
+    def __init__(self) -> None:
+        self.game_state = GameState(seed=0)
+
+    def successors(self, grid: Grid) -> Successors:
+        self.game_state.set_grid([list(row) for row in grid])
+        self.game_state.score = 0
+        return {
+            action: (state.grid, state.score)
+            for action, state in self.game_state.get_possible_moves().items()
+        }
+
+    def is_over(self, grid: Grid) -> bool:
+        return not self.successors(grid)
+
+
+class BitboardEngine:
+    name = "bitboard"
+
+    def successors(self, grid: Grid) -> Successors:
+        return {
+            action: (bitboard.unpack(board), score)
+            for action, (board, score) in bitboard.possible_moves(bitboard.pack(grid)).items()
+        }
+
+    def is_over(self, grid: Grid) -> bool:
+        return bitboard.is_over(bitboard.pack(grid))
+
+
+class CachedEngine(BitboardEngine):
+    """bitboard.SuccessorCache, small enough that eviction is exercised."""
+    name = "cached"
+
+    def __init__(self) -> None:
+        self.cache = bitboard.SuccessorCache(max_entries=64)
+
+    def successors(self, grid: Grid) -> Successors:
+        board = bitboard.pack(grid)
+        # Ask twice so both the miss and the hit path are compared
+        self.cache(board)
+        return {
+            action: (bitboard.unpack(after), score)
+            for action, (after, score) in self.cache(board).items()
+        }
+
+
+ENGINES: dict[str, Callable[[], Engine]] = {
+    "bitboard": BitboardEngine,
+    "cached": CachedEngine,
+}
+
+
+def random_grid(rng: Random) -> Grid:
+    """Random board with a random density and tile range."""
+    density = rng.random()
+    top = rng.randint(1, 15)
+    grid = [
+        [1 << rng.randint(1, top) if rng.random() < density else 0 for _ in range(GRID_SIZE)]
+        for _ in range(GRID_SIZE)
+    ]
+    return grid
+
+
+def adversarial_grid(rng: Random) -> Grid:
+    """Boards built around merge edge cases: runs, chains, patterns and full boards."""
+    kind = rng.randrange(6)
+    small = [2, 4]
+    match kind:
+        case 0:
+            # Runs of equal tiles, e.g. [2, 2, 2, 2]
+            grid = [[rng.choice(small)] * GRID_SIZE for _ in range(GRID_SIZE)]
+        case 1:
+            # Merge chains such as [4, 2, 2, 4] and [2, 2, 4, 8]
+            grid = [rng.choice([[4, 2, 2, 4], [2, 2, 4, 8], [8, 4, 2, 2], [2, 4, 4, 2]]) for _ in range(GRID_SIZE)]
+        case 2:
+            # Checkerboard: full and stuck
+            grid = [[small[(i + j) % 2] for j in range(GRID_SIZE)] for i in range(GRID_SIZE)]
+        case 3:
+            # Full boards of random tiles up to 32768
+            grid = [[1 << rng.randint(1, 15) for _ in range(GRID_SIZE)] for _ in range(GRID_SIZE)]
+        case 4:
+            # Gaps between equal tiles, e.g. [2, 0, 0, 2]
+            grid = [
+                rng.choice([[2, 0, 0, 2], [0, 4, 0, 4], [8, 0, 8, 8], [0, 0, 0, 16]])
+                for _ in range(GRID_SIZE)
+            ]
+        case _:
+            grid = random_grid(rng)
+    # Transpose half of the boards so vertical moves see the same cases
+    if rng.random() < 0.5:
+        grid = [list(col) for col in zip(*grid)]
+    return grid
+
+
+def is_excluded(grid: Grid) -> bool:
+    """Whether grid falls under EXCLUSION."""
+    return sum(row.count(1 << bitboard.MAX_EXPONENT) for row in grid) >= 2
+
+
+def compare(grid: Grid, reference: Engine, engine: Engine) -> list[str]:
+    """Differences between an engine and the reference on one grid."""
+    expected = reference.successors(grid)
+    result = engine.successors(grid)
+    problems = []
+    if set(expected) != set(result):
+        problems.append(
+            f"legal moves {sorted(a.name for a in result)}, expected {sorted(a.name for a in expected)}"
+        )
+    for action in set(expected) & set(result):
+        if expected[action][0] != result[action][0]:
+            problems.append(f"{action.name} grid {result[action][0]}, expected {expected[action][0]}")
+        if expected[action][1] != result[action][1]:
+            problems.append(f"{action.name} score {result[action][1]}, expected {expected[action][1]}")
+    if engine.is_over(grid) != (not expected):
+        problems.append(f"is_over {engine.is_over(grid)}, expected {not expected}")
+    return problems
+
+
+def _simpler(grid: Grid) -> Iterator[Grid]:
+    """Candidate grids one step simpler: a tile removed or halved."""
+    for i in range(GRID_SIZE):
+        for j in range(GRID_SIZE):
+            if grid[i][j]:
+                for value in (0, grid[i][j] // 2 if grid[i][j] > 2 else None):
+                    if value is None:
+                        continue
+                    candidate = [list(row) for row in grid]
+                    candidate[i][j] = value
+                    yield candidate
+
+
+def shrink(grid: Grid, reference: Engine, engine: Engine) -> Grid:
+    """Greedily simplify a failing grid while it keeps failing."""
+    progress = True
+    while progress:
+        progress = False
+        for candidate in _simpler(grid):
+            if compare(candidate, reference, engine):
+                grid = candidate
+                progress = True
+                break
+    return grid
+
+
+class Failure:
+    def __init__(self, engine: str, grid: Grid, shrunk: Grid, problems: list[str]) -> None:
+        self.engine = engine
+        self.grid = grid
+        self.shrunk = shrunk
+        self.problems = problems
+
+    def __repr__(self) -> str:
+        return f"Failure({self.engine}, {self.shrunk}: {'; '.join(self.problems)})"
+
+
+def check_chunk(
+    seed: int, count: int, engines: list[str], max_failures: int = 10
+) -> tuple[int, int, list[Failure]]:
+    """
+    Check count generated grids against every named engine. Returns the
+    grids generated, how many of them were excluded, and the failures.
+    """
+    rng = Random(seed)
+    reference = ReferenceEngine()
+    instances = [ENGINES[name]() for name in engines]
+    excluded = 0
+    failures: list[Failure] = []
+    for n in range(count):
+        grid = adversarial_grid(rng) if n % 4 == 0 else random_grid(rng)
+        if is_excluded(grid):
+            excluded += 1
+            continue
+        for engine in instances:
+            if compare(grid, reference, engine):
+                shrunk = shrink(grid, reference, engine)
+                failures.append(Failure(engine.name, grid, shrunk, compare(shrunk, reference, engine)))
+                if len(failures) >= max_failures:
+                    return n + 1, excluded, failures
+    return count, excluded, failures
+
+
+def _check_chunk_args(args: tuple[int, int, list[str]]) -> tuple[int, int, list[Failure]]:
+    return check_chunk(*args)
+
+
+def run(
+    boards: int,
+    seed: int = 0,
+    engines: list[str] | None = None,
+    workers: int = 1,
+    chunk: int = 10_000,
+) -> tuple[int, int, list[Failure]]:
+    """
+    Check boards generated grids, split into seeded chunks across workers.
+    Returns the grids generated, how many were excluded, and the failures.
+    """
+    engines = engines or list(ENGINES)
+    jobs = [
+        (seed * 1_000_003 + k, min(chunk, boards - start), engines)
+        for k, start in enumerate(range(0, boards, chunk))
+    ]
+    if workers > 1:
+        with Pool(workers) as pool:
+            results = pool.map(_check_chunk_args, jobs)
+    else:
+        results = list(map(_check_chunk_args, jobs))
+    checked = sum(count for count, _, _ in results)
+    excluded = sum(count for _, count, _ in results)
+    failures = [failure for _, _, chunk_failures in results for failure in chunk_failures]
+    return checked, excluded, failures
+
+
+def main(argv: list[str] | None = None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Differential test of move engines")
+    parser.add_argument("--boards", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--engine", action="append", choices=sorted(ENGINES))
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    checked, excluded, failures = run(args.boards, args.seed, args.engine, args.workers)
+    print(f"Checked {checked} boards in {time.perf_counter() - start:.1f}s")
+    print(f"Excluded {excluded} {EXCLUSION}")
+    for failure in failures:
+        print(failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+from __future__ import annotations
+from typing import BinaryIO
+
+import json
+import mmap
+import os
+import struct
+import sys
+
+import bitboard
+from bitboard import Board
+from gamestate import Action, SPAWN_RATE_4
+from solver import HASH_MULTIPLIER, M64, SPAWN_RATE_2, Hint
+
+OBJECTIVES = ("win", "score")
+MAGIC = b"2048TB\x00\x00"
+VERSION = 1
+# magic, version, objective, target exponent, reserved, slot count, entry count
+HEADER = struct.Struct("<8sIBBHQQ")
+SLOT = struct.Struct("<Qd")
+EMPTY_KEY = 0
+
+
+class ExactSolver:
+    """
+    Exact values of small positions under optimal play.
+
+    A position ends when a tile of target_exponent appears (a win) or no
+    move is possible. With objective "win" a position is worth its
+    probability of winning; with "score" it is worth the expected score still
+    to be gained before the game ends. Values are memoized by canonical board,
+    so the search is only feasible for nearly full boards or low targets.
+    """
+    def __init__(
+        self, target_exponent: int = 11, objective: str = "win", max_states: int = 1_000_000
+    ) -> None:
+        if objective not in OBJECTIVES:
+            raise ValueError(f"Unknown objective: {objective}")
+        self.target_exponent = target_exponent
+        self.objective = objective
+        self.max_states = max_states
+        self.values: dict[Board, float] = {}
+
+    def terminal_value(self, board: Board) -> float | None:
+        """Value of board if the game is already decided, else None."""
+        if bitboard.max_exponent(board) >= self.target_exponent:
+            return 1.0 if self.objective == "win" else 0.0
+        if bitboard.is_over(board):
+            return 0.0
+        return None
+
+    def value(self, board: Board) -> float:
+        """Value of a board with the player to move."""
+        terminal = self.terminal_value(board)
+        if terminal is not None:
+            return terminal
+        key = bitboard.canonical(board)
+        cached = self.values.get(key)
+        if cached is not None:
+            return cached
+        if len(self.values) >= self.max_states:
+            raise MemoryError(f"Exact solve exceeded {self.max_states} positions.")
+        result = max(self.action_values(board).values())
+        self.values[key] = result
+        return result
+
+    def afterstate_value(self, board: Board) -> float:
+        """Expected value of an afterstate over tile spawns."""
+        empty = bitboard.empty_cells(board)
+        total = 0.0
+        for index in empty:
+            total += SPAWN_RATE_2 * self.value(bitboard.place(board, index, 1))
+            total += SPAWN_RATE_4 * self.value(bitboard.place(board, index, 2))
+        return total / len(empty)
+
+    def action_values(self, board: Board) -> dict[Action, float]:
+        """Value of each legal action."""
+        values = {}
+        for action, (after, score) in bitboard.possible_moves(board).items():
+            gain = score if self.objective == "score" else 0
+            if bitboard.max_exponent(after) >= self.target_exponent:
+                values[action] = 1.0 if self.objective == "win" else float(gain)
+            else:
+                values[action] = gain + self.afterstate_value(after)
+        return values
+
+    def solve(self, board: Board) -> float:
+        """Solve a position and every position reachable from it."""
+        limit = sys.getrecursionlimit()
+        # Each move is two frames deep; a filling board bounds the game length
+        sys.setrecursionlimit(max(limit, 100_000))
+        try:
+            return self.value(board)
+        finally:
+            sys.setrecursionlimit(limit)
+
+
+def _slot_index(key: Board, bits: int) -> int:
+    return ((key * HASH_MULTIPLIER) & M64) >> (64 - bits)
+
+
+def write_table(
+    file: BinaryIO, values: dict[Board, float], objective: str, target_exponent: int
+) -> None:
+    """Write solved values as an open-addressing hash table."""
+    bits = 3
+    while (1 << bits) < 2 * len(values):
+        bits += 1
+    slots = 1 << bits
+    data = bytearray(HEADER.size + slots * SLOT.size)
+    HEADER.pack_into(
+        data, 0, MAGIC, VERSION, OBJECTIVES.index(objective), target_exponent, 0, slots, len(values)
+    )
+    for key, value in values.items():
+        if key == EMPTY_KEY:
+            continue
+        i = _slot_index(key, bits)
+        while True:
+            offset = HEADER.size + i * SLOT.size
+            if SLOT.unpack_from(data, offset)[0] == EMPTY_KEY:
+                SLOT.pack_into(data, offset, key, value)
+                break
+            i = (i + 1) & (slots - 1)
+    file.write(data)
+
+
+def save_table(path: str, solver: ExactSolver) -> None:
+    """Atomically write the solver's memoized values to path."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as fout:
+        write_table(fout, solver.values, solver.objective, solver.target_exponent)
+    os.replace(tmp, path)
+
+
+class Tablebase:
+    """Memory-mapped table of exact values keyed by canonical board."""
+    def __init__(self, path: str) -> None:
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, objective, target, _, slots, entries = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a tablebase.")
+        if version != VERSION:
+            raise ValueError(f"Unsupported tablebase version {version}.")
+        self.objective = OBJECTIVES[objective]
+        self.target_exponent = target
+        self.slots = slots
+        self.bits = slots.bit_length() - 1
+        self.entries = entries
+        self._rules = ExactSolver(target, self.objective)
+
+    def __len__(self) -> int:
+        return self.entries
+
+    def get(self, board: Board) -> float | None:
+        """Stored value of a position, or None if it was not solved."""
+        terminal = self._rules.terminal_value(board)
+        if terminal is not None:
+            return terminal
+        return self._stored(board)
+
+    def _stored(self, board: Board) -> float | None:
+        key = bitboard.canonical(board)
+        i = _slot_index(key, self.bits)
+        while True:
+            stored, value = SLOT.unpack_from(self.map, HEADER.size + i * SLOT.size)
+            if stored == key:
+                return value
+            if stored == EMPTY_KEY:
+                return None
+            i = (i + 1) & (self.slots - 1)
+
+    def action_values(self, board: Board) -> dict[Action, float] | None:
+        """
+        Exact value of each legal action, or None unless the position itself
+        was solved. A board that already holds the target tile is past the
+        table's horizon, since play continues after a win.
+        """
+        if bitboard.max_exponent(board) >= self.target_exponent or self._stored(board) is None:
+            return None
+        values = {}
+        for action, (after, score) in bitboard.successor_cache(board).items():
+            gain = score if self.objective == "score" else 0
+            if bitboard.max_exponent(after) >= self.target_exponent:
+                values[action] = 1.0 if self.objective == "win" else float(gain)
+                continue
+            empty = bitboard.empty_cells(after)
+            total = 0.0
+            for index in empty:
+                for exponent, rate in ((1, SPAWN_RATE_2), (2, SPAWN_RATE_4)):
+                    value = self.get(bitboard.place(after, index, exponent))
+                    if value is None:
+                        return None
+                    total += rate * value
+            values[action] = gain + total / len(empty)
+        return values
+
+    def hint(self, board: Board) -> Hint | None:
+        """Optimal action as a Hint, or None if the position is not covered."""
+        values = self.action_values(board)
+        if not values:
+            return None
+        return Hint(max(values, key=values.get), values, 0, 0.0, objective=self.objective)
+
+    def close(self) -> None:
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self) -> Tablebase:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def main(argv: list[str] | None = None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Exact endgame tablebase")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="solve positions and write a table")
+    build.add_argument("table")
+    build.add_argument("--grid", action="append", default=[], help="grid as JSON")
+    build.add_argument("--positions", help="file with one JSON grid per line")
+    build.add_argument("--target", type=int, default=2048, help="winning tile")
+    build.add_argument("--objective", choices=OBJECTIVES, default="win")
+    lookup = sub.add_parser("lookup", help="look up a position")
+    lookup.add_argument("table")
+    lookup.add_argument("grid", help="grid as JSON")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        grids = [json.loads(grid) for grid in args.grid]
+        if args.positions:
+            with open(args.positions) as fin:
+                grids += [json.loads(line) for line in fin if line.strip()]
+        solver = ExactSolver(args.target.bit_length() - 1, args.objective)
+        for grid in grids:
+            print(f"{grid}: {solver.solve(bitboard.pack(grid)):.6f}")
+        save_table(args.table, solver)
+        print(f"Wrote {len(solver.values)} positions to {args.table}")
+    else:
+        board = bitboard.pack(json.loads(args.grid))
+        with Tablebase(args.table) as table:
+            print(f"Value: {table.get(board)}")
+            for action, value in (table.action_values(board) or {}).items():
+                print(f"{action.name}: {value:.6f}")
+
+
+if __name__ == "__main__":
+    main()
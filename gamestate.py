@@ -1,11 +1,12 @@
 from __future__ import annotations
 from typing import TextIO
 
+from array import array
 from collections import deque, defaultdict
 from enum import Enum, auto
-from random import Random
 import sys
-import time
+
+from rng import RandomSpawnRNG, SpawnRNG
 
 type Grid = list[list[int]]
 type ActionMap = dict[Action, NextState]
@@ -36,16 +37,82 @@ class NextState:
 
 SPAWN_RATE_4 = 0.1
 GRID_SIZE = 4
+WIN_TILE = 2048
+WIN_EXPONENT = WIN_TILE.bit_length() - 1
 EMPTY_ROW = [0, 0, 0, 0]
+CELLS = GRID_SIZE * GRID_SIZE
+
+
+class History:
+    """
+    Undo stack kept in flat arrays: per move the grid's tile exponents, the
+    score and the win move (-1 for none), so long histories stay compact and
+    can be saved and loaded as raw bytes.
+    """
+    def __init__(self, maxlen: int | None = None) -> None:
+        self.maxlen = maxlen
+        self.cells = bytearray()
+        self.scores = array("Q")
+        self.win_moves = array("q")
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def append(self, grid: Grid, score: int, win_move: int | None) -> None:
+        if self.maxlen == 0:
+            return
+        self.cells += bytes(tile.bit_length() - 1 if tile else 0 for row in grid for tile in row)
+        self.scores.append(score)
+        self.win_moves.append(-1 if win_move is None else win_move)
+        self.trim()
+
+    def trim(self) -> None:
+        """Drop the oldest entries beyond maxlen."""
+        if self.maxlen is None or len(self.scores) <= self.maxlen:
+            return
+        excess = len(self.scores) - self.maxlen
+        del self.cells[:CELLS * excess]
+        del self.scores[:excess]
+        del self.win_moves[:excess]
+
+    def pop(self) -> tuple[Grid, int, int | None]:
+        cells = self.cells[-CELLS:]
+        del self.cells[-CELLS:]
+        win_move = self.win_moves.pop()
+        grid = [
+            [1 << e if e else 0 for e in cells[i * GRID_SIZE:(i + 1) * GRID_SIZE]]
+            for i in range(GRID_SIZE)
+        ]
+        return grid, self.scores.pop(), None if win_move < 0 else win_move
+
+    def clear(self) -> None:
+        self.cells.clear()
+        del self.scores[:]
+        del self.win_moves[:]
+
+    def copy(self) -> History:
+        history = History(self.maxlen)
+        history.cells[:] = self.cells
+        history.scores = array("Q", self.scores)
+        history.win_moves = array("q", self.win_moves)
+        return history
 
 
 class GameState:
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        seed: int | None = None,
+        rng: SpawnRNG | None = None,
+        max_history: int | None = 0,
+    ) -> None:
         """
-        Create new GameState instance.
+        Create new GameState instance. Games with the same seed, or the same
+        spawn generator state, and moves are identical. Up to max_history
+        moves can be undone, all of them if None.
         """
-        self.generator: Random = Random(time.time())
+        self.rng: SpawnRNG = rng if rng is not None else RandomSpawnRNG(seed)
         self.grid: Grid = [[0 for j in range(GRID_SIZE)] for i in range(GRID_SIZE)]
+        self.history = History(max_history)
         self.reset()
 
     def reset(self) -> None:
@@ -54,17 +121,21 @@ class GameState:
             for j in range(GRID_SIZE):
                 self.grid[i][j] = 0
         self.score = 0
+        self.moves = 0
+        self.win_move: int | None = None
         self.status = GameStatus.RUN
+        self.history.clear()
         self.new_tiles(2)
         self.possible_moves: ActionMap = self.get_possible_moves()
 
     def set_grid(self, grid: Grid) -> None:
         """
-        Set game grid.
+        Set game grid. The undo history belongs to the previous grid and is dropped.
         """
         if len(grid) != GRID_SIZE or len(grid[0]) != GRID_SIZE:
             raise ValueError("Grid must be 4x4.")
         self.grid = grid
+        self.history.clear()
         self.possible_moves = self.get_possible_moves()
 
     def new_tiles(self, count: int = 1) -> None:
@@ -77,21 +148,29 @@ class GameState:
                     free.append((i, j))
 
         for _ in range(count):
-            # Choose empty square; Cache last move to check faster?
-            fid = self.generator.randint(0, len(free) - 1)
+            # Choose empty square and 2 or 4 tile
+            fid, four = self.rng.spawn(len(free), SPAWN_RATE_4)
             i, j = free.pop(fid)
-
-            # 2 or 4 tile
-            if self.generator.random() <= SPAWN_RATE_4:
-                self.grid[i][j] = 4
-            else:
-                self.grid[i][j] = 2
+            self.grid[i][j] = 4 if four else 2
 
     def get_possible_moves(self) -> ActionMap:
         """Gets the result of the current state-action pairs."""
         action_map: ActionMap = {}
 
-        # Fast check if no possible moves:
+        possible = self.possible_directions()
+        if possible[Action.LEFT.value]:
+            action_map[Action.LEFT] = self.move_left()
+        if possible[Action.RIGHT.value]:
+            action_map[Action.RIGHT] = self.move_right()
+        if possible[Action.UP.value]:
+            action_map[Action.UP] = self.move_up()
+        if possible[Action.DOWN.value]:
+            action_map[Action.DOWN] = self.move_down()
+
+        return action_map
+
+    def possible_directions(self) -> list[bool]:
+        """Fast check of which actions change the grid, indexed by Action value."""
         possible = [False] * 4
         for i in range(GRID_SIZE):
             if all(possible):
@@ -119,133 +198,149 @@ class GameState:
                         possible[Action.DOWN.value] = True
                     elif self.grid[i][j] == 0 and prev_r[j]:
                         possible[Action.DOWN.value] = True
+        return possible
 
-        if possible[Action.LEFT.value]:
-            # Left
-            state_left = NextState(self.score, [])
-            for row in self.grid:
-                r = []
-                prev = 0
-                for element in row:
+    def move_left(self) -> NextState:
+        """Slide and merge the current grid to the left."""
+        state_left = NextState(self.score, [])
+        for row in self.grid:
+            r = []
+            prev = 0
+            for element in row:
+                if prev == 0:
+                    prev = element
+                elif prev == element:
+                    r.append(prev + element)
+                    state_left.log_merge(prev)
+                    prev = 0
+                elif element:
+                    r.append(prev)
+                    prev = element
+            if prev:
+                r.append(prev)
+            state_left.grid.append(r + [0] * (GRID_SIZE - len(r)))
+        return state_left
+
+    def move_right(self) -> NextState:
+        """Slide and merge the current grid to the right."""
+        state_right = NextState(self.score, [])
+        for row in self.grid:
+            r = []
+            prev = 0
+            for element in reversed(row):
+                if element:
                     if prev == 0:
                         prev = element
                     elif prev == element:
                         r.append(prev + element)
-                        state_left.log_merge(prev)
-                        prev = 0
-                    elif element:
-                        r.append(prev)
-                        prev = element
-                if prev:
-                    if len(r) and prev == r[-1]:
-                        r[-1] += prev
-                        state_left.log_merge(prev)
-                    else:
-                        r.append(prev)
-                state_left.grid.append(r + [0] * (GRID_SIZE - len(r)))
-            action_map[Action.LEFT] = state_left
-
-        if possible[Action.RIGHT.value]:
-            # Right
-            state_right = NextState(self.score, [])
-            for row in self.grid:
-                r = []
-                prev = 0
-                for element in reversed(row):
-                    if element:
-                        if prev == 0:
-                            prev = element
-                        elif prev == element:
-                            r.append(prev + element)
-                            state_right.log_merge(prev)
-                            prev = 0
-                        else:
-                            r.append(prev)
-                            prev = element
-                if prev:
-                    if len(r) and prev == r[-1]:
-                        r[-1] += prev
                         state_right.log_merge(prev)
+                        prev = 0
                     else:
                         r.append(prev)
-                state_right.grid.append([0] * (GRID_SIZE - len(r)) + list(reversed(r)))
-            action_map[Action.RIGHT] = state_right
+                        prev = element
+            if prev:
+                r.append(prev)
+            state_right.grid.append([0] * (GRID_SIZE - len(r)) + list(reversed(r)))
+        return state_right
 
-        if possible[Action.UP.value]:
-            # Up
-            state_up = NextState(self.score, [])
-            temp = [[], [], [], []]
-            prev = [0, 0, 0, 0]
-            for row in self.grid:
-                for i in range(len(row)):
-                    if prev[i] == 0:
-                        prev[i] = row[i]
-                    elif prev[i] == row[i]:
-                        temp[i].append(prev[i] + row[i])
-                        state_up.log_merge(prev[i])
-                        prev[i] = 0
-                    elif row[i]:
-                        temp[i].append(prev[i])
-                        prev[i] = row[i]
-            for i in range(GRID_SIZE):
-                if prev[i]:
+    def move_up(self) -> NextState:
+        """Slide and merge the current grid upwards."""
+        state_up = NextState(self.score, [])
+        temp = [[], [], [], []]
+        prev = [0, 0, 0, 0]
+        for row in self.grid:
+            for i in range(len(row)):
+                if prev[i] == 0:
+                    prev[i] = row[i]
+                elif prev[i] == row[i]:
+                    temp[i].append(prev[i] + row[i])
+                    state_up.log_merge(prev[i])
+                    prev[i] = 0
+                elif row[i]:
                     temp[i].append(prev[i])
-            # Take from stacks and add to map
-            for i in range(GRID_SIZE):
-                row = [0, 0, 0, 0]
-                for j in range(GRID_SIZE):
-                    if i < len(temp[j]):
-                        row[j] = temp[j][i]
-                state_up.grid.append(row)
-            action_map[Action.UP] = state_up
+                    prev[i] = row[i]
+        for i in range(GRID_SIZE):
+            if prev[i]:
+                temp[i].append(prev[i])
+        # Take from stacks and add to map
+        for i in range(GRID_SIZE):
+            row = [0, 0, 0, 0]
+            for j in range(GRID_SIZE):
+                if i < len(temp[j]):
+                    row[j] = temp[j][i]
+            state_up.grid.append(row)
+        return state_up
 
-        if possible[Action.DOWN.value]:
-            # Down
-            state_down = NextState(self.score, [])
-            temp = [[], [], [], []]
-            prev = [0, 0, 0, 0]
-            for row in reversed(self.grid):
-                for i in range(len(row)):
-                    if prev[i] == 0:
-                        prev[i] = row[i]
-                    elif prev[i] == row[i]:
-                        temp[i].append(prev[i] + row[i])
-                        state_down.log_merge(prev[i])
-                        prev[i] = 0
-                    elif row[i]:
-                        temp[i].append(prev[i])
-                        prev[i] = row[i]
-            for i in range(GRID_SIZE):
-                if prev[i]:
+    def move_down(self) -> NextState:
+        """Slide and merge the current grid downwards."""
+        state_down = NextState(self.score, [])
+        temp = [[], [], [], []]
+        prev = [0, 0, 0, 0]
+        for row in reversed(self.grid):
+            for i in range(len(row)):
+                if prev[i] == 0:
+                    prev[i] = row[i]
+                elif prev[i] == row[i]:
+                    temp[i].append(prev[i] + row[i])
+                    state_down.log_merge(prev[i])
+                    prev[i] = 0
+                elif row[i]:
                     temp[i].append(prev[i])
-            for i in range(GRID_SIZE):
-                row = [0, 0, 0, 0]
-                for j in range(GRID_SIZE):
-                    if GRID_SIZE - len(temp[j]) <= i:
-                        row[j] = temp[j].pop()
-                state_down.grid.append(row)
-            action_map[Action.DOWN] = state_down
-
-        return action_map
+                    prev[i] = row[i]
+        for i in range(GRID_SIZE):
+            if prev[i]:
+                temp[i].append(prev[i])
+        for i in range(GRID_SIZE):
+            row = [0, 0, 0, 0]
+            for j in range(GRID_SIZE):
+                if GRID_SIZE - len(temp[j]) <= i:
+                    row[j] = temp[j].pop()
+            state_down.grid.append(row)
+        return state_down
 
     def step(self, move: Action) -> GameStatus:
         """Transition to the next state given an action."""
         # raise NotImplementedError("GameState.step not implemented.")
         next_state = self.possible_moves.get(move)
         if next_state:
+            self.history.append(self.grid, self.score, self.win_move)
             self.grid = next_state.grid
             self.score = next_state.score
+            self.moves += 1
+            if self.win_move is None and any(
+                tile >= WIN_TILE for row in self.grid for tile in row
+            ):
+                # Play continues after a win until no moves are left
+                self.win_move = self.moves
+                self.status = GameStatus.WIN
             self.new_tiles()
             self.possible_moves = self.get_possible_moves()
             if len(self.possible_moves) == 0:
                 self.status = GameStatus.END
         return self.status
 
+    def undo(self) -> bool:
+        """
+        Return to the position before the last move. Spawns are not rewound,
+        so replaying the move may spawn a different tile.
+        """
+        if not self.history:
+            return False
+        self.grid, self.score, self.win_move = self.history.pop()
+        self.moves = max(self.moves - 1, 0)
+        self.status = GameStatus.RUN if self.win_move is None else GameStatus.WIN
+        self.possible_moves = self.get_possible_moves()
+        return True
+
     def print(self, fout: TextIO = sys.stdout) -> None:
         """Print current state."""
-        print(
-            "In Progress" if self.status == GameStatus.RUN else "Game Over", file=fout
-        )
+        match self.status:
+            case GameStatus.RUN:
+                print("In Progress", file=fout)
+            case GameStatus.WIN:
+                print("You Win!", file=fout)
+            case GameStatus.END:
+                print("Game Over", file=fout)
         print(f"Score: {self.score}", file=fout)
         for row in self.grid:
             print(row, file=fout)
@@ -1,11 +1,19 @@
 from __future__ import annotations
 from typing import Callable
 
-import json
+import threading
+import time
 import pygame
 
-from gamestate import GameState, GameStatus, Action, Grid, GRID_SIZE
+from gamestate import GameState, GameStatus, Action, Grid, GRID_SIZE, WIN_TILE
 from theme import Theme, SIZE
+from profiling import Profiler
+from solver import Hint, Solver
+from endgame import Tablebase
+from openings import OpeningBook
+from review import GameReview, Position, analyze, history_positions
+from worker import AUTOPLAY_STEP, AUTOPLAY_STOPPED, HINT_READY, REVIEW_READY, EngineWorker
+import bitboard
 
 type Coordinate = tuple[int, int]
 
@@ -13,9 +21,9 @@ PADDING_SMALL = 16
 TILE_SIZE = 64
 
 
-def load_theme(fn: str):
+def load_theme(fn: str) -> Theme:
     with open(fn, "r") as fin:
-        return json.load(fin)
+        return Theme.load(fin)
 
 
 class Button:
@@ -166,8 +174,113 @@ class GameOverScreen:
         return global_pos
 
 
+class HintBox:
+    def __init__(self, x: int, y: int, w: int, h: int):
+        self.rect = pygame.Rect(x, y, w, h)
+
+    def draw(
+        self, surface: pygame.Surface, theme: Theme, hint: Hint | None, pending: bool = False
+    ) -> pygame.Rect:
+        if pending:
+            message = "Thinking..."
+        elif hint is None:
+            message = "Press H for a hint"
+        elif hint.action is None:
+            message = "No moves available"
+        elif hint.objective == "win":
+            value = hint.values[hint.action]
+            message = f"Optimal: {hint.action.name} ({value:.1%} win)"
+        elif hint.objective == "score":
+            value = hint.values[hint.action]
+            message = f"Optimal: {hint.action.name} (+{value:.0f} expected)"
+        elif hint.objective == "book":
+            value = hint.values[hint.action]
+            message = f"Book: {hint.action.name} (mean score {value:.0f})"
+        else:
+            message = f"Hint: {hint.action.name} (depth {hint.depth})"
+        text = theme.font_small.render(message, True, theme.dark_text)
+        text_pos = text.get_rect(center=self.rect.center)
+        return surface.blit(text, text_pos)
+
+
+class ReviewPanel:
+    """
+    Review of one move: the verdict above the board and a game summary below
+    it, while the board shows the position the move was played in.
+    """
+    def __init__(self, header: pygame.Rect, footer: pygame.Rect):
+        self.header = header
+        self.footer = footer
+
+    def draw(
+        self, surface: pygame.Surface, theme: Theme, review: GameReview, index: int
+    ) -> pygame.Rect:
+        move = review.moves[index]
+        if move.played == move.best:
+            verdict = "Best move"
+        else:
+            verdict = f"Best {move.best.name}, loss {review.format_loss(move.loss)}"
+        values = "  ".join(f"{action.name[0]} {value:.1f}" for action, value in move.values.items())
+        lines = [f"Move {index + 1}/{len(review)}: {move.played.name} {move.grade}", verdict, values]
+        pygame.draw.rect(surface, theme.board, self.header, border_radius=theme.radius)
+        height = theme.font_small.get_height()
+        y = self.header.centery - len(lines) * height // 2
+        for line in lines:
+            text = theme.font_small.render(line, True, theme.light_text)
+            surface.blit(text, text.get_rect(centerx=self.header.centerx, y=y))
+            y += height
+        summary = theme.font_small.render(
+            f"{review.accuracy:.0%} best moves  {review.count('?')} ?  {review.count('??')} ??",
+            True,
+            theme.dark_text,
+        )
+        surface.blit(summary, summary.get_rect(center=self.footer.center))
+        return self.header.union(self.footer)
+
+
+class ProfilerOverlay:
+    """On-screen frame time and moves/sec readout, counted from the step phase."""
+    def __init__(self, profiler: Profiler, x: int = 0, y: int = 0):
+        self.profiler = profiler
+        self.pos = (x, y)
+        self.moves_per_sec = 0.0
+        self._last_sample = time.perf_counter()
+        self._last_moves = 0
+
+    def _sample(self) -> None:
+        now = time.perf_counter()
+        if now - self._last_sample < 1.0:
+            return
+        stats = self.profiler.stats.get("step")
+        moves = stats.calls if stats else 0
+        self.moves_per_sec = (moves - self._last_moves) / (now - self._last_sample)
+        self._last_moves = moves
+        self._last_sample = now
+
+    def draw(
+        self, surface: pygame.Surface, theme: Theme, frame_time: float, fps: float
+    ) -> pygame.Rect | None:
+        if not self.profiler.enabled:
+            return None
+        self._sample()
+        text = theme.font_small.render(
+            f"{frame_time * 1e3:.1f} ms  {fps:.0f} fps  {self.moves_per_sec:.0f} moves/s",
+            True,
+            theme.dark_text,
+        )
+        return surface.blit(text, self.pos)
+
+
 class GameGUI:
-    def __init__(self, theme: Theme | None = None, tile_size: int = TILE_SIZE):
+    def __init__(
+        self,
+        theme: Theme | None = None,
+        tile_size: int = TILE_SIZE,
+        solver: Solver | None = None,
+        hint_budget: float = 0.2,
+        tablebase: Tablebase | None = None,
+        book: OpeningBook | None = None,
+    ):
         if theme:
             self.theme = theme
         else:
@@ -181,7 +294,21 @@ class GameGUI:
                 font_size_large=tile_size // 2,
             )
 
-        self.game_state = GameState()
+        self.game_state = GameState(max_history=None)
+        self.solver = solver
+        self.hint_budget = hint_budget
+        self.tablebase = tablebase
+        self.book = book
+        self.hint: Hint | None = None
+        self.hint_board: int | None = None
+        # Guards game_state when an EngineWorker steps it from its thread
+        self.lock = threading.RLock()
+        self.worker: EngineWorker | None = None
+        self.pending_board: int | None = None
+        # Game review shown instead of the game, and the move on screen
+        self.review: GameReview | None = None
+        self.review_index = 0
+        self.review_pending = False
 
         self.board = Board(tile_size=tile_size, padding=self.theme.padding_small)
         self.score_board = ScoreBoard(
@@ -213,23 +340,213 @@ class GameGUI:
             onclick=self.game_state.reset,
         )
 
-        self.rect = pygame.Rect(0, 0, self.board.rect.right, self.board.rect.bottom)
+        self.hint_box = HintBox(
+            self.board.rect.x,
+            self.board.rect.bottom,
+            self.board.rect.width,
+            2 * self.theme.font_small.get_height(),
+        )
+
+        self.rect = pygame.Rect(0, 0, self.board.rect.right, self.hint_box.rect.bottom)
+        self.review_panel = ReviewPanel(
+            pygame.Rect(
+                self.board.rect.x,
+                self.theme.padding_small // 2,
+                self.board.rect.width,
+                self.board.rect.top - self.theme.padding_small,
+            ),
+            self.hint_box.rect,
+        )
+
+    def load_position(self, grid: Grid, score: int = 0) -> None:
+        """Continue play from a position, e.g. a game opened from the spectator view."""
+        with self.lock:
+            game_state = self.game_state
+            # Also drops the undo history, which belongs to the previous game
+            game_state.set_grid(grid)
+            game_state.score = score
+            game_state.moves = 0
+            won = any(tile >= WIN_TILE for row in grid for tile in row)
+            game_state.win_move = 0 if won else None
+            if not game_state.possible_moves:
+                game_state.status = GameStatus.END
+            else:
+                game_state.status = GameStatus.WIN if won else GameStatus.RUN
+            self.hint = None
+            self.hint_board = None
+
+    def _current_board(self) -> int | None:
+        try:
+            return bitboard.pack(self.game_state.grid)
+        except ValueError:
+            return None
+
+    def _instant_hint(self, board: int) -> Hint | None:
+        """Answer from the tablebase or the opening book, without searching."""
+        hint = None
+        if self.tablebase is not None:
+            hint = self.tablebase.hint(board)
+        if hint is None and self.book is not None:
+            hint = self.book.hint(board)
+        return hint
+
+    def compute_hint(self, board: int) -> Hint:
+        """Tablebase or opening book answer if there is one, else a timed search."""
+        hint = self._instant_hint(board)
+        if hint is None:
+            if self.solver is None:
+                self.solver = Solver()
+            hint = self.solver.hint(board, self.hint_budget)
+        return hint
+
+    def request_hint(self) -> Hint | None:
+        """
+        Search the current position for the best move. With a worker the
+        search runs in the background and None is returned until it is ready.
+        """
+        board = self._current_board()
+        if board is None:
+            return None
+        if self.worker is not None:
+            hint = self._instant_hint(board)
+            if hint is None:
+                self.pending_board = board
+                self.worker.request_hint(board)
+                return None
+        else:
+            hint = self.compute_hint(board)
+        self.hint = hint
+        self.hint_board = board
+        return self.hint
+
+    def compute_review(self, positions: list[Position]) -> GameReview:
+        """Review every move of a game with the hint solver."""
+        if self.solver is None:
+            self.solver = Solver()
+        return analyze(positions, self.solver)
+
+    def request_review(self) -> GameReview | None:
+        """
+        Review the game so far. With a worker the analysis runs in the
+        background and None is returned until it is ready.
+        """
+        game_state = self.game_state
+        try:
+            positions = history_positions(game_state.history, game_state.grid, game_state.score)
+        except ValueError:
+            return None
+        if not positions:
+            return None
+        if self.worker is not None:
+            self.worker.set_autoplay(False)
+            self.review_pending = True
+            self.worker.request_review(positions)
+            return None
+        self.show_review(self.compute_review(positions))
+        return self.review
+
+    def show_review(self, review: GameReview | None) -> None:
+        self.review = review
+        self.review_index = 0
+
+    def _review_input(self, event: pygame.event.Event) -> None:
+        if event.type != pygame.KEYDOWN:
+            return
+        last = len(self.review) - 1
+        match event.key:
+            case pygame.K_LEFT | pygame.K_UP:
+                self.review_index = max(0, self.review_index - 1)
+            case pygame.K_RIGHT | pygame.K_DOWN:
+                self.review_index = min(last, self.review_index + 1)
+            case pygame.K_HOME:
+                self.review_index = 0
+            case pygame.K_END:
+                self.review_index = last
+            case pygame.K_b:
+                index = self.review.next_blunder(self.review_index)
+                if index is not None:
+                    self.review_index = index
+            case pygame.K_ESCAPE | pygame.K_r:
+                self.show_review(None)
+
+    def current_hint(self) -> Hint | None:
+        """
+        The hint for the position on screen: the last requested hint, or the
+        instant answer when the position is in the tablebase or opening book.
+        """
+        board = self._current_board()
+        if board is None:
+            return None
+        if board != self.hint_board:
+            self.hint = self._instant_hint(board)
+            self.hint_board = board
+        return self.hint
 
     def draw(self, surface: pygame.Surface, theme: Theme) -> pygame.Rect:
+        with self.lock:
+            self._draw(surface, theme)
+
+    def _draw(self, surface: pygame.Surface, theme: Theme) -> None:
         surface.fill(theme.bg)
+        if self.review is not None:
+            move = self.review.moves[self.review_index]
+            self.board.draw(surface, theme, bitboard.unpack(move.board))
+            self.review_panel.draw(surface, theme, self.review, self.review_index)
+            return
         self.newgame_button.draw(surface, theme)
         self.score_board.draw(surface, theme, self.game_state.score)
         self.board.draw(surface, theme, self.game_state.grid)
+        hint = self.current_hint()
+        pending = self.review_pending or (
+            self.pending_board is not None and self.pending_board == self.hint_board
+        )
+        self.hint_box.draw(surface, theme, hint, pending)
         if self.game_state.status == GameStatus.END:
             game_over_pos = self.game_over_screen.draw(surface, theme)
             game_over_pos.y += game_over_pos.h + theme.padding_small
             self.replay_button.rect.center = game_over_pos.center
             self.replay_button.draw(surface, theme)
 
+    def engine_event(self, event: pygame.event.Event) -> None:
+        """Apply a result posted by the EngineWorker."""
+        if event.type == HINT_READY:
+            if event.board == self.pending_board:
+                self.pending_board = None
+            if event.board == self._current_board():
+                self.hint = event.hint
+                self.hint_board = event.board
+        elif event.type == AUTOPLAY_STEP:
+            self._report(event.previous, event.status)
+        elif event.type == AUTOPLAY_STOPPED:
+            print(f"Autoplay stopped after {event.steps} moves.")
+        elif event.type == REVIEW_READY:
+            self.review_pending = False
+            self.show_review(event.review)
+
+    def _report(self, previous: GameStatus, state: GameStatus) -> None:
+        if state == GameStatus.WIN and previous == GameStatus.RUN:
+            print(f"You reached {WIN_TILE}! Your score: {self.game_state.score}")
+        if state == GameStatus.END:
+            print(f"Game Over! Your score: {self.game_state.score}")
+
     def event_handler(self, event: pygame.event.Event) -> None:
-        if self.game_state.status == GameStatus.RUN:
+        if event.type in (HINT_READY, AUTOPLAY_STEP, AUTOPLAY_STOPPED, REVIEW_READY):
+            self.engine_event(event)
+            return
+        with self.lock:
+            self._handle_input(event)
+
+    def _handle_input(self, event: pygame.event.Event) -> None:
+        if self.review is not None:
+            self._review_input(event)
+            return
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_r:
+            self.request_review()
+            return
+        if self.game_state.status in (GameStatus.RUN, GameStatus.WIN):
             if event.type == pygame.KEYDOWN:
                 key: int = event.key
+                previous = state = self.game_state.status
                 match key:
                     case pygame.K_LEFT:
                         # print("left")
@@ -243,10 +560,15 @@ class GameGUI:
                     case pygame.K_DOWN:
                         # print("down")
                         state = self.game_state.step(Action.DOWN)
+                    case pygame.K_h:
+                        self.request_hint()
+                    case pygame.K_u | pygame.K_BACKSPACE:
+                        self.game_state.undo()
+                    case pygame.K_a if self.worker is not None:
+                        self.worker.toggle_autoplay()
                     case _:
                         pass
-                if state == GameStatus.END:
-                    print(f"Game Over! Your score: {self.game_state.score}")
+                self._report(previous, state)
             if event.type == pygame.MOUSEBUTTONDOWN:
                 mouse_button: int = event.button
                 mouse_coor: Coordinate = event.pos
@@ -256,6 +578,9 @@ class GameGUI:
                 ):
                     self.newgame_button.onclick()
         if self.game_state.status == GameStatus.END:
+            if event.type == pygame.KEYDOWN and event.key in (pygame.K_u, pygame.K_BACKSPACE):
+                self.game_state.undo()
+                return
             if event.type == pygame.MOUSEBUTTONDOWN:
                 mouse_button: int = event.button
                 mouse_coor: Coordinate = event.pos
@@ -0,0 +1,172 @@
+from __future__ import annotations
+from typing import Any, Iterable
+
+import numpy as np
+
+from bitboard import Board, ROW_COUNT, ROW_MASK, transpose
+
+FEATURES = ("empty", "monotonicity", "smoothness", "corner_max", "merges")
+
+
+class Weights:
+    """Weights of each heuristic feature, on the tile exponent scale."""
+    def __init__(
+        self,
+        empty: float = 2.7,
+        monotonicity: float = 1.0,
+        smoothness: float = 0.1,
+        corner_max: float = 1.0,
+        merges: float = 0.7,
+    ) -> None:
+        self.empty = empty
+        self.monotonicity = monotonicity
+        self.smoothness = smoothness
+        self.corner_max = corner_max
+        self.merges = merges
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> Weights:
+        unknown = set(data) - set(FEATURES)
+        if unknown:
+            raise ValueError(f"Unknown heuristic features: {sorted(unknown)}")
+        return cls(**{name: float(value) for name, value in data.items()})
+
+    def as_dict(self) -> dict[str, float]:
+        return {name: getattr(self, name) for name in FEATURES}
+
+    def as_array(self) -> np.ndarray:
+        return np.array([getattr(self, name) for name in FEATURES], dtype=np.float64)
+
+
+def _row_features() -> dict[str, np.ndarray]:
+    """Per-row feature tables indexed by 16-bit packed row."""
+    rows = np.arange(ROW_COUNT, dtype=np.int64)
+    cells = np.stack([(rows >> (4 * j)) & 0xF for j in range(4)], axis=1)
+
+    diff = np.diff(cells, axis=1)
+    increasing = np.clip(diff, 0, None).sum(axis=1)
+    decreasing = np.clip(-diff, 0, None).sum(axis=1)
+
+    # Slide non-empty cells to the front so adjacency skips over gaps
+    order = np.argsort(cells == 0, axis=1, kind="stable")
+    packed = np.take_along_axis(cells, order, axis=1)
+    filled = (cells != 0).sum(axis=1)
+    adjacent = np.arange(1, 4)[None, :] < filled[:, None]
+    packed_diff = np.diff(packed, axis=1)
+
+    return {
+        "empty": 4 - filled,
+        "monotonicity": -np.minimum(increasing, decreasing),
+        "smoothness": -np.where(adjacent, np.abs(packed_diff), 0).sum(axis=1),
+        "merges": (adjacent & (packed_diff == 0)).sum(axis=1),
+        "max": cells.max(axis=1),
+    }
+
+
+ROW_FEATURES = _row_features()
+ROW_MAX = ROW_FEATURES["max"]
+_ROW_MAX_LIST: list[int] = ROW_MAX.tolist()
+
+
+def _as_uint64(boards: Iterable[Board] | np.ndarray) -> np.ndarray:
+    if isinstance(boards, np.ndarray):
+        return boards.astype(np.uint64, copy=False)
+    return np.fromiter(boards, dtype=np.uint64)
+
+
+def batch_transpose(boards: np.ndarray) -> np.ndarray:
+    """Vectorized bitboard.transpose over an array of uint64 boards."""
+    u = np.uint64
+    a1 = boards & u(0xF0F00F0FF0F00F0F)
+    a2 = boards & u(0x0000F0F00000F0F0)
+    a3 = boards & u(0x0F0F00000F0F0000)
+    a = a1 | (a2 << u(12)) | (a3 >> u(12))
+    b1 = a & u(0xFF00FF0000FF00FF)
+    b2 = a & u(0x00FF00FF00000000)
+    b3 = a & u(0x00000000FF00FF00)
+    return b1 | (b2 >> u(24)) | (b3 << u(24))
+
+
+def _lines(boards: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Rows and columns of each board as (n, 4) arrays of packed rows."""
+    shifts = np.array([0, 16, 32, 48], dtype=np.uint64)
+    mask = np.uint64(ROW_MASK)
+    rows = ((boards[:, None] >> shifts) & mask).astype(np.intp)
+    cols = ((batch_transpose(boards)[:, None] >> shifts) & mask).astype(np.intp)
+    return rows, cols
+
+
+def batch_features(boards: Iterable[Board] | np.ndarray) -> np.ndarray:
+    """Feature matrix of shape (n, len(FEATURES)) for many boards."""
+    boards = _as_uint64(boards)
+    rows, cols = _lines(boards)
+    out = np.empty((len(boards), len(FEATURES)), dtype=np.float64)
+    out[:, 0] = ROW_FEATURES["empty"][rows].sum(axis=1)
+    for k, name in ((1, "monotonicity"), (2, "smoothness"), (4, "merges")):
+        table = ROW_FEATURES[name]
+        out[:, k] = table[rows].sum(axis=1) + table[cols].sum(axis=1)
+
+    best = ROW_MAX[rows].max(axis=1)
+    nibble = np.uint64(0xF)
+    corners = np.stack(
+        [
+            boards & nibble,
+            (boards >> np.uint64(12)) & nibble,
+            (boards >> np.uint64(48)) & nibble,
+            boards >> np.uint64(60),
+        ],
+        axis=1,
+    ).max(axis=1)
+    out[:, 3] = (best > 0) & (corners.astype(np.int64) == best)
+    return out
+
+
+def features(board: Board) -> dict[str, float]:
+    """Feature values of a single board."""
+    return dict(zip(FEATURES, batch_features([board])[0].tolist()))
+
+
+class Evaluator:
+    """
+    Weighted sum of heuristic features.
+
+    The row and column terms are folded into a single lookup table per weight
+    set, so scoring a single board is eight table lookups plus a corner check.
+    """
+    def __init__(self, weights: Weights | None = None) -> None:
+        self.weights = weights or Weights()
+        w = self.weights
+        # Each empty cell is seen once as part of a row and once as a column
+        line = (
+            0.5 * w.empty * ROW_FEATURES["empty"]
+            + w.monotonicity * ROW_FEATURES["monotonicity"]
+            + w.smoothness * ROW_FEATURES["smoothness"]
+            + w.merges * ROW_FEATURES["merges"]
+        )
+        self._line: list[float] = line.tolist()
+        self._weight_array = w.as_array()
+
+    def __call__(self, board: Board) -> float:
+        line = self._line
+        t = transpose(board)
+        r0 = board & ROW_MASK
+        r1 = (board >> 16) & ROW_MASK
+        r2 = (board >> 32) & ROW_MASK
+        r3 = board >> 48
+        value = (
+            line[r0] + line[r1] + line[r2] + line[r3]
+            + line[t & ROW_MASK]
+            + line[(t >> 16) & ROW_MASK]
+            + line[(t >> 32) & ROW_MASK]
+            + line[t >> 48]
+        )
+        row_max = _ROW_MAX_LIST
+        best = max(row_max[r0], row_max[r1], row_max[r2], row_max[r3])
+        corner = max(board & 0xF, (board >> 12) & 0xF, (board >> 48) & 0xF, board >> 60)
+        if best and corner == best:
+            value += self.weights.corner_max
+        return value
+
+    def batch(self, boards: Iterable[Board] | np.ndarray) -> np.ndarray:
+        """Evaluate many boards at once."""
+        return batch_features(boards) @ self._weight_array
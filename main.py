@@ -2,13 +2,29 @@
 # Date: 2025-04-26
 
 from __future__ import annotations
+import argparse
+import os
+import time
 import pygame
 
 from theme import Theme
-from gui import GameGUI
+from gui import GameGUI, Board, ProfilerOverlay, load_theme
+from profiling import profiler, PeriodicDump
+from solver import Solver, ParallelSolver
+from endgame import Tablebase
+from openings import OpeningBook
+from ntuple import NTupleNetwork
+from selfplay import POLICIES, make_policy
+from worker import EngineWorker
+from spectator import BatchSimulator, SpectatorView
+from session import Autosaver, AUTOSAVE_INTERVAL, Snapshot, load_session, save_session
+import bitboard
 
 TILE_SIZE = 64
 PADDING_SMALL = 16
+FPS = 30
+# Command line options stored with a saved session
+SESSION_SETTINGS = ("hint_budget", "autoplay", "autoplay_speed")
 
 
 class GameInterface:
@@ -17,6 +33,81 @@ class GameInterface:
 
 
 def main():
+    parser = argparse.ArgumentParser(description="2048 practice tool")
+    parser.add_argument(
+        "--profile", action="store_true", help="enable profiling (toggle with F3)"
+    )
+    parser.add_argument(
+        "--profile-interval",
+        type=float,
+        default=5.0,
+        help="seconds between profiler dumps to stdout, 0 to disable",
+    )
+    parser.add_argument(
+        "--hint-budget", type=float, default=0.2, help="seconds to spend on a hint"
+    )
+    parser.add_argument(
+        "--hint-workers",
+        type=int,
+        default=0,
+        help="worker processes for hint search, 0 to search in-process",
+    )
+    parser.add_argument("--tablebase", help="exact endgame table built by endgame.py")
+    parser.add_argument("--book", help="opening book built by openings.py")
+    parser.add_argument(
+        "--evaluator", help="n-tuple weight file trained by ntuple.py, scores hint search leaves"
+    )
+    parser.add_argument(
+        "--autoplay",
+        choices=sorted(POLICIES) + ["hint"],
+        default="expectimax",
+        help="bot used when autoplay is toggled with A",
+    )
+    parser.add_argument(
+        "--autoplay-speed",
+        type=float,
+        default=10.0,
+        help="autoplay moves per second, 0 for as fast as possible",
+    )
+    parser.add_argument("--fps", type=int, default=FPS, help="frame rate limit")
+    parser.add_argument(
+        "--spectate",
+        type=int,
+        default=0,
+        metavar="N",
+        help="watch N bot games at once; click one to open it, Esc to go back",
+    )
+    parser.add_argument(
+        "--spectate-policy", choices=sorted(POLICIES), default="greedy"
+    )
+    parser.add_argument(
+        "--spectate-speed",
+        type=float,
+        default=10.0,
+        help="moves per second in every watched game, 0 for as fast as possible",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first watched game")
+    parser.add_argument("--theme", help="theme JSON file, see theme/default.json")
+    parser.add_argument(
+        "--session", help="save the game here on exit and resume it on the next start"
+    )
+    parser.add_argument(
+        "--autosave-interval",
+        type=float,
+        default=AUTOSAVE_INTERVAL,
+        help="seconds between background session saves, 0 to save only on exit",
+    )
+    args = parser.parse_args()
+
+    snapshot = None
+    if args.session and os.path.exists(args.session):
+        snapshot = load_session(args.session)
+        # Saved settings apply unless given again on the command line
+        parser.set_defaults(
+            **{k: v for k, v in snapshot.settings.items() if k in SESSION_SETTINGS}
+        )
+        args = parser.parse_args()
+
     # pygame setup
     pygame.init()
     pygame.font.init()
@@ -25,38 +116,156 @@ def main():
     running = True
 
     # Game objects
-    theme = Theme(
-        font_size_small=16,
-        font_size_medium=32,
-        font_size_large=64,
-        padding_small=PADDING_SMALL,
+    if args.theme:
+        theme = load_theme(args.theme)
+    elif snapshot and "theme" in snapshot.settings:
+        theme = Theme.from_dict(snapshot.settings["theme"])
+    else:
+        theme = Theme(
+            font_size_small=16,
+            font_size_medium=32,
+            font_size_large=64,
+            padding_small=PADDING_SMALL,
+        )
+    if args.hint_workers > 0:
+        solver = ParallelSolver(workers=args.hint_workers, network=args.evaluator)
+    elif args.evaluator:
+        solver = Solver(evaluator=NTupleNetwork.load(args.evaluator))
+    else:
+        solver = Solver()
+    tablebase = Tablebase(args.tablebase) if args.tablebase else None
+    book = OpeningBook(args.book) if args.book else None
+    gui = GameGUI(
+        theme=theme,
+        tile_size=TILE_SIZE,
+        solver=solver,
+        hint_budget=args.hint_budget,
+        tablebase=tablebase,
+        book=book,
     )
-    gui = GameGUI(theme=theme, tile_size=TILE_SIZE)
     # gui.game_state.set_grid([[2, 4, 16, 64], [4, 2, 32, 32], [2, 4, 16, 64], [8, 2, 4, 8]])
+    if snapshot:
+        snapshot.restore(gui.game_state)
+    settings = {k: getattr(args, k) for k in SESSION_SETTINGS}
+    settings["theme"] = theme.to_dict()
+    autosaver = Autosaver(args.session, args.autosave_interval) if args.session else None
 
-    window_size = gui.rect.size
-    screen = pygame.display.set_mode(window_size)
+    # Hints and autoplay run on the worker thread and report back as events
+    if args.autoplay == "hint":
+        policy = lambda board, rng: gui.compute_hint(board).action
+    else:
+        policy = make_policy(args.autoplay)
+    worker = EngineWorker(
+        gui.game_state,
+        gui.lock,
+        gui.compute_hint,
+        policy,
+        args.autoplay_speed,
+        review=gui.compute_review,
+    )
+    gui.worker = worker
+    worker.start()
+
+    spectator = None
+    if args.spectate > 0:
+        simulator = BatchSimulator(
+            args.spectate_policy,
+            args.spectate,
+            seed=args.seed,
+            steps_per_second=args.spectate_speed,
+        )
+        spectator = SpectatorView(simulator, theme)
+        simulator.start()
+        screen = pygame.display.set_mode(spectator.rect.size)
+    else:
+        screen = pygame.display.set_mode(gui.rect.size)
+    view = spectator or gui
+
+    # Profiling
+    profiler.instrument_engine()
+    # Spectated games move outside GameState; count them as steps too
+    profiler.instrument(BatchSimulator, "_move", "step")
+    profiler.instrument_gui(Board, theme)
+    profiler.instrument(pygame.display, "update", "display.update")
+    if args.profile:
+        profiler.enable()
+    overlay = ProfilerOverlay(profiler, theme.padding_small // 4, 0)
+    periodic_dump = PeriodicDump(profiler, args.profile_interval)
+    frame_time = 0.0
 
     while running:
+        frame_start = time.perf_counter()
         # poll for events
         # pygame.QUIT event means the user clicked X to close your window
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                profiler.toggle()
 
+            if view is spectator:
+                index = spectator.event_handler(event)
+                if index is not None:
+                    # Open a snapshot of the clicked game in the full view
+                    sim = spectator.simulator
+                    gui.load_position(bitboard.unpack(sim.boards[index]), sim.scores[index])
+                    view = gui
+                    screen = pygame.display.set_mode(gui.rect.size)
+                continue
+            if (
+                spectator
+                and gui.review is None
+                and event.type == pygame.KEYDOWN
+                and event.key == pygame.K_ESCAPE
+            ):
+                worker.set_autoplay(False)
+                view = spectator
+                screen = pygame.display.set_mode(spectator.rect.size)
+                spectator.invalidate()
+                continue
             gui.event_handler(event)
 
-        # fill the screen with a color to wipe away anything from last frame
-        screen.fill(theme.bg)
+        if view is spectator:
+            # Only boards that changed are redrawn and pushed to the display
+            dirty = spectator.draw(screen, theme)
+            overlay_rect = overlay.draw(screen, theme, frame_time, clock.get_fps())
+            if overlay_rect:
+                dirty.append(overlay_rect)
+            pygame.display.update(dirty)
+        else:
+            # fill the screen with a color to wipe away anything from last frame
+            screen.fill(theme.bg)
+
+            # RENDER YOUR GAME HERE
+            gui.draw(screen, theme)
+            overlay.draw(screen, theme, frame_time, clock.get_fps())
+
+            # flip() the display to put your work on screen
+            pygame.display.flip()
 
-        # RENDER YOUR GAME HERE
-        gui.draw(screen, theme)
+        if autosaver:
+            autosaver.tick(gui.game_state, settings, gui.lock)
 
-        # flip() the display to put your work on screen
-        pygame.display.flip()
+        if profiler.enabled:
+            frame_time = time.perf_counter() - frame_start
+            profiler.record("frame", frame_time)
+            if args.profile_interval > 0:
+                periodic_dump.tick()
 
-        clock.tick(15)  # limits FPS to 30
+        clock.tick(args.fps)
 
+    worker.stop()
+    if autosaver:
+        autosaver.close()
+        save_session(args.session, Snapshot.capture(gui.game_state, settings))
+    if spectator:
+        spectator.simulator.stop()
+    profiler.disable()
+    solver.close()
+    if tablebase:
+        tablebase.close()
+    if book:
+        book.close()
     pygame.quit()
 
 
@@ -0,0 +1,351 @@
+from __future__ import annotations
+from typing import Iterable, TextIO
+
+import os
+import shutil
+import struct
+import sys
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+import bitboard
+from bitboard import Board
+from gamestate import WIN_EXPONENT
+from rng import make_rng
+from selfplay import spawn_tile
+
+MAGIC = b"2048NT\x00\x00"
+VERSION = 1
+# magic, version, tuple count, cells per tuple
+HEADER = struct.Struct("<8sIHH")
+# Weights start on a page-friendly boundary so the file maps cleanly
+ALIGNMENT = 64
+# Cell k is (k // 4, k % 4). Every tuple is also read on the seven other
+# symmetries of the board, so each shape covers all its rotations and mirrors.
+TUPLE_SETS: dict[str, list[tuple[int, ...]]] = {
+    # Four 6-tuples: two rectangles and two L shapes, 64 MiB of weights each
+    "6x4": [(0, 1, 2, 3, 4, 5), (4, 5, 6, 7, 8, 9), (0, 1, 2, 4, 5, 6), (4, 5, 6, 8, 9, 10)],
+    # Small network for quick experiments: rows and 2x2 squares
+    "4x5": [(0, 1, 2, 3), (4, 5, 6, 7), (0, 1, 4, 5), (1, 2, 5, 6), (5, 6, 9, 10)],
+}
+LEARNING_RATE = 0.1
+CHECKPOINT_GAMES = 1000
+
+
+def _runs(cells: tuple[int, ...]) -> list[tuple[int, int]]:
+    """
+    (shift, mask) pairs that gather the sorted cells' nibbles into an index.
+    Each run of adjacent cells is moved with a single right shift.
+    """
+    runs = []
+    position = 0
+    start = 0
+    while start < len(cells):
+        end = start
+        while end + 1 < len(cells) and cells[end + 1] == cells[end] + 1:
+            end += 1
+        length = end - start + 1
+        shift = 4 * cells[start] - 4 * position
+        mask = ((1 << (4 * length)) - 1) << (4 * position)
+        runs.append((shift, mask))
+        position += length
+        start = end + 1
+    return runs
+
+
+class NTupleNetwork:
+    """
+    Board evaluator summing learned weights over n-tuples of cells.
+
+    The weights of all tuples live in one flat float32 array, usually a memory
+    map of a weight file, so several processes can read and train the same
+    network. Tuple t reads the board's 8 symmetries, looking each up in the
+    same table at offsets[t]. Values estimate the score still to come after
+    an afterstate, so search adds move rewards to them.
+    """
+    score_scaled = True
+
+    def __init__(self, tuples: list[tuple[int, ...]], weights: np.ndarray | None = None) -> None:
+        self.tuples = [tuple(sorted(cells)) for cells in tuples]
+        sizes = [16 ** len(cells) for cells in self.tuples]
+        self.offsets = [sum(sizes[:t]) for t in range(len(sizes))]
+        self.size = sum(sizes)
+        if weights is None:
+            weights = np.zeros(self.size, dtype=np.float32)
+        if weights.shape != (self.size,):
+            raise ValueError(f"Expected {self.size} weights, got {weights.shape}.")
+        self.weights = weights
+        self.lookups = 8 * len(self.tuples)
+        self._plans = [
+            (offset, _runs(cells)) for offset, cells in zip(self.offsets, self.tuples)
+        ]
+
+    def indices(self, board: Board) -> list[int]:
+        """Weight index of every tuple on every symmetry of board."""
+        result = []
+        for b in bitboard.symmetries(board):
+            for offset, runs in self._plans:
+                index = 0
+                for shift, mask in runs:
+                    index |= (b >> shift) & mask
+                result.append(offset + index)
+        return result
+
+    def value_at(self, indices: list[int]) -> float:
+        return float(self.weights[indices].sum(dtype=np.float64))
+
+    def __call__(self, board: Board) -> float:
+        return self.value_at(self.indices(board))
+
+    def batch(self, boards: Iterable[Board] | np.ndarray) -> np.ndarray:
+        """Evaluate many boards at once."""
+        boards = np.asarray(list(boards) if not isinstance(boards, np.ndarray) else boards, dtype=np.uint64)
+        total = np.zeros(len(boards), dtype=np.float64)
+        for b in bitboard.symmetries(boards):
+            for offset, runs in self._plans:
+                index = np.zeros(len(boards), dtype=np.uint64)
+                for shift, mask in runs:
+                    index |= (b >> np.uint64(shift)) & np.uint64(mask)
+                total += self.weights[index.astype(np.int64) + offset]
+        return total
+
+    def update(self, indices: list[int], delta: float) -> None:
+        """Move the value of the board with these indices by delta."""
+        np.add.at(self.weights, indices, np.float32(delta / self.lookups))
+
+    def train_game(self, seed: int, learning_rate: float = LEARNING_RATE) -> tuple[int, int, int]:
+        """
+        Play one game greedily on afterstate values, learning by TD(0).
+
+        Returns the score, the number of moves and the largest exponent.
+        """
+        spawns = make_rng("splitmix", seed)
+        board = spawn_tile(spawn_tile(0, spawns), spawns)
+        score = moves = 0
+        previous: list[int] | None = None
+        previous_value = 0.0
+        while True:
+            successors = bitboard.possible_moves(board)
+            if not successors:
+                break
+            best_value = best_indices = best_after = None
+            best_reward = 0
+            for after, reward in successors.values():
+                indices = self.indices(after)
+                value = reward + self.value_at(indices)
+                if best_value is None or value > best_value:
+                    best_value, best_indices, best_after, best_reward = value, indices, after, reward
+            if previous is not None:
+                # V(previous afterstate) moves towards r + V(next afterstate)
+                self.update(previous, learning_rate * (best_value - previous_value))
+            previous = best_indices
+            previous_value = best_value - best_reward
+            score += best_reward
+            moves += 1
+            board = spawn_tile(best_after, spawns)
+        if previous is not None:
+            self.update(previous, learning_rate * -previous_value)
+        return score, moves, bitboard.max_exponent(board)
+
+    def flush(self) -> None:
+        if isinstance(self.weights, np.memmap):
+            self.weights.flush()
+
+    @staticmethod
+    def _data_offset(tuples: list[tuple[int, ...]]) -> int:
+        size = HEADER.size + len(tuples) * len(tuples[0])
+        return -(-size // ALIGNMENT) * ALIGNMENT
+
+    @classmethod
+    def create(cls, path: str, tuples: list[tuple[int, ...]]) -> NTupleNetwork:
+        """Write a weight file of zeros and open it for training."""
+        if len({len(cells) for cells in tuples}) != 1:
+            raise ValueError("All tuples must have the same length.")
+        network = cls(tuples)
+        offset = cls._data_offset(network.tuples)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as fout:
+            fout.write(HEADER.pack(MAGIC, VERSION, len(network.tuples), len(network.tuples[0])))
+            fout.write(bytes(b for cells in network.tuples for b in cells))
+            # Sparse on most filesystems until weights are written
+            fout.truncate(offset + 4 * network.size)
+        os.replace(tmp, path)
+        return cls.load(path, writable=True)
+
+    @classmethod
+    def load(cls, path: str, writable: bool = False) -> NTupleNetwork:
+        """Memory-map a weight file."""
+        with open(path, "rb") as fin:
+            header = fin.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise ValueError(f"{path} is not an n-tuple weight file.")
+            magic, version, count, length = HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not an n-tuple weight file.")
+            if version != VERSION:
+                raise ValueError(f"Unsupported weight file version {version}.")
+            cells = fin.read(count * length)
+        tuples = [tuple(cells[t * length:(t + 1) * length]) for t in range(count)]
+        size = sum(16 ** length for _ in tuples)
+        weights = np.memmap(
+            path,
+            dtype="<f4",
+            mode="r+" if writable else "r",
+            offset=cls._data_offset(tuples),
+            shape=(size,),
+        )
+        return cls(tuples, weights)
+
+
+def save_checkpoint(path: str, checkpoint: str) -> None:
+    """Atomically copy a weight file, e.g. while workers keep training it."""
+    tmp = f"{checkpoint}.tmp"
+    shutil.copyfile(path, tmp)
+    os.replace(tmp, checkpoint)
+
+
+# Worker process state for train
+_network: NTupleNetwork | None = None
+
+
+def _init_worker(path: str) -> None:
+    global _network
+    _network = NTupleNetwork.load(path, writable=True)
+
+
+def _train_task(args: tuple[list[int], float]) -> list[tuple[int, int, int]]:
+    seeds, learning_rate = args
+    results = [_network.train_game(seed, learning_rate) for seed in seeds]
+    _network.flush()
+    return results
+
+
+def train(
+    path: str,
+    games: int,
+    seed: int = 0,
+    workers: int = 1,
+    learning_rate: float = LEARNING_RATE,
+    checkpoint: str | None = None,
+    checkpoint_games: int = CHECKPOINT_GAMES,
+    batch: int = 10,
+    fout: TextIO | None = None,
+) -> dict[str, float]:
+    """
+    Train the weight file at path with games of self-play.
+
+    Workers update the shared memory map without locks: collisions are rare
+    and TD learning tolerates them. Every checkpoint_games games the file is
+    copied to checkpoint and, with fout, a progress line is written.
+    """
+    jobs = [
+        (list(range(start, min(start + batch, seed + games))), learning_rate)
+        for start in range(seed, seed + games, batch)
+    ]
+    start_time = time.perf_counter()
+    done = moves = total_score = wins = 0
+    recent: list[int] = []
+    next_checkpoint = checkpoint_games
+    if workers > 1:
+        pool = Pool(workers, initializer=_init_worker, initargs=(path,))
+        results = pool.imap_unordered(_train_task, jobs)
+    else:
+        pool = None
+        _init_worker(path)
+        results = map(_train_task, jobs)
+    try:
+        for chunk in results:
+            for score, game_moves, exponent in chunk:
+                done += 1
+                moves += game_moves
+                total_score += score
+                wins += exponent >= WIN_EXPONENT
+                recent.append(score)
+            if checkpoint and done >= next_checkpoint:
+                save_checkpoint(path, checkpoint)
+                next_checkpoint += checkpoint_games
+            if len(recent) >= checkpoint_games or done == games:
+                if fout is not None:
+                    elapsed = time.perf_counter() - start_time
+                    print(
+                        f"{done} games  mean score {sum(recent) / len(recent):.0f}  "
+                        f"2048 rate {wins / done:.1%}  {moves / elapsed:.0f} moves/s",
+                        file=fout,
+                    )
+                recent = []
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    if checkpoint:
+        save_checkpoint(path, checkpoint)
+    elapsed = time.perf_counter() - start_time
+    return {
+        "games": done,
+        "moves": moves,
+        "mean_score": total_score / done if done else 0.0,
+        "win_rate": wins / done if done else 0.0,
+        "moves_per_sec": moves / elapsed if elapsed else 0.0,
+    }
+
+
+def benchmark(network: NTupleNetwork, boards: int = 10_000, seed: int = 0) -> dict[str, float]:
+    """Inference latency per board, one at a time and batched."""
+    rng = np.random.default_rng(seed)
+    cells = rng.integers(0, 12, size=(boards, 16), dtype=np.uint64)
+    packed = (cells << (np.arange(16, dtype=np.uint64) * np.uint64(4))).sum(axis=1, dtype=np.uint64)
+    sample = packed.tolist()
+    start = time.perf_counter()
+    for board in sample:
+        network(board)
+    single = (time.perf_counter() - start) / boards
+    start = time.perf_counter()
+    network.batch(packed)
+    batched = (time.perf_counter() - start) / boards
+    return {"single_us": single * 1e6, "batch_us": batched * 1e6}
+
+
+def main(argv: list[str] | None = None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="n-tuple network evaluator")
+    sub = parser.add_subparsers(dest="command", required=True)
+    train_parser = sub.add_parser("train", help="train by TD(0) self-play")
+    train_parser.add_argument("weights", help="weight file, created if missing")
+    train_parser.add_argument("--tuples", choices=sorted(TUPLE_SETS), default="6x4")
+    train_parser.add_argument("--games", type=int, default=10_000)
+    train_parser.add_argument("--seed", type=int, default=0)
+    train_parser.add_argument("--workers", type=int, default=1)
+    train_parser.add_argument("--learning-rate", type=float, default=LEARNING_RATE)
+    train_parser.add_argument("--checkpoint", help="copy of the weights, default WEIGHTS.ckpt")
+    train_parser.add_argument("--checkpoint-games", type=int, default=CHECKPOINT_GAMES)
+    bench_parser = sub.add_parser("bench", help="measure inference latency")
+    bench_parser.add_argument("weights")
+    bench_parser.add_argument("--boards", type=int, default=10_000)
+    args = parser.parse_args(argv)
+
+    match args.command:
+        case "train":
+            if not os.path.exists(args.weights):
+                NTupleNetwork.create(args.weights, TUPLE_SETS[args.tuples])
+            stats = train(
+                args.weights,
+                args.games,
+                args.seed,
+                args.workers,
+                args.learning_rate,
+                args.checkpoint or f"{args.weights}.ckpt",
+                args.checkpoint_games,
+                fout=sys.stdout,
+            )
+            print(f"Trained {stats['games']} games, {stats['moves_per_sec']:.0f} moves/s")
+        case "bench":
+            network = NTupleNetwork.load(args.weights)
+            stats = benchmark(network, args.boards)
+            print(f"{stats['single_us']:.1f} us per board, {stats['batch_us']:.2f} us per board batched")
+
+
+if __name__ == "__main__":
+    main()
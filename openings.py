@@ -0,0 +1,281 @@
+from __future__ import annotations
+from typing import BinaryIO, Iterable
+
+import json
+import os
+import struct
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+
+import bitboard
+from bitboard import Board
+from gamestate import Action
+from analytics import read_chunks
+from rng import RNG_KINDS, make_rng
+from selfplay import CODE_ACTIONS, play, spawn_tile
+from solver import Hint
+
+MAGIC = b"2048OB\x00\x00"
+VERSION = 1
+# magic, version, max moves, reserved, entry count, game count
+HEADER = struct.Struct("<8sIHHQQ")
+# Per canonical board: times each action was played and the sum of final scores
+ENTRY = np.dtype([("board", "<u8"), ("count", "<u4", (4,)), ("score", "<f8", (4,))])
+MAX_MOVES = 20
+MIN_GAMES = 3
+
+type Stats = dict[Action, tuple[int, float]]
+
+
+def opening_positions(record: dict, max_moves: int = MAX_MOVES) -> Iterable[tuple[Board, Action]]:
+    """Replay the first max_moves moves of a recorded game."""
+    spawns = make_rng(record.get("rng", "random"), record["seed"])
+    board = spawn_tile(spawn_tile(0, spawns), spawns)
+    for code in record["actions"][:max_moves]:
+        action = CODE_ACTIONS[code]
+        yield board, action
+        after, _ = bitboard.move(board, action)
+        board = spawn_tile(after, spawns)
+
+
+class BookBuilder:
+    """
+    In-memory opening book that games are streamed into.
+
+    Positions are stored by canonical board with actions mapped into the
+    canonical frame, so all eight symmetric openings share one entry. Builders
+    made from different shards of games are combined with merge.
+    """
+    def __init__(self, max_moves: int = MAX_MOVES) -> None:
+        self.max_moves = max_moves
+        self.games = 0
+        # board -> [count per action..., score sum per action...]
+        self.entries: dict[Board, list[float]] = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add_game(self, record: dict) -> None:
+        """Add a selfplay result record; records without moves are skipped."""
+        if not record.get("actions"):
+            return
+        self.games += 1
+        score = record["score"]
+        for board, action in opening_positions(record, self.max_moves):
+            key, symmetry = bitboard.canonical_index(board)
+            a = bitboard.SYMMETRY_ACTIONS[symmetry][action].value
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = [0] * 8
+            entry[a] += 1
+            entry[4 + a] += score
+
+    def add_games(self, records: Iterable[dict]) -> None:
+        for record in records:
+            self.add_game(record)
+
+    def merge(self, other: BookBuilder) -> None:
+        self.games += other.games
+        self.max_moves = max(self.max_moves, other.max_moves)
+        for key, values in other.entries.items():
+            entry = self.entries.get(key)
+            if entry is None:
+                self.entries[key] = list(values)
+            else:
+                for k in range(8):
+                    entry[k] += values[k]
+
+    def to_array(self) -> np.ndarray:
+        keys = sorted(self.entries)
+        array = np.zeros(len(keys), dtype=ENTRY)
+        array["board"] = keys
+        values = np.array([self.entries[key] for key in keys], dtype=np.float64).reshape(-1, 8)
+        array["count"] = values[:, :4]
+        array["score"] = values[:, 4:]
+        return array
+
+    def write(self, file: BinaryIO) -> None:
+        """Write the book as a header and entries sorted by board."""
+        array = self.to_array()
+        file.write(HEADER.pack(MAGIC, VERSION, self.max_moves, 0, len(array), self.games))
+        file.write(array.tobytes())
+
+    def save(self, path: str) -> None:
+        """Atomically write the book to path."""
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as fout:
+            self.write(fout)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> BookBuilder:
+        """Read a book file back for merging."""
+        with OpeningBook(path) as book:
+            builder = cls(book.max_moves)
+            builder.games = book.games
+            counts = book.entries["count"].astype(np.float64)
+            values = np.concatenate([counts, book.entries["score"]], axis=1)
+            builder.entries = dict(zip(book.entries["board"].tolist(), values.tolist()))
+        return builder
+
+
+class OpeningBook:
+    """Memory-mapped opening book, searched by binary search on the board."""
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as fin:
+            header = fin.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError(f"{path} is not an opening book.")
+        magic, version, max_moves, _, count, games = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an opening book.")
+        if version != VERSION:
+            raise ValueError(f"Unsupported opening book version {version}.")
+        self.max_moves = max_moves
+        self.games = games
+        if count:
+            self.entries = np.memmap(path, dtype=ENTRY, mode="r", offset=HEADER.size, shape=(count,))
+        else:
+            self.entries = np.zeros(0, dtype=ENTRY)
+        self._boards = self.entries["board"]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def stats(self, board: Board) -> Stats | None:
+        """Play count and mean final score of each action seen in a position."""
+        variants = bitboard.symmetries(board)
+        key = min(variants)
+        i = int(np.searchsorted(self._boards, np.uint64(key)))
+        if i == len(self._boards) or int(self._boards[i]) != key:
+            return None
+        entry = self.entries[i]
+        # A symmetric board maps onto the canonical one in several ways; the
+        # actions those ways relate lead to equivalent positions and are pooled
+        mappings = [
+            bitboard.SYMMETRY_ACTIONS[s] for s, variant in enumerate(variants) if variant == key
+        ]
+        result = {}
+        for action in Action:
+            slots = {mapping[action].value for mapping in mappings}
+            count = sum(int(entry["count"][a]) for a in slots)
+            if count:
+                total = sum(float(entry["score"][a]) for a in slots)
+                result[action] = (count, total / count)
+        return result
+
+    def hint(self, board: Board, min_games: int = MIN_GAMES) -> Hint | None:
+        """Action with the best mean final score among those played min_games times."""
+        stats = self.stats(board)
+        if not stats:
+            return None
+        values = {action: mean for action, (count, mean) in stats.items() if count >= min_games}
+        if not values:
+            return None
+        return Hint(max(values, key=values.get), values, 0, 0.0, objective="book")
+
+    def close(self) -> None:
+        self._boards = self.entries = None
+
+    def __enter__(self) -> OpeningBook:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def build_file(path: str, max_moves: int = MAX_MOVES) -> BookBuilder:
+    """Stream one result file into a book."""
+    builder = BookBuilder(max_moves)
+    for chunk in read_chunks(path):
+        builder.add_games(chunk)
+    return builder
+
+
+def build_selfplay(
+    policy: str, seeds: range, max_moves: int = MAX_MOVES, rng_kind: str = "random"
+) -> BookBuilder:
+    """Play games and add them to a book as they finish."""
+    builder = BookBuilder(max_moves)
+    for seed in seeds:
+        builder.add_game(play(policy, seed, rng_kind=rng_kind).to_dict())
+    return builder
+
+
+def _build_args(args: tuple) -> BookBuilder:
+    if args[0] == "file":
+        return build_file(*args[1:])
+    return build_selfplay(*args[1:])
+
+
+def build(jobs: list[tuple], workers: int = 1, max_moves: int = MAX_MOVES) -> BookBuilder:
+    """Build shards in worker processes and merge them as they complete."""
+    book = BookBuilder(max_moves)
+    if workers <= 1 or len(jobs) <= 1:
+        for shard in map(_build_args, jobs):
+            book.merge(shard)
+        return book
+    with Pool(min(workers, len(jobs))) as pool:
+        for shard in pool.imap_unordered(_build_args, jobs):
+            book.merge(shard)
+    return book
+
+
+def main(argv: list[str] | None = None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Opening book of early-game move statistics")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_parser = sub.add_parser("build", help="build a book from result files or self-play")
+    build_parser.add_argument("book")
+    build_parser.add_argument("paths", nargs="*", help="selfplay.py result files (.gz allowed)")
+    build_parser.add_argument("--policy", help="play games with this policy instead")
+    build_parser.add_argument("--games", type=int, default=1000)
+    build_parser.add_argument("--seed", type=int, default=0)
+    build_parser.add_argument("--rng", choices=RNG_KINDS, default="random", help="spawn generator for self-play")
+    build_parser.add_argument("--max-moves", type=int, default=MAX_MOVES)
+    build_parser.add_argument("--workers", type=int, default=1)
+    merge_parser = sub.add_parser("merge", help="merge book shards")
+    merge_parser.add_argument("book")
+    merge_parser.add_argument("shards", nargs="+")
+    lookup = sub.add_parser("lookup", help="look up a position")
+    lookup.add_argument("book")
+    lookup.add_argument("grid", help="grid as JSON")
+    args = parser.parse_args(argv)
+
+    match args.command:
+        case "build":
+            jobs: list[tuple] = [("file", path, args.max_moves) for path in args.paths]
+            if args.policy:
+                per_job = max(1, -(-args.games // max(args.workers, 1)))
+                end = args.seed + args.games
+                jobs += [
+                    ("selfplay", args.policy, range(start, min(start + per_job, end)), args.max_moves, args.rng)
+                    for start in range(args.seed, end, per_job)
+                ]
+            if not jobs:
+                parser.error("give result files or --policy")
+            book = build(jobs, args.workers, args.max_moves)
+            book.save(args.book)
+            print(f"Wrote {len(book)} positions from {book.games} games to {args.book}")
+        case "merge":
+            book = BookBuilder()
+            for shard in args.shards:
+                book.merge(BookBuilder.load(shard))
+            book.save(args.book)
+            print(f"Wrote {len(book)} positions from {book.games} games to {args.book}")
+        case "lookup":
+            board = bitboard.pack(json.loads(args.grid))
+            with OpeningBook(args.book) as book:
+                stats = book.stats(board)
+                if not stats:
+                    print("Position not in book")
+                    sys.exit(1)
+                for action, (count, mean) in sorted(stats.items(), key=lambda item: -item[1][1]):
+                    print(f"{action.name}: {count} games, mean score {mean:.0f}")
+
+
+if __name__ == "__main__":
+    main()
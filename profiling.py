@@ -0,0 +1,210 @@
+from __future__ import annotations
+from typing import Any, Callable, TextIO
+
+import functools
+import sys
+import time
+
+from gamestate import GameState
+
+type Phase = str
+
+# Engine phases; method names on GameState mapped to the phase they record.
+ENGINE_PHASES: dict[str, Phase] = {
+    "move_left": "move.left",
+    "move_right": "move.right",
+    "move_up": "move.up",
+    "move_down": "move.down",
+    "new_tiles": "spawn",
+    "possible_directions": "legal_check",
+    "step": "step",
+}
+
+
+class PhaseStats:
+    """Call count and timing totals for a single phase."""
+    def __init__(self) -> None:
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed: float) -> None:
+        self.calls += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+    def merge(self, other: PhaseStats) -> None:
+        self.calls += other.calls
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.calls if self.calls else 0.0
+
+
+class _TimedFont:
+    """Proxy around a pygame Font that records render time."""
+    def __init__(self, font: Any, profiler: Profiler) -> None:
+        self._font = font
+        self._profiler = profiler
+
+    def render(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._font.render(*args, **kwargs)
+        finally:
+            self._profiler.record("font.render", time.perf_counter() - start)
+
+    def __getattr__(self, name: str):
+        return getattr(self._font, name)
+
+
+class Profiler:
+    """
+    Opt-in per-phase counters and timers.
+
+    Instrumentation is installed by swapping attributes for timing wrappers on
+    enable() and restoring the originals on disable(), so a disabled profiler
+    adds no overhead to the hot paths.
+    """
+    def __init__(self) -> None:
+        self.enabled = False
+        self.stats: dict[Phase, PhaseStats] = {}
+        self.counters: dict[str, int] = {}
+        self.started = time.perf_counter()
+        self._targets: list[tuple[Any, str, Phase]] = []
+        self._fonts: list[Any] = []
+        self._originals: list[tuple[Any, str, Any]] = []
+
+    def instrument(self, owner: Any, attr: str, phase: Phase) -> None:
+        """Register owner.attr to be timed as phase while enabled."""
+        self._targets.append((owner, attr, phase))
+        if self.enabled:
+            self._patch(owner, attr, phase)
+
+    def instrument_engine(self, owner: Any = GameState) -> None:
+        """Register the GameState move generation, spawn and legal-move check."""
+        for attr, phase in ENGINE_PHASES.items():
+            self.instrument(owner, attr, phase)
+
+    def instrument_gui(self, board_cls: Any, theme: Any) -> None:
+        """Register Board.draw, display flip and the theme's font renders."""
+        import pygame
+
+        self.instrument(board_cls, "draw", "board.draw")
+        self.instrument(pygame.display, "flip", "display.flip")
+        self._fonts.append(theme)
+        if self.enabled:
+            self._patch_fonts(theme)
+
+    def enable(self) -> None:
+        if self.enabled:
+            return
+        self.enabled = True
+        for owner, attr, phase in self._targets:
+            self._patch(owner, attr, phase)
+        for theme in self._fonts:
+            self._patch_fonts(theme)
+
+    def disable(self) -> None:
+        if not self.enabled:
+            return
+        self.enabled = False
+        for owner, attr, original in reversed(self._originals):
+            setattr(owner, attr, original)
+        self._originals.clear()
+
+    def toggle(self) -> bool:
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+        return self.enabled
+
+    def _patch(self, owner: Any, attr: str, phase: Phase) -> None:
+        original = getattr(owner, attr)
+        self._originals.append((owner, attr, original))
+        setattr(owner, attr, self.wrap(original, phase))
+
+    def _patch_fonts(self, theme: Any) -> None:
+        for attr in ("font_small", "font_medium", "font_large"):
+            self._originals.append((theme, attr, getattr(theme, attr)))
+            setattr(theme, attr, _TimedFont(getattr(theme, attr), self))
+        self._originals.append((theme, "font", theme.font))
+        theme.font = {size: _TimedFont(font, self) for size, font in theme.font.items()}
+
+    def wrap(self, func: Callable, phase: Phase) -> Callable:
+        """Return func wrapped to record its wall time under phase."""
+        record = self.record
+        perf_counter = time.perf_counter
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(phase, perf_counter() - start)
+
+        return timed
+
+    def record(self, phase: Phase, elapsed: float) -> None:
+        stats = self.stats.get(phase)
+        if stats is None:
+            stats = self.stats[phase] = PhaseStats()
+        stats.add(elapsed)
+
+    def count(self, name: str, n: int = 1) -> None:
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self) -> None:
+        self.stats.clear()
+        self.counters.clear()
+        self.started = time.perf_counter()
+
+    def rate(self, phase: Phase) -> float:
+        """Calls per second of phase since the last reset."""
+        elapsed = time.perf_counter() - self.started
+        stats = self.stats.get(phase)
+        if stats is None or elapsed <= 0:
+            return 0.0
+        return stats.calls / elapsed
+
+    def report(self) -> str:
+        """Format a table of all recorded phases."""
+        lines = [f"{'phase':<14}{'calls':>10}{'total ms':>12}{'mean us':>10}{'max us':>10}"]
+        for phase in sorted(self.stats):
+            stats = self.stats[phase]
+            lines.append(
+                f"{phase:<14}{stats.calls:>10}{stats.total * 1e3:>12.2f}"
+                f"{stats.mean * 1e6:>10.1f}{stats.max * 1e6:>10.1f}"
+            )
+        for name in sorted(self.counters):
+            lines.append(f"{name:<14}{self.counters[name]:>10}")
+        return "\n".join(lines)
+
+    def dump(self, fout: TextIO = sys.stdout) -> None:
+        print(self.report(), file=fout, flush=True)
+
+
+class PeriodicDump:
+    """Print the profiler report at most once every interval seconds."""
+    def __init__(self, profiler: Profiler, interval: float = 5.0, fout: TextIO = sys.stdout):
+        self.profiler = profiler
+        self.interval = interval
+        self.fout = fout
+        self.last = time.perf_counter()
+
+    def tick(self) -> bool:
+        now = time.perf_counter()
+        if not self.profiler.enabled or now - self.last < self.interval:
+            return False
+        self.last = now
+        self.profiler.dump(self.fout)
+        return True
+
+
+profiler = Profiler()
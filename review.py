@@ -0,0 +1,249 @@
+from __future__ import annotations
+from typing import TextIO
+
+import sys
+import time
+
+import bitboard
+from bitboard import Board
+from gamestate import CELLS, Action, Grid, History
+from analytics import read_chunks
+from openings import opening_positions
+from session import MAGIC as SESSION_MAGIC, load_session
+from solver import Solver
+
+type Position = tuple[Board, Action]
+
+DEPTH = 1
+# Mistake and blunder loss thresholds per unit. Score-scaled evaluators such
+# as an n-tuple network value moves in points of expected score; the heuristic
+# Evaluator has no score scale, so its losses stay in its own units.
+THRESHOLDS = {"points": (100.0, 500.0), "eval": (2.0, 5.0)}
+TOP_BLUNDERS = 5
+
+
+def record_positions(record: dict) -> list[Position]:
+    """Every position of a selfplay result record and the move played in it."""
+    return list(opening_positions(record, len(record["actions"])))
+
+
+def infer_action(board: Board, next_board: Board, gain: int | None = None) -> Action | None:
+    """The move that, followed by one spawn, turns board into next_board."""
+    for action, (after, reward) in bitboard.successor_cache(board).items():
+        if gain is not None and reward != gain:
+            continue
+        if _single_spawn(after, next_board ^ after):
+            return action
+    return None
+
+
+def _single_spawn(after: Board, spawned: Board) -> bool:
+    """Whether spawned is a 2 or a 4 on one cell that is empty in after."""
+    if spawned == 0:
+        return False
+    shift = (spawned.bit_length() - 1) // 4 * 4
+    return spawned in (1 << shift, 2 << shift) and (after >> shift) & 0xF == 0
+
+
+def history_positions(history: History, grid: Grid, score: int | None = None) -> list[Position]:
+    """Positions of a game from its undo history, ending at the current grid and score."""
+    cells = history.cells
+    boards = []
+    for k in range(len(history)):
+        board = 0
+        for cell, exponent in enumerate(cells[k * CELLS:(k + 1) * CELLS]):
+            board |= exponent << (4 * cell)
+        boards.append(board)
+    boards.append(bitboard.pack(grid))
+    scores = list(history.scores) + [score]
+    positions = []
+    for k in range(len(history)):
+        gain = None if scores[k + 1] is None else scores[k + 1] - scores[k]
+        action = infer_action(boards[k], boards[k + 1], gain)
+        if action is None:
+            # Not one move apart, e.g. the position was edited; review what follows
+            positions.clear()
+            continue
+        positions.append((boards[k], action))
+    return positions
+
+
+class MoveReview:
+    """
+    The engine's verdict on one move: values of every legal action and the
+    loss of the move played, in the unit of its GameReview.
+    """
+    def __init__(self, index: int, board: Board, played: Action, values: dict[Action, float]) -> None:
+        self.index = index
+        self.board = board
+        self.played = played
+        self.values = values
+        self.best = max(values, key=values.get)
+        self.loss = values[self.best] - values[played]
+        self.grade = ""
+
+    @property
+    def forced(self) -> bool:
+        return len(self.values) == 1
+
+
+class GameReview:
+    """
+    Move by move review of one game. Losses are in unit, "points" or "eval",
+    and the default thresholds follow from it.
+    """
+    def __init__(
+        self,
+        moves: list[MoveReview],
+        depth: int,
+        elapsed: float = 0.0,
+        unit: str = "points",
+        mistake: float | None = None,
+        blunder: float | None = None,
+    ) -> None:
+        self.moves = moves
+        self.depth = depth
+        self.elapsed = elapsed
+        self.unit = unit
+        default_mistake, default_blunder = THRESHOLDS[unit]
+        mistake = default_mistake if mistake is None else mistake
+        blunder = default_blunder if blunder is None else blunder
+        for move in moves:
+            if move.loss >= blunder:
+                move.grade = "??"
+            elif move.loss >= mistake:
+                move.grade = "?"
+
+    def __len__(self) -> int:
+        return len(self.moves)
+
+    @property
+    def accuracy(self) -> float:
+        """Share of unforced moves where the engine's best move was played."""
+        choices = [move for move in self.moves if not move.forced]
+        if not choices:
+            return 1.0
+        return sum(move.played == move.best for move in choices) / len(choices)
+
+    @property
+    def total_loss(self) -> float:
+        return sum(move.loss for move in self.moves)
+
+    def count(self, grade: str) -> int:
+        return sum(move.grade == grade for move in self.moves)
+
+    def worst(self, count: int = TOP_BLUNDERS) -> list[MoveReview]:
+        """Moves with the largest loss, largest first."""
+        ranked = sorted(self.moves, key=lambda move: -move.loss)
+        return [move for move in ranked[:count] if move.loss > 0]
+
+    def format_loss(self, loss: float) -> str:
+        return f"{loss:.0f} points" if self.unit == "points" else f"{loss:.2f}"
+
+    def describe(self, move: MoveReview) -> str:
+        line = f"move {move.index + 1}: played {move.played.name}"
+        if move.played != move.best:
+            line += f", best {move.best.name}, loss {self.format_loss(move.loss)}"
+        return f"{line} {move.grade}".rstrip()
+
+    def next_blunder(self, index: int) -> int | None:
+        """Index of the next move after index graded a mistake or worse."""
+        for move in self.moves[index + 1:]:
+            if move.grade:
+                return move.index
+        return None
+
+
+def analyze(
+    positions: list[Position],
+    solver: Solver | None = None,
+    depth: int = DEPTH,
+    mistake: float | None = None,
+    blunder: float | None = None,
+) -> GameReview:
+    """
+    Review every move of a game at a fixed depth. All positions go to the
+    solver as one batch, which a ParallelSolver spreads over its workers.
+    With a score-scaled evaluator an action is worth its reward plus the
+    expected score after it, so losses are in points.
+    """
+    start = time.perf_counter()
+    solver = solver or Solver()
+    values = solver.analyze([board for board, _ in positions], depth)
+    moves = [
+        MoveReview(k, board, action, action_values)
+        for k, ((board, action), action_values) in enumerate(zip(positions, values))
+    ]
+    unit = "points" if solver.searcher.rewards else "eval"
+    return GameReview(moves, depth, time.perf_counter() - start, unit, mistake, blunder)
+
+
+def print_review(
+    review: GameReview, fout: TextIO = sys.stdout, top: int = TOP_BLUNDERS, all_moves: bool = False
+) -> None:
+    fout.write(f"Reviewed {len(review)} moves at depth {review.depth} in {review.elapsed:.1f}s\n")
+    fout.write(
+        f"Best move played: {review.accuracy:.1%}  mistakes: {review.count('?')}  "
+        f"blunders: {review.count('??')}  total loss: {review.format_loss(review.total_loss)}\n"
+    )
+    if all_moves:
+        fout.write("\n")
+        for move in review.moves:
+            fout.write(f"  {review.describe(move)}\n")
+    worst = review.worst(top)
+    if worst:
+        fout.write("\nBiggest losses:\n")
+        for move in worst:
+            fout.write(f"  {review.describe(move)}\n")
+
+
+def load_positions(path: str, game: int = 0) -> list[Position]:
+    """Positions of a saved session, or of game number game in a selfplay result file."""
+    with open(path, "rb") as fin:
+        is_session = fin.read(len(SESSION_MAGIC)) == SESSION_MAGIC
+    if is_session:
+        snapshot = load_session(path)
+        return history_positions(snapshot.history, snapshot.grid, snapshot.score)
+    index = 0
+    for chunk in read_chunks(path):
+        if game < index + len(chunk):
+            record = chunk[game - index]
+            if not record.get("actions"):
+                raise ValueError(f"Game {game} in {path} was recorded without moves.")
+            return record_positions(record)
+        index += len(chunk)
+    raise ValueError(f"{path} has only {index} games.")
+
+
+def main(argv: list[str] | None = None) -> None:
+    import argparse
+
+    from ntuple import NTupleNetwork
+    from solver import ParallelSolver
+
+    parser = argparse.ArgumentParser(description="Review the moves of a played game")
+    parser.add_argument("path", help="session file, or selfplay.py result file (.gz allowed)")
+    parser.add_argument("--game", type=int, default=0, help="game number in a result file")
+    parser.add_argument("--depth", type=int, default=DEPTH)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--evaluator", help="n-tuple weight file trained by ntuple.py")
+    parser.add_argument("--mistake", type=float, help="loss marked ?, default 100 points")
+    parser.add_argument("--blunder", type=float, help="loss marked ??, default 500 points")
+    parser.add_argument("--top", type=int, default=TOP_BLUNDERS, help="largest losses to list")
+    parser.add_argument("--moves", action="store_true", help="list every move")
+    args = parser.parse_args(argv)
+
+    positions = load_positions(args.path, args.game)
+    if args.workers > 1:
+        solver = ParallelSolver(workers=args.workers, split="root", network=args.evaluator)
+    elif args.evaluator:
+        solver = Solver(evaluator=NTupleNetwork.load(args.evaluator))
+    else:
+        solver = Solver()
+    with solver:
+        review = analyze(positions, solver, args.depth, args.mistake, args.blunder)
+    print_review(review, top=args.top, all_moves=args.moves)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+from __future__ import annotations
+from typing import Any, Protocol
+
+import time
+from random import Random
+
+M64 = (1 << 64) - 1
+GOLDEN_GAMMA = 0x9E3779B97F4A7C15
+RNG_KINDS = ("random", "splitmix")
+
+
+def mix64(z: int) -> int:
+    """SplitMix64 output function."""
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & M64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & M64
+    return z ^ (z >> 31)
+
+
+class SpawnRNG(Protocol):
+    """Source of tile spawns: which free cell, and whether it is a 4."""
+    def spawn(self, free: int, rate_4: float) -> tuple[int, bool]: ...
+    def fork(self) -> SpawnRNG: ...
+    def getstate(self) -> Any: ...
+    def setstate(self, state: Any) -> None: ...
+
+
+class RandomSpawnRNG:
+    """Mersenne Twister spawns, drawing exactly as GameState always has."""
+    def __init__(self, seed: int | float | None = None) -> None:
+        self.generator = Random(time.time() if seed is None else seed)
+
+    def spawn(self, free: int, rate_4: float) -> tuple[int, bool]:
+        index = self.generator.randint(0, free - 1)
+        return index, self.generator.random() <= rate_4
+
+    def fork(self) -> RandomSpawnRNG:
+        return RandomSpawnRNG(self.generator.getrandbits(64))
+
+    def getstate(self) -> Any:
+        return self.generator.getstate()
+
+    def setstate(self, state: Any) -> None:
+        self.generator.setstate(state)
+
+
+class SplitMixRNG:
+    """
+    Counter-based SplitMix64 generator.
+
+    Output n is mix64(key + n * GOLDEN_GAMMA), so the whole state is two ints:
+    copying and forking are cheap, and SplitMixRNG(seed, stream=k) gives
+    independent, reproducible sequences for workers from a single seed. Each spawn uses a
+    single 64-bit draw: the high half picks the cell and the low half the tile.
+    Outputs are computed BLOCK at a time with NumPy, since that is several
+    times cheaper than mixing Python ints one draw at a time.
+    """
+    BLOCK = 1024
+
+    def __init__(self, seed: int | None = None, stream: int = 0) -> None:
+        if seed is None:
+            seed = time.time_ns()
+        self.setstate((mix64((seed & M64) ^ mix64((stream * GOLDEN_GAMMA) & M64)), 0))
+
+    @property
+    def counter(self) -> int:
+        """Number of draws taken so far."""
+        return self._base + self._index
+
+    def _refill(self) -> None:
+        import numpy as np
+
+        self._base += self._index
+        n = np.arange(self._base + 1, self._base + 1 + self.BLOCK, dtype=np.uint64)
+        z = n * np.uint64(GOLDEN_GAMMA) + np.uint64(self.key)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        self._block = (z ^ (z >> np.uint64(31))).tolist()
+        self._index = 0
+
+    def next(self) -> int:
+        if self._index == len(self._block):
+            self._refill()
+        self._index += 1
+        return self._block[self._index - 1]
+
+    def spawn(self, free: int, rate_4: float) -> tuple[int, bool]:
+        index = self._index
+        if index == len(self._block):
+            self._refill()
+            index = 0
+        self._index = index + 1
+        z = self._block[index]
+        return ((z >> 32) * free) >> 32, (z & 0xFFFFFFFF) < rate_4 * 4294967296.0
+
+    def random(self) -> float:
+        """Uniform float in [0, 1)."""
+        return (self.next() >> 11) * (1.0 / 9007199254740992.0)
+
+    def fork(self) -> SplitMixRNG:
+        """Independent child generator; advances this one by a single draw."""
+        child = SplitMixRNG.__new__(SplitMixRNG)
+        child.setstate((self.next(), 0))
+        return child
+
+    def copy(self) -> SplitMixRNG:
+        """Generator that will produce the same sequence as this one."""
+        clone = SplitMixRNG.__new__(SplitMixRNG)
+        clone.setstate(self.getstate())
+        return clone
+
+    def getstate(self) -> tuple[int, int]:
+        return self.key, self.counter
+
+    def setstate(self, state: tuple[int, int]) -> None:
+        self.key, self._base = state
+        self._index = 0
+        self._block: list[int] = []
+
+
+def make_rng(kind: str = "random", seed: int | None = None, stream: int = 0) -> SpawnRNG:
+    """Create a spawn generator by name."""
+    match kind:
+        case "random":
+            if stream:
+                seed = None if seed is None else mix64((seed ^ mix64(stream)) & M64)
+            return RandomSpawnRNG(seed)
+        case "splitmix":
+            return SplitMixRNG(seed, stream)
+    raise ValueError(f"Unknown spawn generator: {kind}")
@@ -0,0 +1,189 @@
+from __future__ import annotations
+from typing import Callable, Iterator, TextIO
+
+import json
+import sys
+import time
+from functools import partial
+from random import Random
+
+import bitboard
+from bitboard import Board
+from gamestate import Action, SPAWN_RATE_4, WIN_EXPONENT
+from heuristics import Evaluator
+from solver import Searcher
+from rng import M64, RNG_KINDS, SpawnRNG, make_rng, mix64
+
+type Policy = Callable[[Board, Random], Action]
+
+ACTION_CODES = {Action.LEFT: "L", Action.RIGHT: "R", Action.UP: "U", Action.DOWN: "D"}
+CODE_ACTIONS = {code: action for action, code in ACTION_CODES.items()}
+# Mixed into the game seed so policy choices never share the spawn stream
+POLICY_SALT = 0x5851F42D4C957F2D
+
+
+def spawn_tile(board: Board, rng: SpawnRNG) -> Board:
+    """Spawn a 2 or 4 on a random empty cell, like GameState.new_tiles."""
+    empty = bitboard.empty_cells(board)
+    index, four = rng.spawn(len(empty), SPAWN_RATE_4)
+    return bitboard.place(board, empty[index], 2 if four else 1)
+
+
+def policy_rng(seed: int) -> Random:
+    """Generator for a policy's random choices, independent of the game's spawns."""
+    return Random(mix64((seed ^ POLICY_SALT) & M64))
+
+
+def random_policy(board: Board, rng: Random) -> Action:
+    return rng.choice(list(bitboard.possible_moves(board)))
+
+
+def greedy_policy(board: Board, rng: Random, evaluator: Evaluator | None = None) -> Action:
+    """Pick the move whose afterstate scores best on the heuristics."""
+    evaluator = evaluator or Evaluator()
+    moves = bitboard.possible_moves(board)
+    return max(moves, key=lambda action: moves[action][1] + evaluator(moves[action][0]))
+
+
+def expectimax_policy(
+    board: Board, rng: Random, depth: int = 2, searcher: Searcher | None = None
+) -> Action:
+    searcher = searcher or Searcher()
+    values = searcher.root(board, depth)
+    return max(values, key=values.get)
+
+
+POLICIES: dict[str, Policy] = {
+    "random": random_policy,
+    "greedy": greedy_policy,
+    "expectimax": expectimax_policy,
+}
+
+
+def make_policy(name: str) -> Policy:
+    """
+    A named policy with its own evaluator or searcher. Make one per game, so
+    a game never depends on the transposition table of the games before it.
+    """
+    match name:
+        case "greedy":
+            return partial(greedy_policy, evaluator=Evaluator())
+        case "expectimax":
+            return partial(expectimax_policy, searcher=Searcher())
+    return POLICIES[name]
+
+
+class GameResult:
+    """Summary of one finished game, stored as a JSON line."""
+    def __init__(
+        self,
+        policy: str,
+        seed: int,
+        score: int,
+        max_tile: int,
+        moves: int,
+        win_move: int | None = None,
+        win_time: float | None = None,
+        duration: float = 0.0,
+        actions: str = "",
+        rng: str = "random",
+    ) -> None:
+        self.policy = policy
+        self.seed = seed
+        self.score = score
+        self.max_tile = max_tile
+        self.moves = moves
+        self.win_move = win_move
+        self.win_time = win_time
+        self.duration = duration
+        # One character per move, see ACTION_CODES
+        self.actions = actions
+        self.rng = rng
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, data: dict) -> GameResult:
+        return cls(**data)
+
+
+def play(
+    policy_name: str, seed: int, record_actions: bool = True, rng_kind: str = "random"
+) -> GameResult:
+    """
+    Play one game to the end with a named policy. Spawns come from their own
+    generator, so a game replays through GameState given its seed and moves.
+    """
+    policy = make_policy(policy_name)
+    rng = policy_rng(seed)
+    spawns = make_rng(rng_kind, seed)
+    board = spawn_tile(spawn_tile(0, spawns), spawns)
+    score = 0
+    actions = []
+    win_move = win_time = None
+    start = time.perf_counter()
+    while True:
+        moves = bitboard.possible_moves(board)
+        if not moves:
+            break
+        action = policy(board, rng)
+        board, gain = moves[action]
+        score += gain
+        actions.append(ACTION_CODES[action])
+        if win_move is None and bitboard.max_exponent(board) >= WIN_EXPONENT:
+            win_move = len(actions)
+            win_time = time.perf_counter() - start
+        board = spawn_tile(board, spawns)
+    return GameResult(
+        policy=policy_name,
+        seed=seed,
+        score=score,
+        max_tile=1 << bitboard.max_exponent(board),
+        moves=len(actions),
+        win_move=win_move,
+        win_time=win_time,
+        duration=time.perf_counter() - start,
+        actions="".join(actions) if record_actions else "",
+        rng=rng_kind,
+    )
+
+
+def run(
+    policy_name: str, seeds: range, record_actions: bool = True, rng_kind: str = "random"
+) -> Iterator[GameResult]:
+    for seed in seeds:
+        yield play(policy_name, seed, record_actions, rng_kind)
+
+
+def write_results(results: Iterator[GameResult], fout: TextIO) -> int:
+    count = 0
+    for result in results:
+        fout.write(json.dumps(result.to_dict()) + "\n")
+        count += 1
+    return count
+
+
+def main(argv: list[str] | None = None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Play games with a bot policy")
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="greedy")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first game")
+    parser.add_argument("--out", help="JSON lines result file (default stdout)")
+    parser.add_argument("--no-actions", action="store_true", help="omit move lists")
+    parser.add_argument("--rng", choices=RNG_KINDS, default="random", help="spawn generator")
+    args = parser.parse_args(argv)
+
+    seeds = range(args.seed, args.seed + args.games)
+    results = run(args.policy, seeds, not args.no_actions, args.rng)
+    if args.out:
+        with open(args.out, "a") as fout:
+            write_results(results, fout)
+    else:
+        write_results(results, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+from __future__ import annotations
+from typing import Any
+
+import json
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+from array import array
+from contextlib import nullcontext
+
+import numpy as np
+
+from gamestate import CELLS, GameState, GameStatus, Grid, GRID_SIZE, History
+from rng import RNG_KINDS, RandomSpawnRNG, SplitMixRNG, SpawnRNG
+
+MAGIC = b"2048SS\x00\x00"
+VERSION = 1
+# magic, version, rng kind, status, reserved, score, moves, win move (-1 for
+# none), history length, settings length, rng state length
+HEADER = struct.Struct("<8sIBBHQQqQII")
+# Mersenne Twister state: gauss flag, next gauss value and 625 state words
+RANDOM_STATE = struct.Struct("<Bd")
+SPLITMIX_STATE = struct.Struct("<QQ")
+AUTOSAVE_INTERVAL = 10.0
+
+
+def _exponents(tiles: Any) -> np.ndarray:
+    tiles = np.asarray(tiles, dtype=np.uint64)
+    exponents = np.zeros(tiles.shape, dtype=np.uint8)
+    nonzero = tiles > 0
+    exponents[nonzero] = np.log2(tiles[nonzero].astype(np.float64)).round().astype(np.uint8)
+    return exponents
+
+
+def _tiles(exponents: np.ndarray) -> np.ndarray:
+    return np.where(exponents > 0, np.left_shift(1, exponents.astype(np.int64)), 0)
+
+
+def _swapped(values: array) -> array:
+    values = array(values.typecode, values)
+    values.byteswap()
+    return values
+
+
+def encode_rng(rng: SpawnRNG) -> tuple[int, bytes]:
+    """Generator kind index and its packed state."""
+    if isinstance(rng, SplitMixRNG):
+        return RNG_KINDS.index("splitmix"), SPLITMIX_STATE.pack(*rng.getstate())
+    if isinstance(rng, RandomSpawnRNG):
+        _, words, gauss = rng.getstate()
+        head = RANDOM_STATE.pack(gauss is not None, gauss or 0.0)
+        return RNG_KINDS.index("random"), head + np.array(words, dtype="<u4").tobytes()
+    raise TypeError(f"Cannot save spawn generator {type(rng).__name__}.")
+
+
+def decode_rng(kind: int, data: bytes) -> SpawnRNG:
+    match RNG_KINDS[kind]:
+        case "splitmix":
+            rng = SplitMixRNG.__new__(SplitMixRNG)
+            rng.setstate(SPLITMIX_STATE.unpack(data))
+            return rng
+        case "random":
+            has_gauss, gauss = RANDOM_STATE.unpack_from(data)
+            words = np.frombuffer(data, dtype="<u4", offset=RANDOM_STATE.size).tolist()
+            rng = RandomSpawnRNG(0)
+            rng.setstate((3, tuple(words), gauss if has_gauss else None))
+            return rng
+    raise ValueError(f"Unknown spawn generator {kind}.")
+
+
+class Snapshot:
+    """Everything a session file holds: game, spawn generator, undo history and settings."""
+    def __init__(
+        self,
+        grid: Grid,
+        score: int,
+        moves: int,
+        status: GameStatus,
+        win_move: int | None,
+        rng_kind: int,
+        rng_state: bytes,
+        history: History,
+        settings: dict[str, Any],
+    ) -> None:
+        self.grid = grid
+        self.score = score
+        self.moves = moves
+        self.status = status
+        self.win_move = win_move
+        self.rng_kind = rng_kind
+        self.rng_state = rng_state
+        self.history = history
+        self.settings = settings
+
+    @classmethod
+    def capture(cls, game_state: GameState, settings: dict[str, Any] | None = None) -> Snapshot:
+        """Copy the parts of a game that may change; cheap enough for the render thread."""
+        rng_kind, rng_state = encode_rng(game_state.rng)
+        return cls(
+            [list(row) for row in game_state.grid],
+            game_state.score,
+            game_state.moves,
+            game_state.status,
+            game_state.win_move,
+            rng_kind,
+            rng_state,
+            game_state.history.copy(),
+            dict(settings or {}),
+        )
+
+    def restore(self, game_state: GameState) -> None:
+        """Put the saved game into an existing GameState."""
+        game_state.rng = decode_rng(self.rng_kind, self.rng_state)
+        game_state.grid = [list(row) for row in self.grid]
+        game_state.score = self.score
+        game_state.moves = self.moves
+        game_state.status = self.status
+        game_state.win_move = self.win_move
+        history = self.history.copy()
+        history.maxlen = game_state.history.maxlen
+        history.trim()
+        game_state.history = history
+        game_state.possible_moves = game_state.get_possible_moves()
+
+    def encode(self) -> bytes:
+        settings = json.dumps(self.settings).encode()
+        history = self.history
+        header = HEADER.pack(
+            MAGIC,
+            VERSION,
+            self.rng_kind,
+            self.status.value,
+            0,
+            self.score,
+            self.moves,
+            -1 if self.win_move is None else self.win_move,
+            len(history),
+            len(settings),
+            len(self.rng_state),
+        )
+        grid = _exponents(self.grid).tobytes()
+        scores, win_moves = history.scores, history.win_moves
+        if sys.byteorder == "big":
+            scores, win_moves = _swapped(scores), _swapped(win_moves)
+        return b"".join(
+            (
+                header,
+                grid,
+                settings,
+                self.rng_state,
+                history.cells,
+                scores.tobytes(),
+                win_moves.tobytes(),
+            )
+        )
+
+    @classmethod
+    def decode(cls, data: bytes) -> Snapshot:
+        if len(data) < HEADER.size:
+            raise ValueError("Not a session file.")
+        (
+            magic, version, rng_kind, status, _, score, moves, win_move, history_length,
+            settings_length, rng_length,
+        ) = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a session file.")
+        if version != VERSION:
+            raise ValueError(f"Unsupported session version {version}.")
+        offset = HEADER.size
+        grid = _tiles(np.frombuffer(data, np.uint8, CELLS, offset)).reshape(GRID_SIZE, GRID_SIZE)
+        offset += CELLS
+        settings = json.loads(data[offset:offset + settings_length])
+        offset += settings_length
+        rng_state = bytes(data[offset:offset + rng_length])
+        offset += rng_length
+        # History columns are copied in bulk, without a Python object per move
+        history = History(None)
+        history.cells[:] = data[offset:offset + CELLS * history_length]
+        offset += CELLS * history_length
+        history.scores.frombytes(data[offset:offset + 8 * history_length])
+        offset += 8 * history_length
+        history.win_moves.frombytes(data[offset:offset + 8 * history_length])
+        if sys.byteorder == "big":
+            history.scores.byteswap()
+            history.win_moves.byteswap()
+        return cls(
+            grid.tolist(),
+            score,
+            moves,
+            GameStatus(status),
+            None if win_move < 0 else win_move,
+            rng_kind,
+            rng_state,
+            history,
+            settings,
+        )
+
+
+def save_session(path: str, snapshot: Snapshot) -> None:
+    """Atomically write a snapshot to path."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as fout:
+        fout.write(snapshot.encode())
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tmp, path)
+
+
+def load_session(path: str) -> Snapshot:
+    with open(path, "rb") as fin:
+        return Snapshot.decode(fin.read())
+
+
+class Autosaver:
+    """
+    Periodic background saves. The render loop only captures a snapshot,
+    under the game lock; encoding and writing happen on a writer thread, and a
+    capture is skipped while the previous one is still being written.
+    """
+    def __init__(self, path: str, interval: float = AUTOSAVE_INTERVAL) -> None:
+        self.path = path
+        self.interval = interval
+        self.last_save = time.perf_counter()
+        self.saved_key: tuple | None = None
+        self.saves = 0
+        self.errors = 0
+        self.pending: queue.Queue[Snapshot | None] = queue.Queue(maxsize=1)
+        self.thread = threading.Thread(target=self._run, name="autosave", daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        while (snapshot := self.pending.get()) is not None:
+            try:
+                save_session(self.path, snapshot)
+                self.saves += 1
+            except Exception as e:
+                # Keep the writer alive: a later snapshot may save fine
+                self.errors += 1
+                print(f"Autosave to {self.path} failed: {type(e).__name__}: {e}")
+            finally:
+                self.pending.task_done()
+
+    def tick(
+        self, game_state: GameState, settings: dict[str, Any], lock: threading.RLock | None = None
+    ) -> bool:
+        """Queue a save if the interval passed and the game changed; True if queued."""
+        now = time.perf_counter()
+        if self.interval <= 0 or now - self.last_save < self.interval or self.pending.full():
+            return False
+        self.last_save = now
+        return self.save(game_state, settings, lock)
+
+    def save(
+        self, game_state: GameState, settings: dict[str, Any], lock: threading.RLock | None = None
+    ) -> bool:
+        """Queue a snapshot unless the game is unchanged since the last save."""
+        with lock or nullcontext():
+            key = (
+                game_state.moves,
+                game_state.score,
+                len(game_state.history),
+                tuple(tile for row in game_state.grid for tile in row),
+            )
+            if key == self.saved_key:
+                return False
+            snapshot = Snapshot.capture(game_state, settings)
+        try:
+            self.pending.put_nowait(snapshot)
+        except queue.Full:
+            return False
+        self.saved_key = key
+        return True
+
+    def wait(self) -> None:
+        """Block until queued saves are written."""
+        self.pending.join()
+
+    def close(self) -> None:
+        """Finish pending writes and stop the writer thread."""
+        self.wait()
+        self.pending.put(None)
+        self.thread.join()
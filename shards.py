@@ -0,0 +1,345 @@
+from __future__ import annotations
+from typing import Iterator
+
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+from multiprocessing import Process
+
+from rng import RNG_KINDS
+from selfplay import POLICIES, run, write_results
+
+# Queue directory layout. A shard moves pending -> claimed -> done, or to
+# failed after MAX_ATTEMPTS. Every move is a rename within one directory
+# tree, which is atomic on local and network filesystems alike.
+MANIFEST = "queue.json"
+PENDING = "pending"
+CLAIMED = "claimed"
+DONE = "done"
+FAILED = "failed"
+RESULTS = "results"
+# Seconds a claim stays valid without a heartbeat
+LEASE = 60.0
+POLL_INTERVAL = 1.0
+MAX_ATTEMPTS = 3
+SHARD_SIZE = 100
+
+
+def _shard_name(shard: int) -> str:
+    return f"{shard:06d}.json"
+
+
+def _write_json(path: str, data: dict) -> None:
+    """Write a JSON file atomically; the temporary name is hidden from scans."""
+    directory, name = os.path.split(path)
+    tmp = os.path.join(directory, f".{name}.{socket.gethostname()}-{os.getpid()}.tmp")
+    with open(tmp, "w") as fout:
+        json.dump(data, fout)
+    os.replace(tmp, path)
+
+
+def _read_json(path: str) -> dict:
+    with open(path) as fin:
+        return json.load(fin)
+
+
+def _jobs(directory: str) -> list[str]:
+    """Shard files in a state directory, in shard order."""
+    return sorted(name for name in os.listdir(directory) if not name.startswith("."))
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def submit(
+    queue_dir: str,
+    policy: str,
+    games: int,
+    seed: int = 0,
+    shard_size: int = SHARD_SIZE,
+    rng_kind: str = "random",
+    record_actions: bool = True,
+) -> int:
+    """Coordinator: split a run into shards of shard_size games. Returns the shard count."""
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown policy {policy}.")
+    if os.path.exists(os.path.join(queue_dir, MANIFEST)):
+        raise FileExistsError(f"{queue_dir} already holds a run.")
+    for state in (PENDING, CLAIMED, DONE, FAILED, RESULTS):
+        os.makedirs(os.path.join(queue_dir, state), exist_ok=True)
+    starts = range(seed, seed + games, shard_size)
+    for shard, start in enumerate(starts):
+        job = {
+            "shard": shard,
+            "policy": policy,
+            "seed": start,
+            "games": min(shard_size, seed + games - start),
+            "rng": rng_kind,
+            "record_actions": record_actions,
+            "attempts": 0,
+        }
+        _write_json(os.path.join(queue_dir, PENDING, _shard_name(shard)), job)
+    # Written last: workers and merge treat the run as complete once it exists
+    _write_json(
+        os.path.join(queue_dir, MANIFEST),
+        {"shards": len(starts), "policy": policy, "games": games, "seed": seed},
+    )
+    return len(starts)
+
+
+class Claim:
+    """
+    A shard owned by one worker, kept alive by touching the claim file.
+
+    Another worker may reclaim it once the file is older than the lease;
+    lost is then set and the owner drops the shard's bookkeeping. Results
+    are deterministic per seed, so a shard run twice writes the same file.
+    """
+    def __init__(self, queue_dir: str, name: str, path: str, lease: float) -> None:
+        self.queue_dir = queue_dir
+        self.name = name
+        self.path = path
+        self.lease = lease
+        self.job = _read_json(path)
+        self.lost = False
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._heartbeat, name="heartbeat", daemon=True)
+
+    def _heartbeat(self) -> None:
+        while not self._stopped.wait(self.lease / 4):
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                self.lost = True
+                return
+
+    def __enter__(self) -> Claim:
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def complete(self) -> bool:
+        """Move the shard to done; False if it was reclaimed meanwhile."""
+        try:
+            os.rename(self.path, os.path.join(self.queue_dir, DONE, self.name))
+            return True
+        except FileNotFoundError:
+            self.lost = True
+            return False
+
+    def release(self, error: str | None = None) -> None:
+        """Give the shard back after a failure, counting the attempt."""
+        _requeue(self.queue_dir, self.path, self.name, error)
+
+
+def _requeue(queue_dir: str, path: str, name: str, error: str | None = None) -> bool:
+    """Atomically take a claim and put its shard back in pending, or in failed."""
+    # Only one of several workers reclaiming the same shard wins this rename
+    hidden = os.path.join(queue_dir, PENDING, f".{name}.{default_worker_id()}.requeue")
+    try:
+        os.rename(path, hidden)
+    except FileNotFoundError:
+        return False
+    job = _read_json(hidden)
+    job["attempts"] += 1
+    if error is not None:
+        job["error"] = error
+    state = FAILED if job["attempts"] >= MAX_ATTEMPTS else PENDING
+    _write_json(os.path.join(queue_dir, state, name), job)
+    os.remove(hidden)
+    return True
+
+
+def reclaim(queue_dir: str, lease: float = LEASE) -> int:
+    """Return shards whose claim had no heartbeat within lease seconds to pending."""
+    claimed = os.path.join(queue_dir, CLAIMED)
+    now = time.time()
+    count = 0
+    for entry in _jobs(claimed):
+        path = os.path.join(claimed, entry)
+        try:
+            age = now - os.stat(path).st_mtime
+        except FileNotFoundError:
+            continue
+        if age > lease:
+            # Claims are named SHARD@WORKER; requeue a stray file under its own name
+            name, _, worker = entry.partition("@")
+            count += _requeue(queue_dir, path, name, f"lease expired, held by {worker or 'unknown worker'}")
+    return count
+
+
+def claim(queue_dir: str, worker_id: str, lease: float = LEASE) -> Claim | None:
+    """Take the first pending shard, or None when nothing is pending."""
+    pending = os.path.join(queue_dir, PENDING)
+    for name in _jobs(pending):
+        path = os.path.join(queue_dir, CLAIMED, f"{name}@{worker_id}")
+        try:
+            os.rename(os.path.join(pending, name), path)
+        except FileNotFoundError:
+            # Another worker was faster
+            continue
+        # A rename keeps the old mtime; the lease starts now
+        os.utime(path)
+        return Claim(queue_dir, name, path, lease)
+    return None
+
+
+def run_shard(queue_dir: str, job: dict) -> int:
+    """Play a shard's games into its result file. Returns the number of games."""
+    name = _shard_name(job["shard"]).replace(".json", ".jsonl")
+    path = os.path.join(queue_dir, RESULTS, name)
+    tmp = os.path.join(queue_dir, RESULTS, f".{name}.{default_worker_id()}.tmp")
+    seeds = range(job["seed"], job["seed"] + job["games"])
+    with open(tmp, "w") as fout:
+        count = write_results(run(job["policy"], seeds, job["record_actions"], job["rng"]), fout)
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tmp, path)
+    return count
+
+
+def status(queue_dir: str) -> dict[str, int]:
+    """Number of shards in each state."""
+    manifest = _read_json(os.path.join(queue_dir, MANIFEST))
+    counts = {"shards": manifest["shards"]}
+    for state in (PENDING, CLAIMED, DONE, FAILED):
+        counts[state] = len(_jobs(os.path.join(queue_dir, state)))
+    return counts
+
+
+def run_worker(
+    queue_dir: str,
+    worker_id: str | None = None,
+    lease: float = LEASE,
+    poll_interval: float = POLL_INTERVAL,
+    wait: bool = True,
+) -> int:
+    """
+    Work shards until none are left. Returns the number of shards completed.
+
+    With wait, a worker that finds nothing pending stays while other claims
+    are open, so shards of a worker that died are picked up once their lease
+    expires. Without it, the worker exits as soon as nothing is pending.
+    """
+    worker_id = worker_id or default_worker_id()
+    completed = 0
+    while True:
+        reclaim(queue_dir, lease)
+        current = claim(queue_dir, worker_id, lease)
+        if current is None:
+            counts = status(queue_dir)
+            if not wait or counts[CLAIMED] == 0:
+                return completed
+            time.sleep(poll_interval)
+            continue
+        with current:
+            try:
+                run_shard(queue_dir, current.job)
+            except Exception as e:
+                current.release(f"{type(e).__name__}: {e}")
+                continue
+        if current.complete():
+            completed += 1
+
+
+def result_files(queue_dir: str) -> Iterator[str]:
+    results = os.path.join(queue_dir, RESULTS)
+    for name in _jobs(results):
+        yield os.path.join(results, name)
+
+
+def merge(queue_dir: str, out: str, partial: bool = False) -> int:
+    """
+    Concatenate result shards in shard order into one result file, usable by
+    analytics.py and openings.py. Returns the number of shards merged.
+    """
+    counts = status(queue_dir)
+    if counts[DONE] < counts["shards"] and not partial:
+        raise RuntimeError(
+            f"Only {counts[DONE]} of {counts['shards']} shards are done ({counts[FAILED]} failed)."
+        )
+    done = {name.replace(".json", ".jsonl") for name in _jobs(os.path.join(queue_dir, DONE))}
+    merged = 0
+    tmp = f"{out}.tmp"
+    with open(tmp, "wb") as fout:
+        for path in result_files(queue_dir):
+            if os.path.basename(path) in done:
+                with open(path, "rb") as fin:
+                    shutil.copyfileobj(fin, fout)
+                merged += 1
+    os.replace(tmp, out)
+    return merged
+
+
+def main(argv: list[str] | None = None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Self-play over a shared directory of work shards")
+    sub = parser.add_subparsers(dest="command", required=True)
+    submit_parser = sub.add_parser("submit", help="split a run into shards")
+    submit_parser.add_argument("queue")
+    submit_parser.add_argument("--policy", choices=sorted(POLICIES), default="greedy")
+    submit_parser.add_argument("--games", type=int, default=1000)
+    submit_parser.add_argument("--seed", type=int, default=0, help="seed of the first game")
+    submit_parser.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="games per shard")
+    submit_parser.add_argument("--rng", choices=RNG_KINDS, default="random", help="spawn generator")
+    submit_parser.add_argument("--no-actions", action="store_true", help="omit move lists")
+    work_parser = sub.add_parser("work", help="run shards until the queue is empty")
+    work_parser.add_argument("queue")
+    work_parser.add_argument("--processes", type=int, default=1, help="worker processes on this machine")
+    work_parser.add_argument("--worker-id", help="default HOST-PID")
+    work_parser.add_argument("--lease", type=float, default=LEASE, help="seconds before a silent claim is reclaimed")
+    work_parser.add_argument("--poll", type=float, default=POLL_INTERVAL)
+    work_parser.add_argument("--no-wait", action="store_true", help="exit once nothing is pending")
+    status_parser = sub.add_parser("status", help="count shards per state")
+    status_parser.add_argument("queue")
+    reclaim_parser = sub.add_parser("reclaim", help="requeue shards with expired claims")
+    reclaim_parser.add_argument("queue")
+    reclaim_parser.add_argument("--lease", type=float, default=LEASE)
+    merge_parser = sub.add_parser("merge", help="combine result shards into one file")
+    merge_parser.add_argument("queue")
+    merge_parser.add_argument("out")
+    merge_parser.add_argument("--partial", action="store_true", help="merge finished shards only")
+    args = parser.parse_args(argv)
+
+    match args.command:
+        case "submit":
+            shards = submit(
+                args.queue, args.policy, args.games, args.seed, args.shard_size, args.rng, not args.no_actions
+            )
+            print(f"Submitted {shards} shards to {args.queue}")
+        case "work":
+            worker_args = (args.queue, args.worker_id, args.lease, args.poll, not args.no_wait)
+            if args.processes <= 1:
+                print(f"Completed {run_worker(*worker_args)} shards")
+            else:
+                processes = [
+                    Process(target=run_worker, args=(args.queue, None) + worker_args[2:])
+                    for _ in range(args.processes)
+                ]
+                for process in processes:
+                    process.start()
+                for process in processes:
+                    process.join()
+        case "status":
+            counts = status(args.queue)
+            print("  ".join(f"{state}: {count}" for state, count in counts.items()))
+        case "reclaim":
+            print(f"Requeued {reclaim(args.queue, args.lease)} shards")
+        case "merge":
+            try:
+                shards = merge(args.queue, args.out, args.partial)
+            except RuntimeError as e:
+                parser.exit(1, f"{e}\n")
+            print(f"Merged {shards} shards into {args.out}")
+
+
+if __name__ == "__main__":
+    main()
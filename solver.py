@@ -0,0 +1,447 @@
+from __future__ import annotations
+from typing import Callable, Protocol
+
+import multiprocessing
+import os
+import struct
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import bitboard
+from bitboard import Board
+from gamestate import Action, SPAWN_RATE_4
+from heuristics import Evaluator, Weights
+
+SPAWN_RATE_2 = 1 - SPAWN_RATE_4
+LOSS_VALUE = -1000.0
+MAX_DEPTH = 8
+DEADLINE_CHECK_INTERVAL = 256
+M64 = (1 << 64) - 1
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+
+# Heuristic Evaluator, a learned ntuple.NTupleNetwork, or any other static
+# value of an afterstate. An evaluator whose score_scaled attribute is true
+# estimates the score still to come, and search adds move rewards to it.
+type BoardEvaluator = Callable[[Board], float]
+
+
+class SearchTimeout(Exception):
+    """Raised inside a search when its deadline passes."""
+
+
+class Table(Protocol):
+    def get(self, board: Board, depth: int) -> float | None: ...
+    def store(self, board: Board, depth: int, value: float) -> None: ...
+
+
+class TranspositionTable:
+    """Process-local table of chance node values keyed by afterstate board."""
+    def __init__(self, max_entries: int = 1 << 20) -> None:
+        self.max_entries = max_entries
+        self.entries: dict[Board, tuple[int, float]] = {}
+
+    def get(self, board: Board, depth: int) -> float | None:
+        entry = self.entries.get(board)
+        if entry is not None and entry[0] >= depth:
+            return entry[1]
+        return None
+
+    def store(self, board: Board, depth: int, value: float) -> None:
+        if len(self.entries) >= self.max_entries:
+            self.entries.clear()
+        self.entries[board] = (depth, value)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+
+class SharedTranspositionTable:
+    """
+    Fixed-size table in shared memory, usable from several processes.
+
+    Each slot holds (key ^ data, data) so a slot torn by concurrent writers
+    fails the key check instead of returning another board's value. Data packs
+    the value as float32 above the search depth.
+    """
+    def __init__(self, size_log2: int = 20, name: str | None = None) -> None:
+        self.size_log2 = size_log2
+        self.mask = (1 << size_log2) - 1
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=16 << size_log2)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.slots = self.shm.buf.cast("Q")
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def _index(self, board: Board) -> int:
+        return (((board * HASH_MULTIPLIER) & M64) >> (64 - self.size_log2)) << 1
+
+    def get(self, board: Board, depth: int) -> float | None:
+        i = self._index(board)
+        data = self.slots[i + 1]
+        if self.slots[i] ^ data != board or (data & 0xFF) < depth:
+            return None
+        return struct.unpack("f", struct.pack("I", data >> 32))[0]
+
+    def store(self, board: Board, depth: int, value: float) -> None:
+        i = self._index(board)
+        data = (struct.unpack("I", struct.pack("f", value))[0] << 32) | depth
+        self.slots[i + 1] = data
+        self.slots[i] = board ^ data
+
+    def clear(self) -> None:
+        self.shm.buf[:] = bytes(len(self.shm.buf))
+
+    def close(self) -> None:
+        self.slots.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class Searcher:
+    """Depth-limited expectimax over packed boards."""
+    def __init__(
+        self,
+        evaluator: BoardEvaluator | None = None,
+        table: Table | None = None,
+        min_probability: float = 1e-4,
+    ) -> None:
+        self.evaluator = evaluator or Evaluator()
+        self.rewards: bool = getattr(self.evaluator, "score_scaled", False)
+        self.table = table if table is not None else TranspositionTable()
+        self.min_probability = min_probability
+        self.deadline: float | None = None
+        self.nodes = 0
+
+    def _tick(self) -> None:
+        self.nodes += 1
+        if (
+            self.deadline is not None
+            and self.nodes % DEADLINE_CHECK_INTERVAL == 0
+            and time.time() > self.deadline
+        ):
+            raise SearchTimeout
+
+    def gain(self, reward: int) -> float:
+        """Part of a move's reward counted in its value."""
+        return reward if self.rewards else 0.0
+
+    def max_node(self, board: Board, depth: int, probability: float = 1.0) -> float:
+        """Value of a board where the player is to move."""
+        self._tick()
+        # Uncached on purpose: post-spawn boards inside a search rarely repeat
+        # (the table already merges transpositions), so an LRU lookup costs
+        # more than it saves here; see bitboard.SuccessorCache
+        moves = bitboard.possible_moves(board)
+        if not moves:
+            return LOSS_VALUE
+        return max(
+            self.gain(reward) + self.chance_node(after, depth, probability)
+            for after, reward in moves.values()
+        )
+
+    def chance_node(self, board: Board, depth: int, probability: float = 1.0) -> float:
+        """Value of an afterstate, averaged over tile spawns."""
+        if depth <= 0 or probability < self.min_probability:
+            return self.evaluator(board)
+        cached = self.table.get(board, depth)
+        if cached is not None:
+            return cached
+
+        empty = bitboard.empty_cells(board)
+        p = probability / len(empty)
+        total = 0.0
+        for index in empty:
+            total += SPAWN_RATE_2 * self.max_node(
+                bitboard.place(board, index, 1), depth - 1, p * SPAWN_RATE_2
+            )
+            total += SPAWN_RATE_4 * self.max_node(
+                bitboard.place(board, index, 2), depth - 1, p * SPAWN_RATE_4
+            )
+        value = total / len(empty)
+        self.table.store(board, depth, value)
+        return value
+
+    def root(self, board: Board, depth: int) -> dict[Action, float]:
+        """Value of each legal action at the given depth."""
+        return {
+            action: self.gain(reward) + self.chance_node(after, depth)
+            for action, (after, reward) in bitboard.successor_cache(board).items()
+        }
+
+    def static_values(self, board: Board) -> dict[Action, float]:
+        """Value of each legal action without searching past its afterstate."""
+        return self.root(board, 0)
+
+
+class Hint:
+    """Result of a hint search."""
+    def __init__(
+        self,
+        action: Action | None,
+        values: dict[Action, float],
+        depth: int,
+        elapsed: float,
+        nodes: int = 0,
+        objective: str | None = None,
+    ) -> None:
+        self.action = action
+        self.values = values
+        self.depth = depth
+        self.elapsed = elapsed
+        self.nodes = nodes
+        # Set for exact tablebase answers: "win" or "score"
+        self.objective = objective
+
+    def __repr__(self) -> str:
+        name = self.action.name if self.action else None
+        return f"Hint({name}, depth={self.depth}, elapsed={self.elapsed:.3f}s)"
+
+
+def _best(values: dict[Action, float]) -> Action | None:
+    return max(values, key=values.get) if values else None
+
+
+class Solver:
+    """
+    Iterative deepening expectimax hint solver. Leaves are scored by evaluator
+    when given, otherwise by the heuristic Evaluator with weights.
+    """
+    def __init__(
+        self,
+        weights: Weights | None = None,
+        max_depth: int = MAX_DEPTH,
+        evaluator: BoardEvaluator | None = None,
+    ):
+        self.weights = weights or Weights()
+        self.max_depth = max_depth
+        self.searcher = Searcher(evaluator or Evaluator(self.weights))
+
+    def search(self, board: Board, depth: int) -> dict[Action, float]:
+        self.searcher.deadline = None
+        return self.searcher.root(board, depth)
+
+    def analyze(self, boards: list[Board], depth: int) -> list[dict[Action, float]]:
+        """Root values of many positions at a fixed depth, sharing one table."""
+        return [self.search(board, depth) for board in boards]
+
+    def hint(self, board: Board, time_budget: float = 0.2) -> Hint:
+        """Best action found by iterative deepening within time_budget seconds."""
+        start = time.time()
+        self.searcher.deadline = start + time_budget
+        self.searcher.nodes = 0
+        values: dict[Action, float] = {}
+        depth = 0
+        try:
+            for d in range(1, self.max_depth + 1):
+                values = self.searcher.root(board, d)
+                depth = d
+                if len(values) <= 1:
+                    break
+        except SearchTimeout:
+            pass
+        finally:
+            self.searcher.deadline = None
+        if not values and depth == 0:
+            # Not even depth 1 finished; fall back to a static evaluation
+            values = self.searcher.static_values(board)
+        return Hint(_best(values), values, depth, time.time() - start, self.searcher.nodes)
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> Solver:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+# Worker process state for ParallelSolver
+_worker: Searcher | None = None
+
+
+def _init_worker(
+    weights: dict[str, float], table_name: str, size_log2: int, network: str | None = None
+) -> None:
+    global _worker
+    table = SharedTranspositionTable(size_log2, name=table_name)
+    if network:
+        # Imported here since ntuple trains through selfplay, which imports this module
+        from ntuple import NTupleNetwork
+
+        evaluator = NTupleNetwork.load(network)
+    else:
+        evaluator = Evaluator(Weights.from_dict(weights))
+    _worker = Searcher(evaluator, table)
+
+
+def _search_task(
+    board: Board, depth: int, probability: float, is_chance: bool, deadline: float | None
+) -> float | None:
+    _worker.deadline = deadline
+    try:
+        if is_chance:
+            return _worker.chance_node(board, depth, probability)
+        return _worker.max_node(board, depth, probability)
+    except SearchTimeout:
+        return None
+
+
+def _analyze_task(boards: list[Board], depth: int) -> list[dict[Action, float]]:
+    _worker.deadline = None
+    return [_worker.root(board, depth) for board in boards]
+
+
+class ParallelSolver(Solver):
+    """
+    Hint solver that spreads each iteration over a pool of worker processes.
+
+    With split="root" each legal root action is one task. With split="spawn"
+    the root chance nodes are expanded in this process and every distinct
+    post-spawn board becomes a task, which keeps many more workers busy. All
+    workers share one transposition table in shared memory. With network, the
+    path of an n-tuple weight file, every worker maps it as its evaluator.
+    """
+    def __init__(
+        self,
+        weights: Weights | None = None,
+        max_depth: int = MAX_DEPTH,
+        workers: int | None = None,
+        split: str = "spawn",
+        table_size_log2: int = 22,
+        network: str | None = None,
+    ) -> None:
+        evaluator = None
+        if network:
+            from ntuple import NTupleNetwork
+
+            evaluator = NTupleNetwork.load(network)
+        super().__init__(weights, max_depth, evaluator)
+        if split not in ("root", "spawn"):
+            raise ValueError(f"Unknown split mode: {split}")
+        self.split = split
+        self.workers = workers or os.cpu_count() or 1
+        self.table = SharedTranspositionTable(table_size_log2)
+        # Forking copies the GUI, autosave and engine threads' locks mid-use
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.weights.as_dict(), self.table.name, table_size_log2, network),
+        )
+
+    def _tasks(self, board: Board) -> dict[Action, tuple[float, list[tuple[float, Board]]]]:
+        """Counted reward and weighted split boards under each root action."""
+        plan = {}
+        for action, (after, reward) in bitboard.successor_cache(board).items():
+            gain = self.searcher.gain(reward)
+            if self.split == "root":
+                plan[action] = (gain, [(1.0, after)])
+                continue
+            empty = bitboard.empty_cells(after)
+            plan[action] = (
+                gain,
+                [
+                    (rate / len(empty), bitboard.place(after, index, exponent))
+                    for index in empty
+                    for exponent, rate in ((1, SPAWN_RATE_2), (2, SPAWN_RATE_4))
+                ],
+            )
+        return plan
+
+    def _iterate(
+        self,
+        plan: dict[Action, tuple[float, list[tuple[float, Board]]]],
+        depth: int,
+        deadline: float | None,
+    ) -> dict[Action, float] | None:
+        is_chance = self.split == "root"
+        task_depth = depth if is_chance else depth - 1
+        futures: dict[Board, Future] = {}
+        for _, children in plan.values():
+            for weight, child in children:
+                if child not in futures:
+                    futures[child] = self.pool.submit(
+                        _search_task, child, task_depth, weight, is_chance, deadline
+                    )
+        timeout = None if deadline is None else max(0.0, deadline - time.time())
+        done, pending = wait(futures.values(), timeout=timeout)
+        if pending:
+            for future in pending:
+                future.cancel()
+            return None
+        results = {child: future.result() for child, future in futures.items()}
+        if any(value is None for value in results.values()):
+            return None
+        return {
+            action: gain + sum(weight * results[child] for weight, child in children)
+            for action, (gain, children) in plan.items()
+        }
+
+    def search(self, board: Board, depth: int) -> dict[Action, float]:
+        return self._iterate(self._tasks(board), depth, None)
+
+    def analyze(
+        self, boards: list[Board], depth: int, chunk_size: int | None = None
+    ) -> list[dict[Action, float]]:
+        """
+        Root values of many positions, in contiguous chunks spread over the
+        workers. Neighbouring positions of a game stay in one worker, and all
+        workers share the transposition table.
+        """
+        chunk_size = chunk_size or max(1, -(-len(boards) // (4 * self.workers)))
+        futures = [
+            self.pool.submit(_analyze_task, boards[i:i + chunk_size], depth)
+            for i in range(0, len(boards), chunk_size)
+        ]
+        return [values for future in futures for values in future.result()]
+
+    def hint(self, board: Board, time_budget: float = 0.2) -> Hint:
+        start = time.time()
+        deadline = start + time_budget
+        plan = self._tasks(board)
+        values: dict[Action, float] = {}
+        depth = 0
+        if len(plan) == 1:
+            values = {action: 0.0 for action in plan}
+        else:
+            for d in range(1, self.max_depth + 1):
+                result = self._iterate(plan, d, deadline)
+                if result is None:
+                    break
+                values, depth = result, d
+        if not values:
+            values = self.searcher.static_values(board)
+        return Hint(_best(values), values, depth, time.time() - start)
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        self.table.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare hint search depth per budget")
+    parser.add_argument("--budget", type=float, default=0.2)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--split", choices=("root", "spawn"), default="spawn")
+    args = parser.parse_args()
+
+    board = bitboard.pack([[2, 4, 8, 16], [0, 0, 4, 32], [0, 2, 0, 64], [0, 0, 2, 128]])
+    with Solver() as solver:
+        print("sequential", solver.hint(board, args.budget))
+    with ParallelSolver(workers=args.workers, split=args.split) as solver:
+        solver.hint(board, args.budget)  # Warm up the pool
+        solver.table.clear()
+        print(f"parallel x{args.workers}", solver.hint(board, args.budget))
@@ -0,0 +1,282 @@
+from __future__ import annotations
+
+import math
+import threading
+import time
+from random import Random
+
+import pygame
+
+import bitboard
+from bitboard import Board
+from gamestate import GRID_SIZE
+from rng import SpawnRNG, make_rng
+from selfplay import Policy, make_policy, policy_rng, spawn_tile
+from theme import Theme
+
+MINI_TILE_SIZE = 20
+MINI_PADDING = 2
+BOARD_GAP = 8
+# Steps a finished game stays on screen before it restarts
+RESTART_DELAY = 10
+
+
+class BatchSimulator:
+    """
+    Many games of one policy stepped together on packed boards.
+
+    Game k starts from seed + k with the same policy and spawn generators as
+    selfplay.play, so a watched game can be replayed from its seed. Finished
+    games restart with the next unused seed when restart is set.
+    """
+    def __init__(
+        self,
+        policy_name: str,
+        games: int,
+        seed: int = 0,
+        rng_kind: str = "random",
+        restart: bool = True,
+        steps_per_second: float = 10.0,
+    ) -> None:
+        self.policy_name = policy_name
+        self.rng_kind = rng_kind
+        self.restart = restart
+        self.steps_per_second = steps_per_second
+        self.next_seed = seed
+        self.boards: list[Board] = [0] * games
+        self.scores = [0] * games
+        self.moves = [0] * games
+        self.seeds = [0] * games
+        self.over = [False] * games
+        self._over_steps = [0] * games
+        self._rngs: list[Random | None] = [None] * games
+        self._policies: list[Policy | None] = [None] * games
+        self._spawns: list[SpawnRNG | None] = [None] * games
+        for k in range(games):
+            self._new_game(k)
+        self.finished = 0
+        self.finished_score = 0
+        self.total_moves = 0
+        self.stopped = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    def _new_game(self, k: int) -> None:
+        seed = self.next_seed
+        self.next_seed += 1
+        spawns = make_rng(self.rng_kind, seed)
+        self.seeds[k] = seed
+        self._rngs[k] = policy_rng(seed)
+        self._policies[k] = make_policy(self.policy_name)
+        self._spawns[k] = spawns
+        self.scores[k] = 0
+        self.moves[k] = 0
+        self.over[k] = False
+        self._over_steps[k] = 0
+        self.boards[k] = spawn_tile(spawn_tile(0, spawns), spawns)
+
+    def step(self) -> int:
+        """Advance every live game by one move; returns the number of moves made."""
+        made = 0
+        for k, board in enumerate(self.boards):
+            if self.over[k]:
+                self._over_steps[k] += 1
+                if self.restart and self._over_steps[k] > RESTART_DELAY:
+                    self._new_game(k)
+                continue
+            moves = bitboard.possible_moves(board)
+            if not moves:
+                self.over[k] = True
+                self.finished += 1
+                self.finished_score += self.scores[k]
+                continue
+            self._move(k, board, moves)
+            made += 1
+        self.total_moves += made
+        return made
+
+    def _move(self, k: int, board: Board, moves: bitboard.Successors) -> None:
+        """Play one move of game k; timed as the profiler's step phase like GameState.step."""
+        action = self._policies[k](board, self._rngs[k])
+        after, gain = moves[action]
+        self.scores[k] += gain
+        self.moves[k] += 1
+        self.boards[k] = spawn_tile(after, self._spawns[k])
+
+    def _run(self) -> None:
+        next_step = time.perf_counter()
+        while not self.stopped.is_set():
+            if self.steps_per_second > 0:
+                delay = next_step - time.perf_counter()
+                if delay > 0:
+                    self.stopped.wait(delay)
+                    continue
+                next_step = max(next_step, time.perf_counter() - 1.0) + 1.0 / self.steps_per_second
+            if not self.step() and not self.restart and all(self.over):
+                break
+
+    def start(self) -> None:
+        """Step the games on a background thread until stop."""
+        self.thread = threading.Thread(target=self._run, name="simulator", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+class TileAtlas:
+    """Pre-rendered tile surfaces, one per exponent, shared by every board."""
+    def __init__(self, theme: Theme, tile_size: int = MINI_TILE_SIZE) -> None:
+        self.tile_size = tile_size
+        radius = max(1, theme.radius * tile_size // 64)
+        font = pygame.font.Font(theme.font_name, max(6, tile_size * 2 // 5))
+        self.tiles: list[pygame.Surface] = []
+        for exponent in range(bitboard.MAX_EXPONENT + 1):
+            surface = pygame.Surface((tile_size, tile_size), pygame.SRCALPHA)
+            if exponent:
+                tile_color, text_color = theme[1 << exponent]
+            else:
+                tile_color, text_color = theme.blank_tile, theme.dark_text
+            pygame.draw.rect(surface, tile_color, surface.get_rect(), border_radius=radius)
+            if exponent:
+                label = _short_label(1 << exponent)
+                text = font.render(label, True, text_color)
+                if text.get_width() > tile_size:
+                    text = pygame.transform.smoothscale(
+                        text, (tile_size, text.get_height() * tile_size // text.get_width())
+                    )
+                surface.blit(text, text.get_rect(center=surface.get_rect().center))
+            if pygame.display.get_surface() is not None:
+                surface = surface.convert_alpha()
+            self.tiles.append(surface)
+
+    def __getitem__(self, exponent: int) -> pygame.Surface:
+        return self.tiles[exponent]
+
+
+def _short_label(tile: int) -> str:
+    return f"{tile // 1024}k" if tile >= 16384 else str(tile)
+
+
+class MiniBoard:
+    """One small board that only redraws the cells that changed."""
+    def __init__(self, x: int, y: int, tile_size: int = MINI_TILE_SIZE, padding: int = MINI_PADDING):
+        self.tile_size = tile_size
+        self.padding = padding
+        size = GRID_SIZE * tile_size + (GRID_SIZE + 1) * padding
+        self.rect = pygame.Rect(x, y, size, size)
+        self.drawn: Board | None = None
+        self.drawn_over = False
+
+    def invalidate(self) -> None:
+        self.drawn = None
+
+    def draw(
+        self, surface: pygame.Surface, theme: Theme, atlas: TileAtlas, board: Board, over: bool
+    ) -> pygame.Rect | None:
+        """Draw changes since the last call; returns the dirty area or None."""
+        if board == self.drawn and over == self.drawn_over:
+            return None
+        if self.drawn is None or self.drawn_over:
+            pygame.draw.rect(surface, theme.board, self.rect, border_radius=theme.radius // 2)
+            changed = ~0
+        else:
+            changed = board ^ self.drawn
+        step = self.tile_size + self.padding
+        for k in range(GRID_SIZE * GRID_SIZE):
+            if (changed >> (4 * k)) & 0xF:
+                i, j = divmod(k, GRID_SIZE)
+                surface.blit(
+                    atlas[(board >> (4 * k)) & 0xF],
+                    (self.rect.x + self.padding + j * step, self.rect.y + self.padding + i * step),
+                )
+        if over:
+            shade = pygame.Surface(self.rect.size, pygame.SRCALPHA)
+            shade.fill((50, 50, 50, 150))
+            surface.blit(shade, self.rect)
+        self.drawn = board
+        self.drawn_over = over
+        return self.rect
+
+
+class SpectatorView:
+    """Grid of live games from a BatchSimulator; click a board to open it."""
+    def __init__(
+        self,
+        simulator: BatchSimulator,
+        theme: Theme,
+        tile_size: int = MINI_TILE_SIZE,
+        columns: int | None = None,
+    ) -> None:
+        self.simulator = simulator
+        self.theme = theme
+        self.tile_size = tile_size
+        count = len(simulator.boards)
+        self.columns = columns or math.ceil(math.sqrt(count))
+        self.header_height = 2 * theme.font_small.get_height()
+        self.boards: list[MiniBoard] = []
+        for k in range(count):
+            row, col = divmod(k, self.columns)
+            board = MiniBoard(0, 0, tile_size)
+            board.rect.x = BOARD_GAP + col * (board.rect.width + BOARD_GAP)
+            board.rect.y = self.header_height + row * (board.rect.height + BOARD_GAP)
+            self.boards.append(board)
+        rows = math.ceil(count / self.columns)
+        size = self.boards[0].rect.width
+        self.rect = pygame.Rect(
+            0,
+            0,
+            BOARD_GAP + self.columns * (size + BOARD_GAP),
+            self.header_height + rows * (size + BOARD_GAP),
+        )
+        self.header = pygame.Rect(0, 0, self.rect.width, self.header_height)
+        self.atlas: TileAtlas | None = None
+        self.full_redraw = True
+
+    def invalidate(self) -> None:
+        """Force a full redraw, e.g. after the window was used by another view."""
+        for board in self.boards:
+            board.invalidate()
+        self.full_redraw = True
+
+    def _header_text(self) -> str:
+        sim = self.simulator
+        live = sum(not over for over in sim.over)
+        mean = sim.finished_score / sim.finished if sim.finished else 0
+        return f"{live} live  {sim.finished} finished  mean score {mean:.0f}  {sim.total_moves} moves"
+
+    def draw(self, surface: pygame.Surface, theme: Theme) -> list[pygame.Rect]:
+        """Draw boards that changed since the last frame and return the dirty rects."""
+        if self.atlas is None:
+            self.atlas = TileAtlas(theme, self.tile_size)
+            self.invalidate()
+        dirty = []
+        if self.full_redraw:
+            surface.fill(theme.bg)
+            dirty.append(surface.get_rect())
+            self.full_redraw = False
+        surface.fill(theme.bg, self.header)
+        text = theme.font_small.render(self._header_text(), True, theme.dark_text)
+        surface.blit(text, text.get_rect(bottomleft=(BOARD_GAP, self.header.bottom)))
+        dirty.append(self.header)
+        # Snapshot the simulator's lists; boards are ints, so this is consistent per board
+        boards = list(self.simulator.boards)
+        over = list(self.simulator.over)
+        for k, mini in enumerate(self.boards):
+            rect = mini.draw(surface, theme, self.atlas, boards[k], over[k])
+            if rect is not None:
+                dirty.append(rect)
+        return dirty
+
+    def board_at(self, pos: tuple[int, int]) -> int | None:
+        for k, mini in enumerate(self.boards):
+            if mini.rect.collidepoint(pos):
+                return k
+        return None
+
+    def event_handler(self, event: pygame.event.Event) -> int | None:
+        """Index of the game clicked, if any."""
+        if event.type == pygame.MOUSEBUTTONDOWN and event.button == pygame.BUTTON_LEFT:
+            return self.board_at(event.pos)
+        return None
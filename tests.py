@@ -1,9 +1,32 @@
 from __future__ import annotations
+import contextlib
 import unittest
 from collections import defaultdict
-from io import StringIO
+from io import BytesIO, StringIO
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
 
 from gamestate import GameState, GameStatus, Grid, Action
+from profiling import Profiler
+import bitboard
+from heuristics import Evaluator, Weights, batch_features, features
+from solver import ParallelSolver, Searcher, SharedTranspositionTable, Solver
+from endgame import ExactSolver, Tablebase, save_table
+from analytics import Distribution, GameStats, merge_summaries, print_summary, summarize, summarize_file
+import selfplay
+import cli
+from rng import SplitMixRNG, make_rng
+import difftest
+import shards
+from session import Autosaver, Snapshot, load_session, save_session
+from openings import BookBuilder, OpeningBook, build_selfplay
+from spectator import BatchSimulator, MiniBoard, TileAtlas
+from ntuple import TUPLE_SETS, NTupleNetwork, train
+from review import analyze, history_positions, load_positions, print_review, record_positions
+from worker import AUTOPLAY_STEP, AUTOPLAY_STOPPED, HINT_READY, EngineWorker
 
 EMPTY_ROW = [0, 0, 0, 0]
 
@@ -235,6 +258,15 @@ class TestGameState(unittest.TestCase):
         self.assertEqual(8, possible_moves[Action.UP].score)
         self.assertEqual(8, possible_moves[Action.DOWN].score)
 
+    def test_get_possible_moves_no_double_merge(self):
+        grid: Grid = [[4, 2, 2, 4], EMPTY_ROW, EMPTY_ROW, EMPTY_ROW]
+        self.game_state.set_grid(grid)
+        possible_moves = self.game_state.possible_moves
+        self.assertEqual([4, 4, 4, 0], possible_moves[Action.LEFT].grid[0])
+        self.assertEqual([0, 4, 4, 4], possible_moves[Action.RIGHT].grid[0])
+        self.assertEqual(4, possible_moves[Action.LEFT].score)
+        self.assertEqual(4, possible_moves[Action.RIGHT].score)
+
     def test_step_move_available(self):
         grid: Grid = [[2, 2, 0, 0], [0, 0, 0, 2], EMPTY_ROW, EMPTY_ROW]
 
@@ -280,6 +312,46 @@ class TestGameState(unittest.TestCase):
         self.game_state.set_grid(grid)
         self.assertEqual(GameStatus.END, self.game_state.step(Action.LEFT))
 
+    def test_step_win(self):
+        grid: Grid = [[1024, 1024, 0, 0], [2, 0, 0, 0], EMPTY_ROW, EMPTY_ROW]
+        self.game_state.set_grid(grid)
+        self.assertEqual(GameStatus.WIN, self.game_state.step(Action.LEFT))
+        self.assertEqual(1, self.game_state.win_move)
+
+        # Play continues after a win and the win move is kept
+        self.assertEqual(GameStatus.WIN, self.game_state.step(Action.RIGHT))
+        self.assertEqual(2, self.game_state.moves)
+        self.assertEqual(1, self.game_state.win_move)
+
+        buffer = StringIO()
+        self.game_state.print(buffer)
+        buffer.seek(0)
+        self.assertEqual("You Win!\n", buffer.readline())
+
+    def test_undo(self):
+        game_state = GameState(seed=3, max_history=2)
+        self.assertFalse(game_state.undo())
+        positions = []
+        for action in (Action.LEFT, Action.UP, Action.RIGHT, Action.DOWN):
+            if action in game_state.possible_moves:
+                positions.append(([list(row) for row in game_state.grid], game_state.score))
+                game_state.step(action)
+        moves = game_state.moves
+        for grid, score in reversed(positions[-2:]):
+            self.assertTrue(game_state.undo())
+            self.assertEqual(grid, game_state.grid)
+            self.assertEqual(score, game_state.score)
+        self.assertEqual(moves - 2, game_state.moves)
+        # Only max_history moves are kept
+        self.assertFalse(game_state.undo())
+        self.assertEqual(0, len(GameState(seed=3).history))
+        # A new grid starts without the old game's history
+        game_state.step(next(iter(game_state.possible_moves)))
+        game_state.set_grid([[2, 2, 0, 0], EMPTY_ROW, EMPTY_ROW, EMPTY_ROW])
+        game_state.moves = 0
+        self.assertFalse(game_state.undo())
+        self.assertEqual(0, game_state.moves)
+
     def test_step_invalid_move(self):
         # Test that invalid move makes no changes to game state
 
@@ -339,5 +411,776 @@ class TestGameState(unittest.TestCase):
         self.assertEqual("[2, 4, 16, 64]\n", buffer.readline())
         self.assertEqual("[8, 2, 4, 8]\n", buffer.readline())
 
+
+class TestProfiler(unittest.TestCase):
+    def test_enable_disable(self):
+        profiler = Profiler()
+        original = GameState.move_left
+        profiler.instrument_engine()
+        self.assertIs(original, GameState.move_left)
+
+        # Seeded so the spawn, and with it the legal moves after it, are fixed
+        game_state = GameState(seed=1)
+        profiler.enable()
+        self.assertIsNot(original, GameState.move_left)
+        game_state.set_grid([[2, 2, 0, 0], EMPTY_ROW, EMPTY_ROW, EMPTY_ROW])
+        game_state.step(Action.LEFT)
+        profiler.disable()
+        self.assertIs(original, GameState.move_left)
+        self.assertEqual([[4, 0, 0, 0], [0, 2, 0, 0], EMPTY_ROW, EMPTY_ROW], game_state.grid)
+
+        self.assertEqual(1, profiler.stats["step"].calls)
+        self.assertEqual(1, profiler.stats["spawn"].calls)
+        self.assertEqual(2, profiler.stats["legal_check"].calls)
+        # Once for the set grid, once after the spawn, which leaves LEFT legal
+        self.assertEqual(2, profiler.stats["move.left"].calls)
+        self.assertIn("move.left", profiler.report())
+
+        # Disabled profiler records nothing
+        profiler.reset()
+        game_state.get_possible_moves()
+        self.assertEqual({}, profiler.stats)
+
+
+class TestBitboard(unittest.TestCase):
+    def test_pack_unpack(self):
+        grid: Grid = [[2, 4, 8, 16], [0, 0, 0, 32768], EMPTY_ROW, [0, 2, 0, 0]]
+        board = bitboard.pack(grid)
+        self.assertEqual(grid, bitboard.unpack(board))
+        self.assertEqual(10, bitboard.count_empty(board))
+        self.assertEqual(15, bitboard.max_exponent(board))
+        self.assertEqual([list(col) for col in zip(*grid)], bitboard.unpack(bitboard.transpose(board)))
+        self.assertRaises(ValueError, bitboard.pack, [[3, 0, 0, 0], EMPTY_ROW, EMPTY_ROW, EMPTY_ROW])
+        self.assertTrue(bitboard.is_over(0))
+        self.assertFalse(bitboard.is_over(board))
+
+    def test_symmetries(self):
+        board = bitboard.pack([[2, 4, 8, 16], [0, 0, 0, 32], [0, 2, 0, 4], EMPTY_ROW])
+        variants = bitboard.symmetries(board)
+        self.assertEqual(8, len(set(variants)))
+        for variant in variants:
+            self.assertEqual(bitboard.canonical(board), bitboard.canonical(variant))
+
+    def test_possible_moves_match_game_state(self):
+        game_state = GameState()
+        grids: list[Grid] = [
+            [[2, 2, 4, 4], [0, 2, 0, 2], [4, 2, 2, 4], [8, 0, 8, 8]],
+            [[2, 4, 16, 64], [4, 2, 32, 32], [2, 4, 16, 64], [8, 2, 4, 8]],
+            [[2, 4, 2, 4], [4, 2, 4, 2], [2, 4, 2, 4], [4, 2, 4, 2]],
+        ]
+        for grid in grids:
+            with self.subTest(grid=grid):
+                game_state.set_grid(grid)
+                expected = {
+                    action: (state.grid, state.score)
+                    for action, state in game_state.possible_moves.items()
+                }
+                result = {
+                    action: (bitboard.unpack(board), score)
+                    for action, (board, score) in bitboard.possible_moves(bitboard.pack(grid)).items()
+                }
+                self.assertEqual(expected, result)
+
+    def test_symmetry_actions(self):
+        board = bitboard.pack([[2, 4, 8, 0], [0, 2, 0, 4], [4, 0, 0, 2], [0, 0, 16, 2]])
+        for s, variant in enumerate(bitboard.symmetries(board)):
+            for action in Action:
+                moved = bitboard.move(board, action)[0]
+                mapped = bitboard.SYMMETRY_ACTIONS[s][action]
+                self.assertEqual(bitboard.symmetries(moved)[s], bitboard.move(variant, mapped)[0])
+        canonical, s = bitboard.canonical_index(board)
+        self.assertEqual(bitboard.canonical(board), canonical)
+        self.assertEqual(canonical, bitboard.symmetries(board)[s])
+
+    def test_successor_cache(self):
+        cache = bitboard.SuccessorCache(max_entries=2)
+        boards = [bitboard.pack(grid) for grid in (
+            [[2, 2, 0, 0], EMPTY_ROW, EMPTY_ROW, EMPTY_ROW],
+            [[4, 0, 0, 4], EMPTY_ROW, EMPTY_ROW, EMPTY_ROW],
+            [[0, 0, 0, 8], EMPTY_ROW, EMPTY_ROW, [2, 0, 0, 0]],
+        )]
+        first = cache(boards[0])
+        self.assertEqual(bitboard.possible_moves(boards[0]), dict(first))
+        self.assertIs(first, cache(boards[0]))
+        with self.assertRaises(TypeError):
+            first[Action.LEFT] = (0, 0)
+        cache(boards[1])
+        cache(boards[2])
+        # boards[0] was least recently used and has been evicted
+        self.assertNotIn(boards[0], cache.entries)
+        self.assertEqual({"hits": 1, "misses": 3}, {k: cache.info()[k] for k in ("hits", "misses")})
+        self.assertEqual(0.25, cache.hit_rate)
+
+        # Threads sharing one cache keep evicting each other's entries
+        errors = []
+
+        def hammer():
+            try:
+                for k in range(2000):
+                    cache(boards[k % 3])
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=hammer) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+        self.assertEqual(8004, cache.hits + cache.misses)
+
+
+class TestHeuristics(unittest.TestCase):
+    def test_features(self):
+        grid: Grid = [[2, 4, 8, 16], [0, 0, 0, 32], [0, 2, 0, 0], EMPTY_ROW]
+        result = features(bitboard.pack(grid))
+        self.assertEqual(10, result["empty"])
+        self.assertEqual(-3, result["monotonicity"])
+        self.assertEqual(-5, result["smoothness"])
+        self.assertEqual(0, result["corner_max"])
+        self.assertEqual(0, result["merges"])
+
+        grid = [[2, 2, 0, 2], EMPTY_ROW, EMPTY_ROW, [0, 0, 0, 4]]
+        result = features(bitboard.pack(grid))
+        self.assertEqual(1, result["corner_max"])
+        self.assertEqual(2, result["merges"])
+
+    def test_evaluator_matches_batch(self):
+        evaluator = Evaluator(Weights(empty=1.5, smoothness=0.3))
+        grids: list[Grid] = [
+            [[2, 4, 8, 16], [0, 0, 0, 32], [0, 2, 0, 0], EMPTY_ROW],
+            [[2, 4, 16, 64], [4, 2, 32, 32], [2, 4, 16, 64], [8, 2, 4, 8]],
+            [EMPTY_ROW, EMPTY_ROW, EMPTY_ROW, EMPTY_ROW],
+        ]
+        boards = [bitboard.pack(grid) for grid in grids]
+        batch = evaluator.batch(boards)
+        self.assertEqual((len(boards), 5), batch_features(boards).shape)
+        for board, value in zip(boards, batch):
+            self.assertAlmostEqual(value, evaluator(board))
+
+    def test_weights_from_dict(self):
+        weights = Weights.from_dict({"empty": 1, "merges": 2})
+        self.assertEqual(1.0, weights.empty)
+        self.assertEqual(2.0, weights.merges)
+        self.assertRaises(ValueError, Weights.from_dict, {"unknown": 1})
+
+
+class TestSolver(unittest.TestCase):
+    grid: Grid = [[2, 4, 8, 16], [0, 0, 0, 32], [0, 2, 0, 4], [0, 0, 0, 2]]
+
+    def test_hint(self):
+        board = bitboard.pack(self.grid)
+        hint = Solver().hint(board, time_budget=0.1)
+        self.assertIn(hint.action, bitboard.possible_moves(board))
+        self.assertGreaterEqual(hint.depth, 1)
+
+        only_up = bitboard.pack([[0, 0, 0, 0], [2, 4, 8, 16], [4, 8, 16, 32], [2, 4, 8, 16]])
+        self.assertEqual(Action.UP, Solver().hint(only_up).action)
+
+        end = bitboard.pack([[2, 4, 16, 64], [4, 2, 8, 32], [2, 4, 16, 64], [8, 2, 4, 8]])
+        self.assertIsNone(Solver().hint(end).action)
+
+    def test_shared_table(self):
+        table = SharedTranspositionTable(size_log2=8)
+        try:
+            self.assertIsNone(table.get(12345, 1))
+            table.store(12345, 3, 1.5)
+            self.assertEqual(1.5, table.get(12345, 2))
+            self.assertIsNone(table.get(12345, 4))
+            self.assertIsNone(table.get(54321, 1))
+        finally:
+            table.close()
+
+    def test_parallel_matches_sequential(self):
+        board = bitboard.pack(self.grid)
+        expected = Solver().search(board, 2)
+        for split in ("root", "spawn"):
+            with self.subTest(split=split), ParallelSolver(workers=2, split=split) as solver:
+                result = solver.search(board, 2)
+                self.assertEqual(expected.keys(), result.keys())
+                for action in expected:
+                    self.assertAlmostEqual(expected[action], result[action], places=3)
+                self.assertIsNotNone(solver.hint(board, time_budget=0.2).action)
+
+
+class TestEndgame(unittest.TestCase):
+    def test_afterstate_value(self):
+        # Only a 4 spawning in the corner can merge, making the winning 8
+        grid: Grid = [[0, 4, 2, 4], [4, 2, 4, 2], [2, 4, 2, 4], [4, 2, 4, 2]]
+        solver = ExactSolver(target_exponent=3)
+        self.assertAlmostEqual(0.1, solver.afterstate_value(bitboard.pack(grid)))
+
+    def test_tablebase_round_trip(self):
+        grid: Grid = [[2, 4, 2, 4], [4, 2, 4, 2], [2, 4, 2, 4], [4, 2, 0, 0]]
+        board = bitboard.pack(grid)
+        for objective in ("win", "score"):
+            with self.subTest(objective=objective), tempfile.TemporaryDirectory() as tmp:
+                solver = ExactSolver(target_exponent=3, objective=objective)
+                value = solver.solve(board)
+                path = os.path.join(tmp, "endgame.tb")
+                save_table(path, solver)
+                with Tablebase(path) as table:
+                    self.assertEqual(len(solver.values), len(table))
+                    self.assertEqual(value, table.get(board))
+                    for key, expected in solver.values.items():
+                        self.assertEqual(expected, table.get(key))
+                    self.assertEqual(solver.action_values(board), table.action_values(board))
+                    self.assertIsNone(table.get(bitboard.pack([[2, 0, 0, 0], EMPTY_ROW, EMPTY_ROW, EMPTY_ROW])))
+                    self.assertEqual(objective, table.hint(board).objective)
+                    # Unsolved positions and positions past the target fall through to search
+                    self.assertIsNone(table.hint(bitboard.pack([[2, 2, 0, 0], EMPTY_ROW, EMPTY_ROW, EMPTY_ROW])))
+                    won = bitboard.pack([[8, 2, 0, 0], [4, 0, 0, 0], EMPTY_ROW, EMPTY_ROW])
+                    self.assertIsNone(table.action_values(won))
+                    self.assertIsNone(table.hint(won))
+
+    def test_state_limit(self):
+        board = bitboard.pack([[2, 0, 0, 0], EMPTY_ROW, EMPTY_ROW, [0, 0, 0, 2]])
+        solver = ExactSolver(target_exponent=11, max_states=100)
+        self.assertRaises(MemoryError, solver.solve, board)
+
+
+class TestAnalytics(unittest.TestCase):
+    def test_distribution_merge(self):
+        values = [3, 17, 250, 1200, 999, 42]
+        whole = Distribution(100)
+        left = Distribution(100)
+        right = Distribution(100)
+        for k, value in enumerate(values):
+            whole.add(value)
+            (left if k % 2 else right).add(value)
+        left.merge(right)
+        self.assertEqual(whole.count, left.count)
+        self.assertEqual(whole.bins, left.bins)
+        self.assertEqual((3, 1200), (left.min, left.max))
+        self.assertAlmostEqual(whole.mean, left.mean)
+        self.assertAlmostEqual(whole.std, left.std)
+        self.assertRaises(ValueError, left.merge, Distribution(10))
+
+    def test_selfplay_reproducible(self):
+        first = selfplay.play("greedy", seed=7)
+        second = selfplay.play("greedy", seed=7)
+        self.assertEqual(first.actions, second.actions)
+        self.assertEqual(first.score, second.score)
+        self.assertEqual(first.moves, len(first.actions))
+        # Every game gets its own searcher, so earlier games leave no state behind
+        first, second = selfplay.make_policy("expectimax"), selfplay.make_policy("expectimax")
+        self.assertIsNot(first.keywords["searcher"], second.keywords["searcher"])
+        board = bitboard.pack([[2, 4, 8, 16], [0, 0, 4, 32], [0, 2, 0, 64], [0, 0, 2, 128]])
+        first(board, None)
+        self.assertEqual({}, second.keywords["searcher"].table.entries)
+
+    def test_policy_rng_independent_of_spawns(self):
+        seed = 3
+        self.assertNotEqual(make_rng("random", seed).spawn(16, 0.1)[0] >> 2, selfplay.policy_rng(seed).randrange(4))
+        # A shared stream would make the first choice follow the first spawn every time
+        agree = sum(
+            make_rng("random", seed).spawn(16, 0.1)[0] >> 2 == selfplay.policy_rng(seed).randrange(4)
+            for seed in range(400)
+        )
+        self.assertLess(agree, 200)
+
+    def test_summarize(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for k, policy in enumerate(("random", "random", "greedy")):
+                path = os.path.join(tmp, f"results{k}.jsonl")
+                with open(path, "w") as fout:
+                    selfplay.write_results(selfplay.run(policy, range(3 * k, 3 * k + 3)), fout)
+                paths.append(path)
+
+            summary = summarize(paths, workers=2)
+            self.assertEqual({"random": 6, "greedy": 3}, {p: s.games for p, s in summary.items()})
+            chunked = merge_summaries(summarize_file(path, chunk_size=2) for path in paths)
+            self.assertEqual(summary["random"].score.total, chunked["random"].score.total)
+            self.assertEqual(summary["greedy"].max_tiles, chunked["greedy"].max_tiles)
+            won = GameStats()
+            won.add({"score": 20000, "moves": 1000, "max_tile": 2048, "win_move": 900, "win_time": 1.25})
+            out = StringIO()
+            print_summary({"greedy": won}, out)
+            self.assertIn("1.25", out.getvalue().splitlines()[1])
+            self.assertIn("seconds to 2048", out.getvalue())
+
+
+class TestBatchCli(unittest.TestCase):
+    def test_read_moves(self):
+        data = b"up LEFT\nw  a\n\nDOWN jump RIGHT\nd"
+        expected = [
+            Action.UP, Action.LEFT, Action.UP, Action.LEFT,
+            Action.DOWN, None, Action.RIGHT, Action.RIGHT,
+        ]
+        for block_size in (1, 3, 7, 1024):
+            with self.subTest(block_size=block_size):
+                self.assertEqual(expected, list(cli.read_moves(BytesIO(data), "words", block_size)))
+        self.assertEqual(
+            [Action.LEFT, Action.RIGHT, None, Action.UP, Action.DOWN],
+            list(cli.read_moves(BytesIO(b"LR x\nUD\n"), "codes", 2)),
+        )
+
+    def test_batch_replays_selfplay(self):
+        result = selfplay.play("greedy", seed=5)
+        game_state = GameState(seed=5)
+        buffer = StringIO()
+        moves = cli.read_moves(BytesIO(result.actions.encode()), "codes")
+        summary = cli.batch(game_state, moves, buffer, quiet=True)
+        self.assertEqual(result.score, game_state.score)
+        self.assertEqual(result.moves, summary["applied"])
+        self.assertEqual(GameStatus.END, game_state.status)
+        self.assertNotIn("[", buffer.getvalue())
+
+
+class TestSpawnRNG(unittest.TestCase):
+    def test_reproducible(self):
+        for kind in ("random", "splitmix"):
+            with self.subTest(kind=kind):
+                first = make_rng(kind, 42)
+                second = make_rng(kind, 42)
+                draws = [first.spawn(n % 16 + 1, 0.1) for n in range(3000)]
+                self.assertEqual(draws, [second.spawn(n % 16 + 1, 0.1) for n in range(3000)])
+                self.assertTrue(all(0 <= i < n % 16 + 1 for n, (i, _) in enumerate(draws)))
+                self.assertNotEqual(draws[:100], [make_rng(kind, 42, stream=1).spawn(n % 16 + 1, 0.1) for n in range(100)])
+
+    def test_splitmix_state(self):
+        rng = SplitMixRNG(7)
+        for _ in range(1500):
+            rng.next()
+        state = rng.getstate()
+        clone = rng.copy()
+        expected = [rng.next() for _ in range(10)]
+        self.assertEqual(expected, [clone.next() for _ in range(10)])
+        rng.setstate(state)
+        self.assertEqual(expected, [rng.next() for _ in range(10)])
+
+        child = rng.fork()
+        self.assertNotEqual([rng.next() for _ in range(5)], [child.next() for _ in range(5)])
+
+    def test_splitmix_spawn_rate(self):
+        rng = SplitMixRNG(1)
+        fours = sum(rng.spawn(16, 0.1)[1] for _ in range(20000))
+        self.assertAlmostEqual(0.1, fours / 20000, delta=0.01)
+
+    def test_game_state_rng(self):
+        grids = []
+        for _ in range(2):
+            game_state = GameState(rng=SplitMixRNG(3))
+            for action in [Action.LEFT, Action.UP, Action.RIGHT, Action.DOWN] * 10:
+                game_state.step(action)
+            grids.append(game_state.grid)
+        self.assertEqual(grids[0], grids[1])
+
+
+class TestDifferential(unittest.TestCase):
+    def test_engines_match_reference(self):
+        checked, excluded, failures = difftest.run(2000, seed=1, chunk=500)
+        self.assertEqual(2000, checked)
+        self.assertLess(0, excluded)
+        self.assertEqual([], failures)
+        self.assertTrue(difftest.is_excluded([[32768, 32768, 0, 0]] + [[0] * 4] * 3))
+        self.assertFalse(difftest.is_excluded([[32768, 16384, 0, 0]] + [[0] * 4] * 3))
+
+    def test_shrink(self):
+        class BrokenEngine(difftest.BitboardEngine):
+            # Forgets the score of merging two 8s
+            def successors(self, grid):
+                result = super().successors(grid)
+                for action, (moved, score) in result.items():
+                    merged = count_blocks(moved).get(16, 0) > count_blocks(grid).get(16, 0)
+                    result[action] = (moved, score - 16 if merged else score)
+                return result
+
+        reference = difftest.ReferenceEngine()
+        broken = BrokenEngine()
+        grid: Grid = [[8, 8, 2, 4], [16, 2, 0, 0], [4, 0, 32, 2], [0, 2, 0, 8]]
+        self.assertTrue(difftest.compare(grid, reference, broken))
+        shrunk = difftest.shrink(grid, reference, broken)
+        self.assertEqual(2, total_blocks(shrunk))
+        self.assertEqual({8: 2}, dict(count_blocks(shrunk)))
+        self.assertEqual([], difftest.compare(grid, reference, difftest.BitboardEngine()))
+
+
+class TestEngineWorker(unittest.TestCase):
+    def setUp(self):
+        import pygame
+
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        pygame.display.init()
+        self.addCleanup(pygame.display.quit)
+        self.pygame = pygame
+
+    def _wait_for(self, event_type: int, timeout: float = 10.0):
+        import time
+
+        deadline = time.time() + timeout
+        events = []
+        while time.time() < deadline:
+            events += self.pygame.event.get()
+            if any(event.type == event_type for event in events):
+                return events
+            time.sleep(0.01)
+        self.fail(f"no event {event_type} within {timeout}s")
+
+    def test_autoplay_and_hints(self):
+        import threading
+
+        game_state = GameState(seed=1)
+        solver = Solver(max_depth=2)
+        worker = EngineWorker(
+            game_state,
+            threading.RLock(),
+            lambda board: solver.hint(board, 1.0),
+            selfplay.POLICIES["random"],
+            steps_per_second=0,
+            seed=1,
+        )
+        worker.start()
+        self.addCleanup(worker.stop)
+
+        board = bitboard.pack(game_state.grid)
+        worker.request_hint(board)
+        event = [e for e in self._wait_for(HINT_READY) if e.type == HINT_READY][0]
+        self.assertEqual(board, event.board)
+        self.assertIn(event.hint.action, bitboard.possible_moves(board))
+
+        # Unthrottled autoplay runs the game to the end off the main thread
+        worker.set_autoplay(True)
+        events = self._wait_for(AUTOPLAY_STOPPED)
+        steps = [e for e in events if e.type == AUTOPLAY_STEP]
+        self.assertEqual(GameStatus.END, game_state.status)
+        self.assertEqual(game_state.moves, len(steps))
+        self.assertEqual(game_state.moves, worker.steps)
+
+
+
+
+class TestOpeningBook(unittest.TestCase):
+    def test_build_merge_lookup(self):
+        records = [selfplay.play("random", seed).to_dict() for seed in range(6)]
+        whole = BookBuilder(max_moves=5)
+        whole.add_games(records)
+        shard = build_selfplay("random", range(3, 6), max_moves=5)
+        merged = BookBuilder(max_moves=5)
+        merged.add_games(records[:3])
+        merged.merge(shard)
+        self.assertEqual(whole.entries, merged.entries)
+        self.assertEqual(6, merged.games)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "book")
+            merged.save(path)
+            self.assertEqual(whole.entries, BookBuilder.load(path).entries)
+            with OpeningBook(path) as book:
+                self.assertEqual(len(whole), len(book))
+                spawns = make_rng("random", 0)
+                start = selfplay.spawn_tile(selfplay.spawn_tile(0, spawns), spawns)
+                stats = book.stats(start)
+                first = selfplay.CODE_ACTIONS[records[0]["actions"][0]]
+                self.assertIn(first, stats)
+                # Every symmetric position maps to the same statistics
+                for s, variant in enumerate(bitboard.symmetries(start)):
+                    mapped = {
+                        bitboard.SYMMETRY_ACTIONS[s][action]: value
+                        for action, value in stats.items()
+                    }
+                    self.assertEqual(mapped, book.stats(variant))
+                hint = book.hint(start, min_games=1)
+                self.assertEqual("book", hint.objective)
+                self.assertIsNone(book.stats(bitboard.pack([[2, 4, 8, 16]] * 4)))
+
+
+
+class TestSession(unittest.TestCase):
+    def test_round_trip(self):
+        for kind in ("random", "splitmix"):
+            with self.subTest(rng=kind):
+                game_state = GameState(rng=make_rng(kind, 7), max_history=None)
+                for action in [Action.LEFT, Action.UP, Action.RIGHT, Action.DOWN] * 10:
+                    game_state.step(action)
+                snapshot = Snapshot.capture(game_state, {"hint_budget": 0.5})
+                restored = GameState(max_history=None)
+                decoded = Snapshot.decode(snapshot.encode())
+                decoded.restore(restored)
+                self.assertEqual({"hint_budget": 0.5}, decoded.settings)
+                for attr in ("grid", "score", "moves", "status", "win_move"):
+                    self.assertEqual(getattr(game_state, attr), getattr(restored, attr))
+                self.assertEqual(len(game_state.history), len(restored.history))
+                # Spawns continue identically and undo goes back through the saved history
+                for action in [Action.DOWN, Action.LEFT, Action.UP, Action.RIGHT] * 3:
+                    game_state.step(action)
+                    restored.step(action)
+                self.assertEqual(game_state.grid, restored.grid)
+                while game_state.undo():
+                    self.assertTrue(restored.undo())
+                    self.assertEqual(game_state.grid, restored.grid)
+                self.assertRaises(ValueError, Snapshot.decode, b"not a session" * 10)
+
+    def test_autosave(self):
+        game_state = GameState(seed=1, max_history=None)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "session")
+            autosaver = Autosaver(path, interval=0)
+            self.assertTrue(autosaver.save(game_state, {}))
+            autosaver.wait()
+            # Unchanged games are not written again
+            self.assertFalse(autosaver.save(game_state, {}))
+            game_state.step(next(iter(game_state.possible_moves)))
+            self.assertTrue(autosaver.save(game_state, {}))
+            autosaver.wait()
+            # A snapshot that cannot be encoded does not stop later saves
+            game_state.moves = -1
+            with contextlib.redirect_stdout(StringIO()) as output:
+                self.assertTrue(autosaver.save(game_state, {}))
+                autosaver.wait()
+            self.assertIn("Autosave to", output.getvalue())
+            game_state.moves = 1
+            self.assertTrue(autosaver.save(game_state, {}))
+            autosaver.wait()
+            self.assertEqual((3, 1), (autosaver.saves, autosaver.errors))
+            autosaver.close()
+            self.assertEqual(game_state.grid, load_session(path).grid)
+            self.assertEqual([], [f for f in os.listdir(tmp) if f.endswith(".tmp")])
+
+    def test_theme_dump_load(self):
+        import pygame
+        from theme import Theme
+
+        pygame.font.init()
+        theme = Theme(bg="black", font_size_small=12, padding_medium=20)
+        buffer = StringIO()
+        theme.dump(buffer)
+        buffer.seek(0)
+        loaded = Theme.load(buffer)
+        self.assertEqual(theme.to_dict(), loaded.to_dict())
+        self.assertEqual(("peachpuff1", theme.light_text), loaded[8])
+        with open("theme/default.json") as fin:
+            self.assertEqual("azure", Theme.load(fin).bg)
+
+    def test_theme_partial_tiles(self):
+        import pygame
+        from theme import Theme
+
+        pygame.font.init()
+        partial = Theme.from_dict({"background": "black", "8": {"color": "red"}})
+        self.assertEqual(("red", partial.dark_text), partial[8])
+        self.assertEqual(("beige", partial.dark_text), partial[2])
+        self.assertEqual(("black", partial.light_text), partial[4096])
+        loaded = Theme.from_dict(partial.to_dict())
+        self.assertEqual(partial.to_dict(), loaded.to_dict())
+        self.assertEqual("peachpuff1", Theme().tiles[8].tile_color)
+
+
+class TestSpectator(unittest.TestCase):
+    def test_simulator_matches_selfplay(self):
+        simulator = BatchSimulator("greedy", 3, seed=5, restart=False)
+        while not all(simulator.over):
+            simulator.step()
+        for k in range(3):
+            result = selfplay.play("greedy", 5 + k)
+            self.assertEqual(result.score, simulator.scores[k])
+            self.assertEqual(result.moves, simulator.moves[k])
+        self.assertEqual(3, simulator.finished)
+
+    def test_simulator_moves_profiled_as_steps(self):
+        profiler = Profiler()
+        profiler.instrument(BatchSimulator, "_move", "step")
+        simulator = BatchSimulator("random", 2, seed=1, restart=False)
+        profiler.enable()
+        for _ in range(5):
+            simulator.step()
+        profiler.disable()
+        self.assertEqual(10, simulator.total_moves)
+        self.assertEqual(simulator.total_moves, profiler.stats["step"].calls)
+
+    def test_mini_board_redraws_changes(self):
+        import pygame
+        from theme import Theme
+
+        pygame.font.init()
+        theme = Theme()
+        atlas = TileAtlas(theme, 20)
+        surface = pygame.Surface((200, 200))
+        mini = MiniBoard(0, 0, 20)
+        board = bitboard.pack([[2, 4, 0, 0], EMPTY_ROW, EMPTY_ROW, [0, 0, 0, 2048]])
+        self.assertIsNotNone(mini.draw(surface, theme, atlas, board, False))
+        self.assertIsNone(mini.draw(surface, theme, atlas, board, False))
+        moved = bitboard.move(board, Action.RIGHT)[0]
+        self.assertEqual(mini.rect, mini.draw(surface, theme, atlas, moved, False))
+
+
+class TestNTuple(unittest.TestCase):
+    def test_create_load_evaluate(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "weights")
+            network = NTupleNetwork.create(path, TUPLE_SETS["4x5"])
+            board = bitboard.pack([[2, 4, 8, 16], [0, 0, 4, 32], [0, 2, 0, 64], [0, 0, 2, 128]])
+            network.update(network.indices(board), 8.0)
+            network.flush()
+            loaded = NTupleNetwork.load(path)
+            self.assertEqual(network.tuples, loaded.tuples)
+            self.assertGreater(loaded(board), 0)
+            self.assertAlmostEqual(network(board), loaded(board), places=4)
+            # Weights are shared across symmetries
+            for variant in bitboard.symmetries(board):
+                self.assertAlmostEqual(loaded(board), loaded(variant), places=4)
+            boards = [board, 0, 0x1234567890ABCDEF]
+            expected = [loaded(b) for b in boards]
+            for value, batched in zip(expected, loaded.batch(boards)):
+                self.assertAlmostEqual(value, batched, places=4)
+            with open(path, "r+b") as fout:
+                fout.write(b"garbage!")
+            self.assertRaises(ValueError, NTupleNetwork.load, path)
+
+    def test_train_and_hint(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "weights")
+            checkpoint = path + ".ckpt"
+            NTupleNetwork.create(path, TUPLE_SETS["4x5"])
+            progress = StringIO()
+            stats = train(path, 4, checkpoint=checkpoint, checkpoint_games=2, batch=2, fout=progress)
+            self.assertIn("4 games", progress.getvalue())
+            self.assertEqual(4, stats["games"])
+            self.assertGreater(stats["moves_per_sec"], 0)
+            network = NTupleNetwork.load(checkpoint)
+            self.assertTrue(network.weights.any())
+            # Training is deterministic for a seed
+            again = os.path.join(tmp, "again")
+            NTupleNetwork.create(again, TUPLE_SETS["4x5"]).train_game(0)
+            first = NTupleNetwork.create(os.path.join(tmp, "first"), TUPLE_SETS["4x5"])
+            first.train_game(0)
+            self.assertTrue((NTupleNetwork.load(again).weights == first.weights).all())
+
+            # One move ahead, the search picks the move training would: best reward + V(after)
+            searcher = Searcher(network)
+            record = selfplay.play("random", 3).to_dict()
+            for board, _ in record_positions(record)[:100]:
+                successors = bitboard.possible_moves(board)
+                greedy = max(successors, key=lambda a: successors[a][1] + network(successors[a][0]))
+                values = searcher.root(board, 0)
+                self.assertEqual(greedy, max(values, key=values.get))
+
+            board = bitboard.pack([[2, 4, 8, 16], [0, 0, 4, 32], [0, 2, 0, 64], [0, 0, 2, 128]])
+            hint = Solver(max_depth=2, evaluator=network).hint(board, 5.0)
+            self.assertIn(hint.action, bitboard.possible_moves(board))
+            self.assertEqual(2, hint.depth)
+
+
+class TestReview(unittest.TestCase):
+    def test_history_positions(self):
+        game_state = GameState(seed=4, max_history=None)
+        played = []
+        for action in [Action.LEFT, Action.DOWN, Action.RIGHT, Action.UP] * 8:
+            board = bitboard.pack(game_state.grid)
+            if game_state.possible_moves.get(action):
+                game_state.step(action)
+                played.append((board, action))
+        positions = history_positions(game_state.history, game_state.grid, game_state.score)
+        self.assertEqual(played, positions)
+
+    def test_analyze_and_report(self):
+        record = selfplay.play("random", 2).to_dict()
+        positions = record_positions(record)
+        self.assertEqual(record["moves"], len(positions))
+        review = analyze(positions[:60], depth=1)
+        self.assertEqual(60, len(review))
+        for move in review.moves:
+            self.assertEqual(max(move.values.values()) - move.values[move.played], move.loss)
+            self.assertGreaterEqual(move.loss, 0)
+        worst = review.worst(3)
+        self.assertEqual(sorted((m.loss for m in review.moves), reverse=True)[:len(worst)], [m.loss for m in worst])
+        with ParallelSolver(workers=2, split="root") as solver:
+            parallel = analyze(positions[:60], solver, depth=1)
+        self.assertEqual([m.values for m in review.moves], [m.values for m in parallel.moves])
+        out = StringIO()
+        print_review(review, out)
+        self.assertIn("Reviewed 60 moves", out.getvalue())
+        self.assertEqual("eval", review.unit)
+
+        # With a score-scaled evaluator an action is worth reward + V(after), in points
+        network = NTupleNetwork(TUPLE_SETS["4x5"])
+        network.train_game(0)
+        scored = analyze(positions[:20], Solver(evaluator=network), depth=0)
+        self.assertEqual("points", scored.unit)
+        for move in scored.moves:
+            for action, (after, reward) in bitboard.possible_moves(move.board).items():
+                self.assertAlmostEqual(reward + network(after), move.values[action])
+        self.assertIn("points", scored.describe(max(scored.moves, key=lambda m: m.loss)))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            results = os.path.join(tmp, "results.jsonl")
+            with open(results, "w") as fout:
+                selfplay.write_results(iter([selfplay.play("random", 1), selfplay.play("random", 2)]), fout)
+            self.assertEqual(positions, load_positions(results, game=1))
+            self.assertRaises(ValueError, load_positions, results, 5)
+            game_state = GameState(seed=1, max_history=None)
+            for action in [Action.LEFT, Action.UP] * 3:
+                game_state.step(action)
+            session = os.path.join(tmp, "session")
+            save_session(session, Snapshot.capture(game_state))
+            self.assertEqual(game_state.moves, len(load_positions(session)))
+
+
+class TestShards(unittest.TestCase):
+    def test_workers_merge(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            queue = os.path.join(tmp, "queue")
+            self.assertEqual(4, shards.submit(queue, "random", 7, seed=3, shard_size=2))
+            self.assertRaises(FileExistsError, shards.submit, queue, "random", 7)
+            # A worker that claimed a shard and died; its lease has expired
+            abandoned = shards.claim(queue, "dead-worker")
+            os.utime(abandoned.path, (0, 0))
+            processes = [
+                multiprocessing.Process(target=shards.run_worker, args=(queue, None, 5.0, 0.05))
+                for _ in range(2)
+            ]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join(60)
+                self.assertEqual(0, process.exitcode)
+            counts = shards.status(queue)
+            self.assertEqual(
+                {"shards": 4, "pending": 0, "claimed": 0, "done": 4, "failed": 0}, counts
+            )
+            out = os.path.join(tmp, "results.jsonl")
+            self.assertEqual(4, shards.merge(queue, out))
+            expected = [(r.seed, r.score, r.actions) for r in selfplay.run("random", range(3, 10))]
+            with open(out) as fin:
+                records = [json.loads(line) for line in fin]
+            self.assertEqual(expected, [(r["seed"], r["score"], r["actions"]) for r in records])
+            self.assertFalse(abandoned.complete())
+
+    def test_failed_shards(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            queue = os.path.join(tmp, "queue")
+            shards.submit(queue, "random", 2, shard_size=1)
+            # Break one shard so every attempt raises
+            path = os.path.join(queue, shards.PENDING, "000001.json")
+            with open(path) as fin:
+                job = json.load(fin)
+            job["policy"] = "missing"
+            with open(path, "w") as fout:
+                json.dump(job, fout)
+            self.assertEqual(1, shards.run_worker(queue, "w", poll_interval=0.01))
+            counts = shards.status(queue)
+            self.assertEqual((1, 1), (counts[shards.DONE], counts[shards.FAILED]))
+            with open(os.path.join(queue, shards.FAILED, "000001.json")) as fin:
+                failed = json.load(fin)
+            self.assertEqual(shards.MAX_ATTEMPTS, failed["attempts"])
+            self.assertIn("KeyError", failed["error"])
+            self.assertRaises(RuntimeError, shards.merge, queue, os.path.join(tmp, "out"))
+            self.assertEqual(1, shards.merge(queue, os.path.join(tmp, "out"), partial=True))
+
+    def test_reclaim_unnamed_claim(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            queue = os.path.join(tmp, "queue")
+            shards.submit(queue, "random", 1)
+            # A claim file without the @WORKER suffix, e.g. moved in by hand
+            stray = os.path.join(queue, shards.CLAIMED, "000000.json")
+            os.rename(os.path.join(queue, shards.PENDING, "000000.json"), stray)
+            os.utime(stray, (0, 0))
+            self.assertEqual(1, shards.reclaim(queue))
+            with open(os.path.join(queue, shards.PENDING, "000000.json")) as fin:
+                job = json.load(fin)
+            self.assertEqual((1, "lease expired, held by unknown worker"), (job["attempts"], job["error"]))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -18,6 +18,21 @@ class TileTheme:
         self.tile_color = color
         self.light = light
 
+DEFAULT_TILES = {
+    2: TileTheme("beige"),
+    4: TileTheme("antiquewhite"),
+    8: TileTheme("peachpuff1", True),
+    16: TileTheme("orange", True),
+    32: TileTheme("orangered", True),
+    64: TileTheme("orangered3", True),
+    128: TileTheme("khaki", True),
+    256: TileTheme("khaki1", True),
+    512: TileTheme("gold", True),
+    1024: TileTheme("gold1", True),
+    2048: TileTheme("goldenrod1", True),
+    0: TileTheme("black", True)
+}
+
 class Theme:
     """Appearance settings class."""
     def __init__(
@@ -35,20 +50,7 @@ class Theme:
         font_size_large: int = 32,
         light_text: str = "azure",
         dark_text: str = "burlywood4",
-        tiles: dict[int, TileTheme] = {
-            2: TileTheme("beige"),
-            4: TileTheme("antiquewhite"),
-            8: TileTheme("peachpuff1", True),
-            16: TileTheme("orange", True),
-            32: TileTheme("orangered", True),
-            64: TileTheme("orangered3", True),
-            128: TileTheme("khaki", True),
-            256: TileTheme("khaki1", True),
-            512: TileTheme("gold", True),
-            1024: TileTheme("gold1", True),
-            2048: TileTheme("goldenrod1", True),
-            0: TileTheme("black", True)
-        },
+        tiles: dict[int, TileTheme] | None = None,
     ) -> None:
         self.bg = bg
         self.board = board
@@ -57,6 +59,12 @@ class Theme:
         self.padding_small = padding_small
         self.padding_medium = padding_medium
         self.padding_large = padding_large
+        self.font_name = font
+        self.font_sizes = {
+            SIZE.SMALL: font_size_small,
+            SIZE.MEDIUM: font_size_medium,
+            SIZE.LARGE: font_size_large,
+        }
         self.font_small = Font(font, font_size_small)
         self.font_medium = Font(font, font_size_medium)
         self.font_large = Font(font, font_size_large)
@@ -67,7 +75,7 @@ class Theme:
         }
         self.light_text = light_text
         self.dark_text = dark_text
-        self.tiles = tiles
+        self.tiles = dict(DEFAULT_TILES) if tiles is None else tiles
 
     def __getitem__(self, tile) -> tuple[Color, Color]:
         """Get tile and text color of a given tile."""
@@ -77,11 +85,60 @@ class Theme:
         text_color = self.light_text if theme.light else self.dark_text
         return theme.tile_color, text_color
 
+    def to_dict(self) -> dict[str, Any]:
+        """Theme as JSON data; tiles are stored under their value."""
+        data: dict[str, Any] = {
+            "background": self.bg,
+            "board": self.board,
+            "blank": self.blank_tile,
+            "radius": self.radius,
+            "padding": {
+                SIZE.SMALL: self.padding_small,
+                SIZE.MEDIUM: self.padding_medium,
+                SIZE.LARGE: self.padding_large,
+            },
+            "font": self.font_name,
+            "font_size": dict(self.font_sizes),
+            "light_text": self.light_text,
+            "dark_text": self.dark_text,
+        }
+        for value, tile in self.tiles.items():
+            data[str(value)] = {"color": tile.tile_color, "light": tile.light}
+        return data
+
+    @staticmethod
+    def from_dict(data: dict[str, Any]) -> Theme:
+        """Theme from JSON data; missing settings and tiles keep their defaults."""
+        kwargs: dict[str, Any] = {}
+        for key, name in (
+            ("background", "bg"),
+            ("board", "board"),
+            ("blank", "blank_tile"),
+            ("radius", "radius"),
+            ("font", "font"),
+            ("light_text", "light_text"),
+            ("dark_text", "dark_text"),
+        ):
+            if key in data:
+                kwargs[name] = data[key]
+        for size, value in data.get("padding", {}).items():
+            kwargs[f"padding_{SIZE(size)}"] = value
+        for size, value in data.get("font_size", {}).items():
+            kwargs[f"font_size_{SIZE(size)}"] = value
+        tiles = dict(DEFAULT_TILES)
+        tiles.update(
+            (int(key), TileTheme(value["color"], value.get("light", False)))
+            for key, value in data.items()
+            if key.isdigit()
+        )
+        return Theme(tiles=tiles, **kwargs)
+
+    @staticmethod
     def load(file: TextIO) -> Theme:
         """Load theme from file."""
         data: dict[str, Any] = json.load(file)
-        raise NotImplementedError
+        return Theme.from_dict(data)
 
     def dump(self, file: TextIO) -> None:
         """Write theme to file."""
-        raise NotImplementedError
+        json.dump(self.to_dict(), file, indent=4)
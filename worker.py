@@ -0,0 +1,148 @@
+from __future__ import annotations
+from typing import Callable
+
+import queue
+import threading
+import time
+from random import Random
+
+import pygame
+
+import bitboard
+from bitboard import Board
+from gamestate import Action, GameState, GameStatus
+from review import GameReview, Position
+from solver import Hint
+
+type HintFunction = Callable[[Board], Hint | None]
+type ReviewFunction = Callable[[list[Position]], GameReview]
+type AutoplayPolicy = Callable[[Board, Random], Action]
+
+# Events posted back to the render loop
+HINT_READY = pygame.event.custom_type()
+AUTOPLAY_STEP = pygame.event.custom_type()
+AUTOPLAY_STOPPED = pygame.event.custom_type()
+REVIEW_READY = pygame.event.custom_type()
+
+IDLE_WAIT = 0.05
+
+
+class EngineWorker:
+    """
+    Background thread for engine work: hint searches, game reviews and autoplay.
+
+    The render loop only posts requests and reads pygame events, so a long
+    search never freezes the window. Autoplay steps the shared GameState under
+    lock at its own rate, independent of the frame rate: with steps_per_second
+    0 it plays as fast as the policy allows, many moves between two frames.
+    """
+    def __init__(
+        self,
+        game_state: GameState,
+        lock: threading.RLock,
+        hint: HintFunction,
+        policy: AutoplayPolicy,
+        steps_per_second: float = 10.0,
+        seed: int | None = None,
+        review: ReviewFunction | None = None,
+    ) -> None:
+        self.game_state = game_state
+        self.lock = lock
+        self.hint = hint
+        self.policy = policy
+        self.review = review
+        self.steps_per_second = steps_per_second
+        self.rng = Random(seed)
+        # A board asks for a hint, a list of positions for a review
+        self.requests: queue.Queue[Board | list[Position] | None] = queue.Queue()
+        self.autoplay = threading.Event()
+        self.stopped = threading.Event()
+        self.steps = 0
+        self.thread = threading.Thread(target=self._run, name="engine", daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self, timeout: float | None = 5.0) -> None:
+        self.stopped.set()
+        self.requests.put(None)
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+
+    def request_hint(self, board: Board) -> None:
+        """Queue a hint search; the result arrives as a HINT_READY event."""
+        self.requests.put(board)
+
+    def request_review(self, positions: list[Position]) -> None:
+        """Queue a review of a game; the result arrives as a REVIEW_READY event."""
+        self.requests.put(positions)
+
+    def set_autoplay(self, enabled: bool) -> None:
+        if enabled:
+            self.autoplay.set()
+        else:
+            self.autoplay.clear()
+
+    def toggle_autoplay(self) -> bool:
+        self.set_autoplay(not self.autoplay.is_set())
+        return self.autoplay.is_set()
+
+    def _snapshot(self) -> Board | None:
+        with self.lock:
+            if self.game_state.status == GameStatus.END:
+                return None
+            try:
+                return bitboard.pack(self.game_state.grid)
+            except ValueError:
+                return None
+
+    def _serve_requests(self, wait: float) -> None:
+        try:
+            request = self.requests.get(timeout=wait) if wait > 0 else self.requests.get_nowait()
+        except queue.Empty:
+            return
+        while request is not None:
+            if isinstance(request, list):
+                review = self.review(request)
+                pygame.event.post(pygame.event.Event(REVIEW_READY, review=review))
+            else:
+                hint = self.hint(request)
+                pygame.event.post(pygame.event.Event(HINT_READY, board=request, hint=hint))
+            try:
+                request = self.requests.get_nowait()
+            except queue.Empty:
+                return
+
+    def _autoplay_step(self) -> None:
+        board = self._snapshot()
+        if board is None:
+            self.autoplay.clear()
+            pygame.event.post(pygame.event.Event(AUTOPLAY_STOPPED, steps=self.steps))
+            return
+        action = self.policy(board, self.rng)
+        with self.lock:
+            # The player may have moved or restarted while the policy ran
+            if self._snapshot() != board:
+                return
+            previous = self.game_state.status
+            status = self.game_state.step(action)
+            self.steps += 1
+        pygame.event.post(
+            pygame.event.Event(AUTOPLAY_STEP, action=action, previous=previous, status=status)
+        )
+
+    def _run(self) -> None:
+        next_step = time.perf_counter()
+        while not self.stopped.is_set():
+            if not self.autoplay.is_set():
+                self._serve_requests(IDLE_WAIT)
+                next_step = time.perf_counter()
+                continue
+            self._serve_requests(0)
+            if self.steps_per_second > 0:
+                delay = next_step - time.perf_counter()
+                if delay > 0:
+                    self._serve_requests(delay)
+                    continue
+                next_step = max(next_step, time.perf_counter() - 1.0) + 1.0 / self.steps_per_second
+            self._autoplay_step()